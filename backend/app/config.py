@@ -11,6 +11,9 @@ class Settings(BaseSettings):
     db_user: str = "app"
     db_password: str = "password"
     db_name: str = "appdb"
+    # Per-process connection pool; admission control sizes its class limits to fit it
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
 
     s3_endpoint: str = "http://minio:9000"
     s3_access_key: str = "minioadmin"
@@ -24,18 +27,118 @@ class Settings(BaseSettings):
     allowed_hosts: str = "*"  # comma-separated list or '*'
     max_request_bytes: int = 1048576  # 1 MiB default for JSON bodies
 
+    # Token-bucket rate limits as "requests/window_seconds"; rules add a stricter bucket per
+    # "METHOD /path". Keyed by client IP.
+    rate_limit_backend: str = "memory"  # memory (per process) | postgres (shared, migration 0015)
+    rate_limit_default: str = "120/60"
+    rate_limit_rules: str = "POST /v1/auth/login=10/60,POST /v1/auth/signup=5/60,POST /v1/receipts/upload=30/60"
+    rate_limit_memory_max_keys: int = 100000
+    # Reverse proxies in front of the API that append to X-Forwarded-For. 0 ignores the header
+    # (it is client-controlled); N keys on the address the outermost proxy saw
+    trusted_proxy_hops: int = 0
+
+    # Admission control (see app/utils/admission.py): max concurrency per route class, bounded
+    # wait queues, and the per-class latency target that drives adaptive limit decreases.
+    # Empty limits split the DB pool (pool size + overflow) between the classes; explicit limits
+    # are scaled down if together they exceed it
+    admission_enabled: bool = True
+    admission_limits: str = ""
+    admission_target_latency_ms: str = "auth=1000,analytics=2000,write=750,read=300"
+    admission_queue_size: int = 50
+    admission_queue_timeout_ms: int = 2000
+    admission_retry_after_seconds: int = 1
+
     cursor_secret: str = "dev-change-me"
+    session_hmac_secret: str = "dev-change-me"  # key for session token digests; rotating it logs everyone out
+    bcrypt_rounds: int = 12  # existing hashes are upgraded on the next successful login
+    # Bounded thread pool for bcrypt; calls beyond workers + queue are rejected with 503
+    hashing_executor_workers: int = 2
+    hashing_executor_queue: int = 64
+    # Outbound HTTP to third parties (see app/utils/http.py): bounded thread pool, pooled
+    # keep-alive sessions, and per-upstream read timeouts as "upstream=seconds,..."
+    outbound_executor_workers: int = 8
+    outbound_executor_queue: int = 128
+    outbound_connect_timeout_seconds: float = 3.05
+    outbound_read_timeout_seconds: float = 10.0
+    outbound_timeouts: str = "stripe=20,google=5,apple=5"
+    # S3/MinIO (see app/utils/storage.py): one shared client per process with a sized connection
+    # pool; network calls from async code run on the bounded "storage" executor
+    s3_max_pool_connections: int = 16
+    s3_connect_timeout_seconds: float = 3.05
+    s3_read_timeout_seconds: float = 30.0
+    s3_max_attempts: int = 3
+    storage_executor_workers: int = 16
+    storage_executor_queue: int = 256
+    # WebP receipt derivatives rendered by the worker (see app/utils/receipt_images.py); sizes are
+    # the longest edge in pixels. Their presigned URLs are reused for half their lifetime so
+    # clients can cache the images
+    receipt_thumbnail_px: int = 320
+    receipt_display_px: int = 1600
+    receipt_webp_quality: int = 75
+    receipt_image_url_expires_seconds: int = 3600
+    # Background dependency checks served by /readyz (see app/utils/health.py)
+    health_check_interval_seconds: float = 5.0
+    health_check_timeout_seconds: float = 2.0
+    # Authenticated principal cache (per process, invalidated via NOTIFY); TTL bounds staleness
+    principal_cache_size: int = 10000
+    principal_cache_ttl_seconds: int = 60
+    # Worker cleanup of expired/revoked sessions (see app/utils/session_maintenance.py)
+    session_retention_days: int = 7
+    session_purge_interval_seconds: int = 3600
+    session_purge_batch_size: int = 5000
+    session_purge_max_batches: int = 200  # per run; the rest waits for the next interval
+    session_partition_months_ahead: int = 2  # only used once sessions is partitioned
+    # Write-behind last_seen_at for sessions and push devices (see app/utils/activity.py)
+    activity_flush_seconds: float = 15.0
+    activity_buffer_max_entries: int = 50000  # flush early once this many are pending
 
     stripe_secret_key: str = ""
     stripe_webhook_secret: str = ""
     stripe_price_id: str = ""
 
     log_json: bool = True
+    # Buffered logger (app/utils/logger.py): queue bound, sampling of info records once the
+    # queue is this full (keep 1 in LOG_SAMPLE_RATE), and writer thread flush interval
+    log_queue_size: int = 10000
+    log_sample_above: float = 0.5
+    log_sample_rate: int = 10
+    log_flush_interval_ms: int = 200
+    # Span tracing (app/utils/tracing.py): JSON-lines export target ("" = off, "-" = stdout)
+    trace_export_path: str = ""
+    trace_sample_ratio: float = 1.0
+    trace_queue_size: int = 20000
+    # Event-loop health (app/utils/profiling.py): lag gauge sampling interval and the stall
+    # that makes the watchdog log the loop thread's stack
+    loop_lag_interval_ms: int = 500
+    loop_block_threshold_ms: int = 100
+    # Sampling profiler: GET /v1/admin/profile (API), SIGUSR2 -> PROFILE_OUTPUT_DIR (worker)
+    profile_max_seconds: int = 60
+    profile_interval_ms: int = 10
+    profile_signal_seconds: int = 30
+    profile_output_dir: str = "/tmp"
+    # Development/test aid: record every statement shape per request, flag shapes repeated at
+    # least `query_debug_repeat_threshold` times (likely N+1) in the log and X-Query-* headers
+    query_debug: bool = False
+    query_debug_repeat_threshold: int = 3
     upload_max_bytes: int = 10 * 1024 * 1024  # 10 MiB
     upload_allowed_mime: str = "image/jpeg,image/png,application/pdf"
 
+    # Merchant -> category memo (in-process LRU in front of the `merchants` table)
+    merchant_cache_size: int = 10000
+    merchant_cache_ttl_seconds: int = 300
+    user_override_cache_size: int = 5000  # users whose category corrections are kept in memory
+
+    # Trained category classifier (see app/utils/category_model.py); keyword fallback when empty
+    category_model_path: str = ""
+    category_model_min_confidence: float = 0.5
+
     google_client_ids: str = ""  # comma-separated
     apple_audience: str = ""  # bundle or service id
+    # Signing keys for social login tokens, cached per process (see app/utils/jwks.py)
+    google_jwks_url: str = "https://www.googleapis.com/oauth2/v3/certs"
+    apple_jwks_url: str = "https://appleid.apple.com/auth/keys"
+    jwks_default_ttl_seconds: int = 3600  # when the JWKS response has no Cache-Control max-age
+    jwks_min_refetch_seconds: int = 30  # floor between refetches triggered by unknown kids
     admin_secret: str = ""
 
     # Admin operations (rules management). If empty, write operations allowed only in dev.
@@ -1,7 +1,10 @@
-from typing import Any, Dict
+from typing import Any, Dict, Optional
 from fastapi import FastAPI, Request
 from fastapi.responses import JSONResponse
 from fastapi.exceptions import HTTPException
+from starlette.types import Scope
+
+from .utils.logger import get_request_id, log
 
 
 class AppError(Exception):
@@ -12,25 +15,50 @@ class AppError(Exception):
         self.status_code = status_code
 
 
-def _format_error(code: str, message: str, details: Dict[str, Any] = None) -> Dict[str, Any]:
-    return {"error": {"code": code, "message": message, "details": details or {}}}
+class RequestTooLarge(HTTPException):
+    """Raised while reading a request body that exceeds MAX_REQUEST_BYTES."""
+
+    error_code = "REQUEST_TOO_LARGE"
+
+    def __init__(self):
+        super().__init__(status_code=413, detail="Body too large")
+
+
+def _format_error(code: str, message: str, details: Dict[str, Any] = None, request_id: Optional[str] = None) -> Dict[str, Any]:
+    error = {"code": code, "message": message, "details": details or {}}
+    request_id = request_id or get_request_id()
+    if request_id is not None:
+        # Same id as the X-Request-Id header and the log lines, so support can find the request
+        error["request_id"] = request_id
+    return {"error": error}
+
+
+def error_response(scope: Scope, status_code: int, code: str, message: str, headers: Optional[Dict[str, str]] = None) -> JSONResponse:
+    """Error body for pure-ASGI middleware that answers before the exception handlers run."""
+    request_id = scope.get("state", {}).get("request_id")
+    return JSONResponse(status_code=status_code, content=_format_error(code, message, request_id=request_id), headers=headers)
 
 
 def register_error_handlers(app: FastAPI) -> None:
     @app.exception_handler(AppError)
     async def app_error_handler(_: Request, exc: AppError):
-        return JSONResponse(status_code=exc.status_code, content=_format_error(exc.code, exc.message, exc.details))
+        return JSONResponse(
+            status_code=exc.status_code,
+            content=_format_error(exc.code, exc.message, exc.details),
+            headers=getattr(exc, "headers", None),
+        )
 
     @app.exception_handler(HTTPException)
     async def http_error_handler(_: Request, exc: HTTPException):
         # Map to our shape
-        code = f"HTTP_{exc.status_code}"
+        code = getattr(exc, "error_code", None) or f"HTTP_{exc.status_code}"
         message = exc.detail if isinstance(exc.detail, str) else "HTTP error"
         return JSONResponse(status_code=exc.status_code, content=_format_error(code, message))
 
     @app.exception_handler(Exception)
-    async def unhandled_error_handler(_: Request, exc: Exception):
-        # Avoid leaking internals in production; log if needed
+    async def unhandled_error_handler(request: Request, exc: Exception):
+        # Avoid leaking internals in production; the traceback goes to the log under the request id
+        log.exception("unhandled error", exc, method=request.method, path=request.url.path)
         return JSONResponse(status_code=500, content=_format_error("INTERNAL_SERVER_ERROR", "An unexpected error occurred"))
 
 
@@ -1,15 +1,25 @@
-from fastapi import FastAPI, Request
+import asyncio
+
+from fastapi import FastAPI
 from fastapi.responses import ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 
 from .config import settings
 from .routers.v1 import router as v1_router
-from .routers.admin import router as admin_router
-from .utils.storage import ensure_bucket, s3_ready
-from .db import AsyncSessionLocal
-from sqlalchemy import text
+from .routers.admin import router as admin_router, ops_router
+from .utils.storage import close_client, ensure_bucket
+from .utils.principals import listen_for_invalidations
+from .utils.activity import activity
+from .utils.health import health
+from .utils.executors import shutdown_executors
+from .utils.http import close_sessions
+from .utils.logger import configure_logging, log
+from .utils.tracing import configure_tracing, shutdown_tracing
+from .utils.profiling import monitor_event_loop
 from .errors import register_error_handlers
-from .utils.observability import RequestIdMiddleware, MetricsMiddleware, RateLimiter, metrics_endpoint, JsonLoggingMiddleware
+from .utils.observability import EdgeMiddleware, metrics_endpoint
+from .utils.ratelimit import RateLimiter
+from .utils.admission import AdmissionController
 
 
 def create_app() -> FastAPI:
@@ -19,12 +29,10 @@ def create_app() -> FastAPI:
         version="0.1.0",
     )
 
-    # Observability & CORS
-    if settings.log_json:
-        app.add_middleware(JsonLoggingMiddleware)
-    app.add_middleware(RequestIdMiddleware)
-    app.add_middleware(MetricsMiddleware)
-    app.add_middleware(RateLimiter, requests=120, window_seconds=60)
+    # Admission control sheds load before the rate limiter can check out a pooled connection
+    # for the shared (Postgres) buckets
+    app.add_middleware(RateLimiter)
+    app.add_middleware(AdmissionController)
 
     # CORS
     if settings.cors_origin_list == ["*"]:
@@ -46,23 +54,8 @@ def create_app() -> FastAPI:
             max_age=600,
         )
 
-    # Basic security headers and request size guard
-    @app.middleware("http")
-    async def security_headers_and_size(request: Request, call_next):
-        # Size guard for incoming JSON bodies
-        content_length = request.headers.get("content-length")
-        if content_length and content_length.isdigit():
-            if int(content_length) > settings.max_request_bytes:
-                return ORJSONResponse({"error": {"code": "REQUEST_TOO_LARGE", "message": "Body too large", "details": {}}}, status_code=413)
-
-        response = await call_next(request)
-        # Security headers
-        response.headers.setdefault("X-Content-Type-Options", "nosniff")
-        response.headers.setdefault("X-Frame-Options", "DENY")
-        response.headers.setdefault("Referrer-Policy", "no-referrer")
-        response.headers.setdefault("Permissions-Policy", "camera=(), microphone=(), geolocation=()")
-        response.headers.setdefault("X-XSS-Protection", "0")
-        return response
+    # Outermost: request id, security headers, body size limit, metrics and access log in one pass
+    app.add_middleware(EdgeMiddleware)
 
     @app.get("/healthz")
     async def healthz():
@@ -70,18 +63,9 @@ def create_app() -> FastAPI:
 
     @app.get("/readyz")
     async def readyz():
-        # DB check
-        db_ok = False
-        try:
-            async with AsyncSessionLocal() as s:
-                await s.execute(text("SELECT 1"))
-                db_ok = True
-        except Exception:
-            db_ok = False
-        # S3 check
-        storage_ok = s3_ready()
-        ok = db_ok and storage_ok
-        return {"ready": ok, "db": db_ok, "storage": storage_ok}
+        # Last result of the background checks; probes never touch the database or S3
+        body = health.snapshot()
+        return ORJSONResponse(body, status_code=200 if body["ready"] else 503)
 
     @app.get("/metrics")
     async def metrics():
@@ -89,14 +73,34 @@ def create_app() -> FastAPI:
 
     app.include_router(v1_router)
     app.include_router(admin_router)
+    app.include_router(ops_router)
 
     @app.on_event("startup")
     async def _startup():
+        configure_logging()
+        configure_tracing()
         try:
             ensure_bucket()
         except Exception:
             # Non-fatal during local dev if MinIO not ready yet; compose dependency should cover it
             pass
+        app.state.background_stop = asyncio.Event()
+        app.state.background_tasks = [
+            asyncio.create_task(listen_for_invalidations(app.state.background_stop)),
+            asyncio.create_task(activity.run(app.state.background_stop)),
+            asyncio.create_task(monitor_event_loop(app.state.background_stop)),
+            asyncio.create_task(health.run(app.state.background_stop)),
+        ]
+
+    @app.on_event("shutdown")
+    async def _shutdown():
+        app.state.background_stop.set()
+        await asyncio.gather(*app.state.background_tasks, return_exceptions=True)
+        shutdown_executors()
+        close_sessions()
+        close_client()
+        shutdown_tracing()
+        log.stop()
 
     register_error_handlers(app)
 
@@ -1,13 +1,20 @@
-from fastapi import APIRouter, Depends, Header, HTTPException
-from pydantic import BaseModel
+import threading
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+from pydantic import BaseModel, Field
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text
 
 from ..config import settings
 from ..db import get_db
+from ..utils.profiling import ProfilerBusy, profile_for
+from ..utils.recategorize import enqueue_recategorization, simulate_rule, validate_merchant_pattern
 
 
 router = APIRouter(prefix="/v1/rules")
+ops_router = APIRouter(prefix="/v1/admin")
 
 
 def _check_admin(secret: str | None):
@@ -31,16 +38,42 @@ async def list_merchant_rules(db: AsyncSession = Depends(get_db)):
 @router.post("/merchant")
 async def create_merchant_rule(body: MerchantRule, x_admin_secret: str | None = Header(default=None), db: AsyncSession = Depends(get_db)):
     _check_admin(x_admin_secret)
-    await db.execute(
+    await validate_merchant_pattern(db, body.merchant_pattern)
+    res = await db.execute(
         text(
-            "INSERT INTO merchant_rules(merchant_pattern, category, confidence, active) VALUES (:p, :c, :conf, :a)"
+            "INSERT INTO merchant_rules(merchant_pattern, category, confidence, active) VALUES (:p, :c, :conf, :a) RETURNING id"
         ),
         {"p": body.merchant_pattern, "c": body.category, "conf": body.confidence, "a": body.active},
     )
+    if body.active:
+        await enqueue_recategorization(db, "merchant", res.scalar_one())
     await db.commit()
     return {"ok": True}
 
 
+class MerchantRuleSimulation(BaseModel):
+    merchant_pattern: str
+    category: str
+    confidence: float
+    sample_percent: Optional[float] = Field(default=None, gt=0, le=100)  # None scans the full table
+    time_budget_ms: int = Field(default=2000, ge=100, le=30000)
+    max_examples: int = Field(default=5, ge=0, le=50)
+
+
+@router.post("/merchant/simulate")
+async def simulate_merchant_rule(body: MerchantRuleSimulation, x_admin_secret: str | None = Header(default=None), db: AsyncSession = Depends(get_db)):
+    """Dry-run: how many transactions would this rule recategorize, and from which categories."""
+    _check_admin(x_admin_secret)
+    return await simulate_rule(
+        db,
+        "merchant",
+        {"merchant_pattern": body.merchant_pattern, "category": body.category, "confidence": body.confidence},
+        sample_percent=body.sample_percent,
+        time_budget_ms=body.time_budget_ms,
+        max_examples=body.max_examples,
+    )
+
+
 class KeywordRule(BaseModel):
     keyword: str
     scope: str = "both"
@@ -58,14 +91,54 @@ async def list_keyword_rules(db: AsyncSession = Depends(get_db)):
 @router.post("/keyword")
 async def create_keyword_rule(body: KeywordRule, x_admin_secret: str | None = Header(default=None), db: AsyncSession = Depends(get_db)):
     _check_admin(x_admin_secret)
-    await db.execute(
+    res = await db.execute(
         text(
-            "INSERT INTO keyword_rules(keyword, scope, category, confidence, active) VALUES (:k, :s, :c, :conf, :a)"
+            "INSERT INTO keyword_rules(keyword, scope, category, confidence, active) VALUES (:k, :s, :c, :conf, :a) RETURNING id"
         ),
         {"k": body.keyword, "s": body.scope, "c": body.category, "conf": body.confidence, "a": body.active},
     )
+    if body.active:
+        await enqueue_recategorization(db, "keyword", res.scalar_one())
     await db.commit()
     return {"ok": True}
 
 
+class KeywordRuleSimulation(BaseModel):
+    keyword: str
+    scope: str = "both"
+    category: str
+    confidence: float
+    sample_percent: Optional[float] = Field(default=None, gt=0, le=100)
+    time_budget_ms: int = Field(default=2000, ge=100, le=30000)
+    max_examples: int = Field(default=5, ge=0, le=50)
+
 
+@router.post("/keyword/simulate")
+async def simulate_keyword_rule(body: KeywordRuleSimulation, x_admin_secret: str | None = Header(default=None), db: AsyncSession = Depends(get_db)):
+    _check_admin(x_admin_secret)
+    return await simulate_rule(
+        db,
+        "keyword",
+        {"keyword": body.keyword, "scope": body.scope, "category": body.category, "confidence": body.confidence},
+        sample_percent=body.sample_percent,
+        time_budget_ms=body.time_budget_ms,
+        max_examples=body.max_examples,
+    )
+
+
+@ops_router.get("/profile", response_class=PlainTextResponse)
+async def profile(
+    seconds: float = Query(default=10, gt=0),
+    interval_ms: int = Query(default=settings.profile_interval_ms, ge=1, le=1000),
+    threads: str = Query(default="all", pattern="^(all|loop)$"),
+    x_admin_secret: str | None = Header(default=None),
+):
+    """Sample this process's stacks for `seconds` and return them as collapsed stacks
+    (flamegraph.pl / speedscope input). `threads=loop` samples only the event-loop thread."""
+    _check_admin(x_admin_secret)
+    thread_id = threading.get_ident() if threads == "loop" else None
+    try:
+        collapsed = await profile_for(min(seconds, settings.profile_max_seconds), interval_ms / 1000.0, thread_id)
+    except ProfilerBusy:
+        raise HTTPException(status_code=409, detail="A profile is already running")
+    return PlainTextResponse(collapsed)
@@ -2,28 +2,26 @@ from typing import Optional
 from fastapi import APIRouter, Depends, HTTPException, Header, Request, status
 from pydantic import BaseModel, EmailStr
 from sqlalchemy import text
-import stripe
 from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import date, timedelta
 
 from ..db import get_db
 from ..config import settings
-from ..utils.security import hash_password, verify_password, generate_session_token, session_expiry
-from ..utils.storage import presign_put, presign_get, head_object
+from ..utils.security import hash_password_async, verify_password_async, verify_session_secret_async, generate_session_token, session_expiry
+from ..utils.storage import presign_put, presign_get, presign_image, head_object_async
 from ..utils.cursor import encode_cursor, decode_cursor
-from ..utils.auth import get_current_user
+from ..utils.auth import get_current_principal, get_current_user
 from ..errors import AppError
-from ..utils.oauth import verify_google, verify_apple
+from ..utils.http import call_upstream, configure_stripe
 from ..utils.categorize import determine_category
+from ..utils.recategorize import enqueue_recategorization, validate_merchant_pattern
+from ..utils.merchants import record_user_override
+from ..utils.principals import invalidate_principal, is_premium
 from ..utils.badges import check_and_award_badges
-from ..utils.analytics import (
-    get_spending_trends,
-    detect_recurring_transactions,
-    get_spending_forecast,
-    get_spending_insights,
-    get_category_comparison,
-)
 from ..utils.budget_alerts import check_and_create_budget_alerts
+from ..utils.logger import get_request_id
+from ..utils.tracing import current_traceparent
+from ..utils.receipt_images import upload_keys
 
 
 router = APIRouter(prefix="/v1")
@@ -36,6 +34,8 @@ class SignupRequest(BaseModel):
 
 @router.post("/auth/signup")
 async def signup(payload: SignupRequest, db: AsyncSession = Depends(get_db)):
+    # Hash before touching the database so no connection is held while bcrypt runs
+    password_hash = await hash_password_async(payload.password)
     # Create user
     try:
         user_res = await db.execute(
@@ -59,7 +59,7 @@ async def signup(payload: SignupRequest, db: AsyncSession = Depends(get_db)):
             VALUES (:uid, 'email', :email, false, :ph)
             """
         ),
-        {"uid": user_id, "email": payload.email, "ph": hash_password(payload.password)},
+        {"uid": user_id, "email": payload.email, "ph": password_hash},
     )
 
     await db.execute(
@@ -88,7 +88,9 @@ class GoogleLogin(BaseModel):
 
 @router.post("/auth/google")
 async def auth_google(payload: GoogleLogin, request: Request, db: AsyncSession = Depends(get_db)):
-    info = verify_google(payload.id_token)
+    from ..utils.oauth import verify_google  # PyJWT and its crypto only load once someone signs in this way
+
+    info = await verify_google(payload.id_token)
     if not info:
         raise HTTPException(status_code=401, detail="Invalid Google token")
     email = info.get("email")
@@ -134,7 +136,9 @@ class AppleLogin(BaseModel):
 
 @router.post("/auth/apple")
 async def auth_apple(payload: AppleLogin, request: Request, db: AsyncSession = Depends(get_db)):
-    info = verify_apple(payload.identity_token)
+    from ..utils.oauth import verify_apple
+
+    info = await verify_apple(payload.identity_token)
     if not info:
         raise HTTPException(status_code=401, detail="Invalid Apple token")
     sub = info.get("sub")
@@ -191,8 +195,22 @@ async def login(payload: LoginRequest, request: Request, db: AsyncSession = Depe
         {"email": payload.email},
     )
     rec = row.mappings().first()
-    if not rec or not verify_password(payload.password, rec["password_hash"]):
+    if not rec:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
+    valid, upgraded_hash = await verify_password_async(payload.password, rec["password_hash"])
+    if not valid:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid credentials")
+    if upgraded_hash:
+        # Stored hash predates the current bcrypt cost; replace it while we have the plaintext
+        await db.execute(
+            text(
+                """
+                UPDATE identities SET password_hash = :new
+                WHERE user_id = :uid AND provider = 'email' AND password_hash = :old
+                """
+            ),
+            {"uid": rec["user_id"], "new": upgraded_hash, "old": rec["password_hash"]},
+        )
 
     secret, hashed = generate_session_token()
     res = await db.execute(
@@ -226,6 +244,7 @@ async def logout(authorization: Optional[str] = Header(default=None), db: AsyncS
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
     session_id = token.split(".", 1)[0]
     await db.execute(text("UPDATE sessions SET revoked_at = now() WHERE id = :sid"), {"sid": session_id})
+    await invalidate_principal(db, session_id=session_id)
     await db.commit()
     return {"ok": True}
 
@@ -233,6 +252,7 @@ async def logout(authorization: Optional[str] = Header(default=None), db: AsyncS
 @router.post("/auth/logout_all")
 async def logout_all(user=Depends(get_current_user), db: AsyncSession = Depends(get_db)):
     await db.execute(text("UPDATE sessions SET revoked_at = now() WHERE user_id = :uid AND revoked_at IS NULL"), {"uid": user["id"]})
+    await invalidate_principal(db, user_id=user["id"])
     await db.commit()
     return {"ok": True}
 
@@ -262,7 +282,7 @@ async def rotate_session(
         {"sid": session_id},
     )
     rec = row.mappings().first()
-    if not rec or not verify_password(secret, rec["refresh_token_hash"]):
+    if not rec or not (await verify_session_secret_async(secret, rec["refresh_token_hash"]))[0]:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid or expired token")
 
     # Create new session and revoke old
@@ -285,29 +305,18 @@ async def rotate_session(
     )
     new_session_id = new_row.scalar_one()
     await db.execute(text("UPDATE sessions SET revoked_at = now() WHERE id = :sid"), {"sid": session_id})
+    await invalidate_principal(db, session_id=session_id)
     await db.commit()
     return {"token": f"{new_session_id}.{new_secret}"}
 
 
 @router.get("/auth/me")
-async def me(user=Depends(get_current_user), db: AsyncSession = Depends(get_db)):
-    sub = await db.execute(
-        text("SELECT plan, status FROM subscriptions WHERE user_id = :uid"),
-        {"uid": user["id"]},
-    )
-    s = sub.mappings().first()
-    
-    # Get profile
-    profile_res = await db.execute(
-        text("SELECT * FROM profiles WHERE user_id = :uid"),
-        {"uid": user["id"]},
-    )
-    profile = profile_res.mappings().first()
-    
+async def me(principal=Depends(get_current_principal)):
+    # Subscription and profile come with the cached principal
     return {
-        "user": user,
-        "subscription": dict(s) if s else None,
-        "profile": dict(profile) if profile else None,
+        "user": dict(principal["user"]),
+        "subscription": principal["subscription"],
+        "profile": principal["profile"],
     }
 
 
@@ -359,6 +368,7 @@ async def profile_update(body: ProfileUpdate, user=Depends(get_current_user), db
         text(f"UPDATE profiles SET {', '.join(updates)} WHERE user_id = :uid"),
         params,
     )
+    await invalidate_principal(db, user_id=user["id"])
     await db.commit()
     return {"updated": True}
 
@@ -382,9 +392,10 @@ async def receipts_upload(body: ReceiptCreate, user=Depends(get_current_user), d
         {"uid": user["id"]},
     )
     rid = rec.scalar_one()
-    object_key = f"receipts/{user['id']}/{rid}.jpg"
+    jpg_key, pdf_key = upload_keys(user["id"], rid)
+    object_key = jpg_key
     if body.mime and body.mime.lower() == 'application/pdf':
-        object_key = f"receipts/{user['id']}/{rid}.pdf"
+        object_key = pdf_key
     url = presign_put(object_key, content_type=body.mime)
     await db.commit()
     return {"receipt_id": str(rid), "upload_url": url, "object_key": object_key}
@@ -399,8 +410,12 @@ class ReceiptConfirm(BaseModel):
 
 @router.post("/receipts/confirm")
 async def receipts_confirm(body: ReceiptConfirm, user=Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    # Only the key issued for this receipt: anything else could point OCR and the derivatives at
+    # another user's objects
+    if body.object_key not in upload_keys(user["id"], body.receipt_id):
+        raise AppError(code="INVALID_OBJECT_KEY", message="object_key does not belong to this receipt", status_code=400)
     # Validate object exists and matches constraints
-    meta = head_object(body.object_key)
+    meta = await head_object_async(body.object_key)
     size = meta.get('ContentLength') or 0
     if size > settings.upload_max_bytes:
         raise AppError(code="FILE_TOO_LARGE", message="Uploaded file too large", details={"max_bytes": settings.upload_max_bytes}, status_code=413)
@@ -408,18 +423,23 @@ async def receipts_confirm(body: ReceiptConfirm, user=Depends(get_current_user),
     if settings.allowed_mime_list and mime not in settings.allowed_mime_list:
         raise AppError(code="UNSUPPORTED_MEDIA_TYPE", message="Invalid content type", details={"allowed": settings.allowed_mime_list}, status_code=415)
 
-    await db.execute(
+    updated = await db.execute(
         text(
             "UPDATE receipts SET storage_uri = :uri, ocr_status = 'pending' WHERE id = :rid AND user_id = :uid"
         ),
         {"uri": body.object_key, "rid": body.receipt_id, "uid": user["id"]},
     )
+    if updated.rowcount == 0:
+        raise HTTPException(status_code=404, detail="Not found")
     # Enqueue OCR job bookkeeping
     await db.execute(
         text(
-            "INSERT INTO receipt_processing_jobs(receipt_id, status) VALUES (:rid, 'pending')"
+            """
+            INSERT INTO receipt_processing_jobs(receipt_id, status, request_id, traceparent)
+            VALUES (:rid, 'pending', :req, :tp)
+            """
         ),
-        {"rid": body.receipt_id},
+        {"rid": body.receipt_id, "req": get_request_id(), "tp": current_traceparent()},
     )
     await db.commit()
     
@@ -441,8 +461,12 @@ async def receipts_get(receipt_id: str, user=Depends(get_current_user), db: Asyn
     data = dict(rec)
     # Add presigned URL for viewing the receipt image if storage_uri exists and is not 'pending'
     if data.get("storage_uri") and data.get("storage_uri") != "pending":
-        from ..utils.storage import presign_get
         data["image_url"] = presign_get(data["storage_uri"])
+    # WebP derivatives written by the worker after OCR; clients should prefer these over the original
+    if data.get("thumbnail_uri"):
+        data["thumbnail_url"] = presign_image(data["thumbnail_uri"])
+    if data.get("display_uri"):
+        data["display_url"] = presign_image(data["display_uri"])
     return data
 
 
@@ -458,18 +482,22 @@ async def transactions_list(
 ):
     limit = max(1, min(limit, 200))
     cur = decode_cursor(cursor)
+    # Receipt thumbnails ride along with the page (one join, no per-row lookups)
+    base = (
+        "SELECT t.*, r.thumbnail_uri AS receipt_thumbnail_uri FROM transactions t"
+        " LEFT JOIN receipts r ON r.id = t.receipt_id WHERE t.user_id = :uid"
+    )
     if cur:
-        base = "SELECT * FROM transactions WHERE user_id = :uid"
         filters = []
         if from_date:
-            filters.append("txn_date >= :from_date")
+            filters.append("t.txn_date >= :from_date")
         if to_date:
-            filters.append("txn_date <= :to_date")
+            filters.append("t.txn_date <= :to_date")
         if category:
-            filters.append("category = :category")
-        filters.append("(txn_date, created_at, id) < (:cd, :cc, :cid)")
+            filters.append("t.category = :category")
+        filters.append("(t.txn_date, t.created_at, t.id) < (:cd, :cc, :cid)")
         where = " AND ".join(filters)
-        sql = f"{base} AND {where} ORDER BY txn_date DESC, created_at DESC, id DESC LIMIT :lim"
+        sql = f"{base} AND {where} ORDER BY t.txn_date DESC, t.created_at DESC, t.id DESC LIMIT :lim"
         q = text(sql)
         params = {"uid": user["id"], "cd": cur.get("txn_date"), "cc": cur.get("created_at"), "cid": cur.get("id"), "lim": limit + 1}
         if from_date:
@@ -479,18 +507,17 @@ async def transactions_list(
         if category:
             params["category"] = category
     else:
-        base = "SELECT * FROM transactions WHERE user_id = :uid"
         filters = []
         if from_date:
-            filters.append("txn_date >= :from_date")
+            filters.append("t.txn_date >= :from_date")
         if to_date:
-            filters.append("txn_date <= :to_date")
+            filters.append("t.txn_date <= :to_date")
         if category:
-            filters.append("category = :category")
+            filters.append("t.category = :category")
         where = (" AND ".join(filters))
         if where:
             base = f"{base} AND {where}"
-        sql = f"{base} ORDER BY txn_date DESC, created_at DESC, id DESC LIMIT :lim"
+        sql = f"{base} ORDER BY t.txn_date DESC, t.created_at DESC, t.id DESC LIMIT :lim"
         q = text(sql)
         params = {"uid": user["id"], "lim": limit + 1}
         if from_date:
@@ -509,6 +536,10 @@ async def transactions_list(
             {"txn_date": last["txn_date"], "created_at": last["created_at"], "id": last["id"]}
         )
         rows = rows[:limit]
+    for r in rows:
+        thumb = r.pop("receipt_thumbnail_uri", None)
+        if thumb:
+            r["receipt_thumbnail_url"] = presign_image(thumb)
     return {"items": rows, "next_cursor": next_cursor}
 
 
@@ -562,26 +593,19 @@ class TransactionManual(BaseModel):
 
 
 @router.post("/transactions/manual")
-async def transactions_manual(body: TransactionManual, user=Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+async def transactions_manual(body: TransactionManual, principal=Depends(get_current_principal), db: AsyncSession = Depends(get_db)):
+    user = principal["user"]
     # Premium gating example: require active premium to create manual transactions
-    sub = await db.execute(text("SELECT plan, status FROM subscriptions WHERE user_id=:uid"), {"uid": user["id"]})
-    s = sub.mappings().first()
-    if not s or s.get("plan") != "premium" or s.get("status") != "active":
+    if not is_premium(principal):
         raise HTTPException(status_code=402, detail="Premium required")
-    # Premium gating: allow manual transactions for premium users only (bypass in dev)
-    if settings.env != "dev":
-        subrow = await db.execute(text("SELECT plan, status FROM subscriptions WHERE user_id = :uid"), {"uid": user["id"]})
-        sub = subrow.mappings().first()
-        if not sub or sub.get("plan") != "premium" or sub.get("status") != "active":
-            raise HTTPException(status_code=402, detail="Premium required for manual transactions")
     # Determine category using rules if not provided
-    auto_category = await determine_category(db, merchant=body.merchant, raw_text=None)
+    auto_category = await determine_category(db, merchant=body.merchant, raw_text=None, user_id=user["id"])
 
     res = await db.execute(
         text(
             """
-            INSERT INTO transactions(user_id, merchant, txn_date, total_cents, tax_cents, tip_cents, currency_code, category, subcategory, source)
-            VALUES (:uid, :m, :d, :t, :tax, :tip, :cur, :cat, :sub, 'manual')
+            INSERT INTO transactions(user_id, merchant, txn_date, total_cents, tax_cents, tip_cents, currency_code, category, subcategory, source, category_edited_at)
+            VALUES (:uid, :m, :d, :t, :tax, :tip, :cur, :cat, :sub, 'manual', CASE WHEN CAST(:user_chose AS boolean) THEN now() END)
             RETURNING id
             """
         ),
@@ -595,6 +619,8 @@ async def transactions_manual(body: TransactionManual, user=Depends(get_current_
             "cur": body.currency_code,
             "cat": body.category or auto_category,
             "sub": body.subcategory,
+            # An explicitly chosen category is the user's, like a PATCH edit: rule backfills leave it alone
+            "user_chose": "category" in body.model_fields_set and bool(body.category),
         },
     )
     tid = res.scalar_one()
@@ -653,6 +679,7 @@ async def list_merchant_rules(db: AsyncSession = Depends(get_db)):
 @router.post("/rules/merchant")
 async def create_merchant_rule(payload: MerchantRuleCreate, request: Request, db: AsyncSession = Depends(get_db)):
     _assert_admin(request)
+    await validate_merchant_pattern(db, payload.merchant_pattern)
     row = await db.execute(
         text(
             """
@@ -664,6 +691,9 @@ async def create_merchant_rule(payload: MerchantRuleCreate, request: Request, db
         {"p": payload.merchant_pattern, "c": payload.category, "conf": payload.confidence, "a": payload.active},
     )
     rid = row.scalar_one()
+    # Existing transactions keep stale categories until the worker re-evaluates them
+    if payload.active:
+        await enqueue_recategorization(db, "merchant", rid)
     await db.commit()
     return {"id": str(rid)}
 
@@ -688,6 +718,8 @@ async def create_keyword_rule(payload: KeywordRuleCreate, request: Request, db:
         {"k": payload.keyword, "s": payload.scope, "c": payload.category, "conf": payload.confidence, "a": payload.active},
     )
     rid = row.scalar_one()
+    if payload.active:
+        await enqueue_recategorization(db, "keyword", rid)
     await db.commit()
     return {"id": str(rid)}
 
@@ -703,8 +735,15 @@ async def transactions_update(txn_id: str, body: TransactionPatch, user=Depends(
             params[field] = val
     if not sets:
         return {"id": txn_id, "updated": False}
-    q = text(f"UPDATE transactions SET {', '.join(sets)} WHERE id = :id AND user_id = :uid")
-    await db.execute(q, params)
+    if body.category is not None:
+        # Pin user-chosen categories so bulk recategorization leaves them alone
+        sets.append("category_edited_at = now()")
+    q = text(f"UPDATE transactions SET {', '.join(sets)} WHERE id = :id AND user_id = :uid RETURNING merchant")
+    res = await db.execute(q, params)
+    row = res.first()
+    if row and body.category is not None:
+        # Learn the correction so this merchant is categorized the user's way next time
+        await record_user_override(db, user["id"], row[0], body.category)
     await db.commit()
     return {"id": txn_id, "updated": True}
 
@@ -832,22 +871,20 @@ class ExportCSV(BaseModel):
 
 
 @router.post("/export/csv")
-async def export_csv(body: ExportCSV, user=Depends(get_current_user), db: AsyncSession = Depends(get_db)):
-    sub = await db.execute(text("SELECT plan, status FROM subscriptions WHERE user_id=:uid"), {"uid": user["id"]})
-    s = sub.mappings().first()
-    if not s or s.get("plan") != "premium" or s.get("status") != "active":
+async def export_csv(body: ExportCSV, principal=Depends(get_current_principal), db: AsyncSession = Depends(get_db)):
+    user = principal["user"]
+    # Premium gating: CSV exports require premium
+    if not is_premium(principal):
         raise HTTPException(status_code=402, detail="Premium required")
-    # Premium gating: CSV exports require premium (bypass in dev)
-    if settings.env != "dev":
-        subrow = await db.execute(text("SELECT plan, status FROM subscriptions WHERE user_id = :uid"), {"uid": user["id"]})
-        sub = subrow.mappings().first()
-        if not sub or sub.get("plan") != "premium" or sub.get("status") != "active":
-            raise HTTPException(status_code=402, detail="Premium required for CSV export")
     res = await db.execute(
         text(
-            "INSERT INTO export_jobs(user_id, from_date, to_date) VALUES (:uid, :fd, :td) RETURNING id"
+            """
+            INSERT INTO export_jobs(user_id, from_date, to_date, request_id, traceparent)
+            VALUES (:uid, :fd, :td, :req, :tp)
+            RETURNING id
+            """
         ),
-        {"uid": user["id"], "fd": body.from_date, "td": body.to_date},
+        {"uid": user["id"], "fd": body.from_date, "td": body.to_date, "req": get_request_id(), "tp": current_traceparent()},
     )
     jid = res.scalar_one()
     await db.commit()
@@ -889,8 +926,13 @@ async def subscription_get(user=Depends(get_current_user), db: AsyncSession = De
 async def subscription_checkout(user=Depends(get_current_user)):
     if not settings.stripe_secret_key or not settings.stripe_price_id:
         raise HTTPException(status_code=501, detail="Stripe not configured")
+    import stripe  # ~1s of import time; only billing endpoints need it
+
     stripe.api_key = settings.stripe_secret_key
-    session = stripe.checkout.Session.create(
+    configure_stripe()
+    session = await call_upstream(
+        "stripe",
+        stripe.checkout.Session.create,
         mode="subscription",
         line_items=[{"price": settings.stripe_price_id, "quantity": 1}],
         metadata={"user_id": str(user["id"] )},
@@ -900,12 +942,20 @@ async def subscription_checkout(user=Depends(get_current_user)):
     return {"checkout_url": session.url}
 
 
+async def _invalidate_subscribers(db: AsyncSession, res) -> None:
+    # Cached principals carry the plan; drop them for every subscription the webhook touched
+    for uid in res.scalars().all():
+        await invalidate_principal(db, user_id=uid)
+
+
 @router.post("/subscription/webhook")
 async def subscription_webhook(request: Request, db: AsyncSession = Depends(get_db)):
     payload = await request.body()
     sig = request.headers.get("stripe-signature")
     if not settings.stripe_webhook_secret:
         raise HTTPException(status_code=501, detail="Stripe webhook not configured")
+    import stripe
+
     try:
         event = stripe.Webhook.construct_event(payload, sig, settings.stripe_webhook_secret)
     except Exception:
@@ -932,16 +982,18 @@ async def subscription_webhook(request: Request, db: AsyncSession = Depends(get_
         customer_id = obj.get("customer")
         subscription_id = obj.get("subscription")
         if uid and subscription_id:
-            await db.execute(
+            res = await db.execute(
                 text(
                     """
                     UPDATE subscriptions
                     SET plan='premium', status='active', stripe_customer_id=:cust, stripe_subscription_id=:sub
                     WHERE user_id = :uid
+                    RETURNING user_id
                     """
                 ),
                 {"uid": uid, "cust": customer_id, "sub": subscription_id},
             )
+            await _invalidate_subscribers(db, res)
             await db.commit()
     # Handle subscription updates and billing events
     if et in ("customer.subscription.updated", "customer.subscription.deleted", "customer.subscription.created"):
@@ -949,35 +1001,39 @@ async def subscription_webhook(request: Request, db: AsyncSession = Depends(get_
         status_val = obj.get("status") or "canceled"
         cpe = obj.get("current_period_end")
         cancel_at_period_end = bool(obj.get("cancel_at_period_end"))
-        await db.execute(
+        res = await db.execute(
             text(
                 """
                 UPDATE subscriptions
                 SET status=:status, current_period_end = to_timestamp(:cpe), cancel_at_period_end=:cpef
                 WHERE stripe_subscription_id=:sub
+                RETURNING user_id
                 """
             ),
             {"status": status_val, "cpe": cpe or 0, "cpef": cancel_at_period_end, "sub": sub_id},
         )
+        await _invalidate_subscribers(db, res)
         await db.commit()
 
     if et == "invoice.payment_succeeded":
         # ensure user stays active; find user via customer
         cust = obj.get("customer")
         if cust:
-            await db.execute(
-                text("UPDATE subscriptions SET status='active' WHERE stripe_customer_id=:cust"),
+            res = await db.execute(
+                text("UPDATE subscriptions SET status='active' WHERE stripe_customer_id=:cust RETURNING user_id"),
                 {"cust": cust},
             )
+            await _invalidate_subscribers(db, res)
             await db.commit()
 
     if et in ("invoice.payment_failed", "customer.subscription.paused"):
         cust = obj.get("customer")
         if cust:
-            await db.execute(
-                text("UPDATE subscriptions SET status='past_due' WHERE stripe_customer_id=:cust"),
+            res = await db.execute(
+                text("UPDATE subscriptions SET status='past_due' WHERE stripe_customer_id=:cust RETURNING user_id"),
                 {"cust": cust},
             )
+            await _invalidate_subscribers(db, res)
             await db.commit()
 
     return {"ok": True}
@@ -986,7 +1042,10 @@ async def subscription_webhook(request: Request, db: AsyncSession = Depends(get_
 @router.delete("/account")
 async def account_delete(user=Depends(get_current_user), db: AsyncSession = Depends(get_db)):
     # Best-effort S3 cleanup scheduled along with deletion job
-    await db.execute(text("INSERT INTO deletion_jobs(user_id) VALUES (:uid)"), {"uid": user["id"]})
+    await db.execute(
+        text("INSERT INTO deletion_jobs(user_id, request_id) VALUES (:uid, :req)"),
+        {"uid": user["id"], "req": get_request_id()},
+    )
     await db.commit()
     return {"scheduled": True}
 
@@ -1030,25 +1089,27 @@ async def savings_goals_create(body: SavingsGoalCreate, user=Depends(get_current
 
 @router.get("/savings/goals")
 async def savings_goals_list(user=Depends(get_current_user), db: AsyncSession = Depends(get_db), status: Optional[str] = None):
-    if status:
-        res = await db.execute(
-            text("SELECT * FROM savings_goals WHERE user_id = :uid AND status = :status ORDER BY created_at DESC"),
-            {"uid": user["id"], "status": status},
-        )
-    else:
-        res = await db.execute(
-            text("SELECT * FROM savings_goals WHERE user_id = :uid ORDER BY created_at DESC"),
-            {"uid": user["id"]},
-        )
+    # Contribution totals are aggregated in the same query (one statement regardless of goal count)
+    status_filter = "AND g.status = :status" if status else ""
+    res = await db.execute(
+        text(
+            f"""
+            SELECT g.*, c.total AS _contributed_cents
+            FROM savings_goals g
+            LEFT JOIN LATERAL (
+                SELECT COALESCE(SUM(amount_cents), 0) AS total FROM savings_contributions WHERE goal_id = g.id
+            ) c ON true
+            WHERE g.user_id = :uid {status_filter}
+            ORDER BY g.created_at DESC
+            """
+        ),
+        {"uid": user["id"], "status": status} if status else {"uid": user["id"]},
+    )
     goals = []
     for row in res.mappings().all():
         goal = dict(row)
         # Calculate progress
-        contrib_res = await db.execute(
-            text("SELECT COALESCE(SUM(amount_cents), 0) as total FROM savings_contributions WHERE goal_id = :gid"),
-            {"gid": goal["id"]},
-        )
-        contributed = contrib_res.scalar_one() or 0
+        contributed = goal.pop("_contributed_cents") or 0
         goal["contributed_cents"] = contributed
         goal["progress_percent"] = min(100, int((contributed / goal["target_cents"]) * 100)) if goal["target_cents"] > 0 else 0
         goals.append(goal)
@@ -1222,35 +1283,36 @@ async def linked_accounts_create(body: LinkedAccountCreate, user=Depends(get_cur
 
 @router.get("/linked-accounts")
 async def linked_accounts_list(user=Depends(get_current_user), db: AsyncSession = Depends(get_db), status: Optional[str] = None):
-    if status:
-        res = await db.execute(
-            text("SELECT * FROM linked_accounts WHERE user_id = :uid AND status = :status ORDER BY created_at DESC"),
-            {"uid": user["id"], "status": status},
-        )
-    else:
-        res = await db.execute(
-            text("SELECT * FROM linked_accounts WHERE user_id = :uid ORDER BY created_at DESC"),
-            {"uid": user["id"]},
-        )
-    accounts = []
-    for row in res.mappings().all():
-        account = dict(row)
-        # Get latest balance
-        balance_res = await db.execute(
-            text(
-                """
+    # Latest balance per account joined in (one statement regardless of account count)
+    status_filter = "AND a.status = :status" if status else ""
+    res = await db.execute(
+        text(
+            f"""
+            SELECT a.*,
+                   b.current_cents AS _balance_current_cents,
+                   b.available_cents AS _balance_available_cents,
+                   b.currency_code AS _balance_currency_code,
+                   b.as_of AS _balance_as_of
+            FROM linked_accounts a
+            LEFT JOIN LATERAL (
                 SELECT current_cents, available_cents, currency_code, as_of
                 FROM account_balances
-                WHERE linked_account_id = :aid
+                WHERE linked_account_id = a.id
                 ORDER BY as_of DESC
                 LIMIT 1
-                """
-            ),
-            {"aid": account["id"]},
-        )
-        balance = balance_res.mappings().first()
-        if balance:
-            account["balance"] = dict(balance)
+            ) b ON true
+            WHERE a.user_id = :uid {status_filter}
+            ORDER BY a.created_at DESC
+            """
+        ),
+        {"uid": user["id"], "status": status} if status else {"uid": user["id"]},
+    )
+    accounts = []
+    for row in res.mappings().all():
+        account = dict(row)
+        balance = {k: account.pop(f"_balance_{k}") for k in ("current_cents", "available_cents", "currency_code", "as_of")}
+        if balance["as_of"] is not None:
+            account["balance"] = balance
         accounts.append(account)
     return {"items": accounts}
 
@@ -1406,6 +1468,8 @@ async def analytics_trends(user=Depends(get_current_user), db: AsyncSession = De
     """Get month-over-month spending trends."""
     if months < 1 or months > 24:
         raise HTTPException(status_code=400, detail="Months must be between 1 and 24")
+    from ..utils.analytics import get_spending_trends
+
     return await get_spending_trends(db, user["id"], months)
 
 
@@ -1414,18 +1478,24 @@ async def analytics_forecast(user=Depends(get_current_user), db: AsyncSession =
     """Forecast spending for next N months."""
     if months_ahead < 1 or months_ahead > 12:
         raise HTTPException(status_code=400, detail="Months ahead must be between 1 and 12")
+    from ..utils.analytics import get_spending_forecast
+
     return await get_spending_forecast(db, user["id"], months_ahead)
 
 
 @router.get("/analytics/insights")
 async def analytics_insights(user=Depends(get_current_user), db: AsyncSession = Depends(get_db)):
     """Get actionable spending insights and recommendations."""
+    from ..utils.analytics import get_spending_insights
+
     return await get_spending_insights(db, user["id"])
 
 
 @router.get("/analytics/recurring")
 async def analytics_recurring(user=Depends(get_current_user), db: AsyncSession = Depends(get_db)):
     """Detect recurring transactions."""
+    from ..utils.analytics import detect_recurring_transactions
+
     return {"recurring": await detect_recurring_transactions(db, user["id"])}
 
 
@@ -1456,6 +1526,8 @@ async def analytics_compare(
         p2_start = date.fromisoformat(period2_start or "")
         p2_end = date.fromisoformat(period2_end or "")
     
+    from ..utils.analytics import get_category_comparison
+
     return await get_category_comparison(db, user["id"], p1_start, p1_end, p2_start, p2_end)
 
 
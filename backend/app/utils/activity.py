@@ -0,0 +1,116 @@
+"""
+Write-behind buffer for last-activity timestamps of sessions and push devices.
+
+Authenticated requests only record "seen now" in memory; a background task flushes the
+latest timestamp per session/device every `activity_flush_seconds` with one set-based
+UPDATE per table, so activity tracking costs no extra query per request.
+"""
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Dict, Tuple
+
+from prometheus_client import Counter
+from sqlalchemy import text
+
+from ..config import settings
+from ..db import AsyncSessionLocal
+
+
+ACTIVITY_FLUSHED = Counter("activity_rows_flushed_total", "Last-seen timestamps written by the activity buffer", ["table"])
+
+logger = logging.getLogger("activity")
+
+
+class ActivityBuffer:
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._sessions: Dict[str, datetime] = {}
+        # (user_id, push token) -> last seen
+        self._devices: Dict[Tuple[str, str], datetime] = {}
+        self._full = asyncio.Event()
+
+    def __len__(self) -> int:
+        return len(self._sessions) + len(self._devices)
+
+    def touch_session(self, session_id: str) -> None:
+        self._sessions[session_id] = datetime.now(timezone.utc)
+        if len(self) >= self.max_entries:
+            self._full.set()
+
+    def touch_device(self, user_id, token: str) -> None:
+        self._devices[(str(user_id), token)] = datetime.now(timezone.utc)
+        if len(self) >= self.max_entries:
+            self._full.set()
+
+    def _restore(self, sessions: Dict[str, datetime], devices: Dict[Tuple[str, str], datetime]) -> None:
+        # Put back entries from a failed flush unless a newer touch replaced them; while the
+        # database is unreachable the buffer stays capped and the oldest activity is dropped
+        for key, seen in sessions.items():
+            if len(self) >= self.max_entries:
+                return
+            self._sessions.setdefault(key, seen)
+        for key, seen in devices.items():
+            if len(self) >= self.max_entries:
+                return
+            self._devices.setdefault(key, seen)
+
+    async def flush(self) -> None:
+        sessions, self._sessions = self._sessions, {}
+        devices, self._devices = self._devices, {}
+        self._full.clear()
+        if not sessions and not devices:
+            return
+        try:
+            async with AsyncSessionLocal() as db:
+                if sessions:
+                    await db.execute(
+                        text(
+                            """
+                            UPDATE sessions s
+                            SET last_seen_at = v.seen
+                            FROM unnest(CAST(:ids AS uuid[]), CAST(:seen AS timestamptz[])) AS v(id, seen)
+                            WHERE s.id = v.id
+                              AND (s.last_seen_at IS NULL OR s.last_seen_at < v.seen)
+                            """
+                        ),
+                        {"ids": list(sessions.keys()), "seen": list(sessions.values())},
+                    )
+                if devices:
+                    await db.execute(
+                        text(
+                            """
+                            UPDATE push_devices d
+                            SET last_seen_at = v.seen
+                            FROM unnest(CAST(:uids AS uuid[]), CAST(:tokens AS text[]), CAST(:seen AS timestamptz[]))
+                                 AS v(user_id, token, seen)
+                            WHERE d.user_id = v.user_id AND d.token = v.token AND d.is_active
+                              AND (d.last_seen_at IS NULL OR d.last_seen_at < v.seen)
+                            """
+                        ),
+                        {
+                            "uids": [k[0] for k in devices],
+                            "tokens": [k[1] for k in devices],
+                            "seen": list(devices.values()),
+                        },
+                    )
+                await db.commit()
+        except Exception as e:
+            logger.warning("activity flush failed: %s", e)
+            self._restore(sessions, devices)
+            return
+        ACTIVITY_FLUSHED.labels(table="sessions").inc(len(sessions))
+        ACTIVITY_FLUSHED.labels(table="push_devices").inc(len(devices))
+
+    async def run(self, stop: asyncio.Event) -> None:
+        """Flush every `activity_flush_seconds`, early when the buffer fills, and once more on stop."""
+        while not stop.is_set():
+            full = asyncio.create_task(self._full.wait())
+            stopping = asyncio.create_task(stop.wait())
+            await asyncio.wait([full, stopping], timeout=settings.activity_flush_seconds, return_when=asyncio.FIRST_COMPLETED)
+            full.cancel()
+            stopping.cancel()
+            await self.flush()
+
+
+activity = ActivityBuffer(max_entries=settings.activity_buffer_max_entries)
@@ -0,0 +1,192 @@
+"""
+Adaptive admission control: per-route-class concurrency limits in front of the handlers.
+
+Requests are classified (auth, analytics, write, read; health endpoints are exempt) and each
+class admits up to its current limit concurrently, queueing a bounded number of others for
+at most `admission_queue_timeout_ms`. Anything beyond that gets 503 + Retry-After at once
+instead of piling onto the database pool; together the class ceilings never exceed the pool
+(size + overflow). Limits adapt AIMD-style: a completion slower
+than the class's target latency cuts the limit by 10% (at most once per target interval),
+fast completions grow it back towards the configured ceiling.
+"""
+import asyncio
+import time
+from collections import deque
+from typing import Deque, Dict, Optional
+
+from prometheus_client import Counter, Gauge, Histogram
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from ..config import settings
+from ..errors import error_response
+
+
+# Limits are per API process; under gunicorn each live worker is reported with a pid label
+ADMISSION_LIMIT = Gauge("admission_limit", "Current concurrency limit per route class", ["route_class"], multiprocess_mode="liveall")
+ADMISSION_INFLIGHT = Gauge("admission_inflight", "Requests executing per route class", ["route_class"], multiprocess_mode="livesum")
+ADMISSION_QUEUE_WAIT = Histogram(
+    "admission_queue_wait_seconds",
+    "Time admitted requests waited for a slot",
+    ["route_class"],
+    buckets=(0.001, 0.005, 0.025, 0.1, 0.25, 0.5, 1, 2, 5),
+)
+ADMISSION_REJECTED = Counter("admission_rejected_total", "Requests shed by admission control", ["route_class", "reason"])
+
+# The profiler holds its request open for seconds by design; it must not skew class limits
+EXEMPT_PATHS = {"/healthz", "/readyz", "/metrics", "/v1/admin/profile"}
+AUTH_PATHS = {"/v1/auth/login", "/v1/auth/signup", "/v1/auth/rotate", "/v1/auth/google", "/v1/auth/apple"}
+ANALYTICS_PREFIXES = ("/v1/analytics/", "/v1/dashboard/", "/v1/export/", "/v1/transactions/search")
+
+DECREASE_FACTOR = 0.9
+
+
+class Rejected(Exception):
+    def __init__(self, reason: str):
+        self.reason = reason
+
+
+def classify(method: str, path: str) -> Optional[str]:
+    """Route class for a request, or None when it bypasses admission control."""
+    if path in EXEMPT_PATHS:
+        return None
+    if path in AUTH_PATHS:
+        return "auth"
+    if path.startswith(ANALYTICS_PREFIXES):
+        return "analytics"
+    if method in ("GET", "HEAD", "OPTIONS"):
+        return "read"
+    return "write"
+
+
+def _parse_map(spec: str) -> Dict[str, float]:
+    out: Dict[str, float] = {}
+    for entry in spec.split(","):
+        name, _, value = entry.partition("=")
+        if name.strip() and value.strip():
+            out[name.strip()] = float(value)
+    return out
+
+
+# Relative share of the database pool per route class when ADMISSION_LIMITS is not set
+CLASS_SHARES = {"auth": 2.0, "analytics": 1.0, "write": 4.0, "read": 8.0}
+
+
+def class_limits(spec: str, capacity: int) -> Dict[str, int]:
+    """Max concurrency per route class, never admitting more requests in total than `capacity`
+    (the DB pool) can serve: `spec` as configured, scaled down if it overcommits the pool, or
+    the pool split by CLASS_SHARES when `spec` is empty."""
+    configured = _parse_map(spec)
+    wanted = {name: configured.get(name, share) for name, share in CLASS_SHARES.items()}
+    total = sum(wanted.values())
+    scale = capacity / total if not configured or total > capacity else 1.0
+    return {name: max(1, int(value * scale)) for name, value in wanted.items()}
+
+
+class AdaptiveLimit:
+    def __init__(self, name: str, max_limit: int, max_queue: int, queue_timeout: float, target_latency: float):
+        self.name = name
+        self.max_limit = max(1, int(max_limit))
+        self.limit = float(self.max_limit)
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.target_latency = target_latency
+        self.inflight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._last_decrease = 0.0
+        ADMISSION_LIMIT.labels(route_class=name).set(self.limit)
+
+    def _has_slot(self) -> bool:
+        return self.inflight < int(self.limit)
+
+    async def acquire(self) -> None:
+        if self._has_slot() and not self._waiters:
+            self.inflight += 1
+            ADMISSION_INFLIGHT.labels(route_class=self.name).set(self.inflight)
+            return
+        if len(self._waiters) >= self.max_queue:
+            raise Rejected("queue_full")
+        started = time.monotonic()
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.append(fut)
+        try:
+            await asyncio.wait_for(fut, timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            raise Rejected("queue_timeout")
+        except asyncio.CancelledError:
+            # Client went away; hand back a slot that was already transferred to us
+            if fut.done() and not fut.cancelled():
+                self._release_slot()
+            raise
+        finally:
+            if not fut.done():
+                fut.cancel()
+            try:
+                self._waiters.remove(fut)
+            except ValueError:
+                pass
+        ADMISSION_QUEUE_WAIT.labels(route_class=self.name).observe(time.monotonic() - started)
+
+    def _release_slot(self) -> None:
+        # Transfer the slot straight to the oldest live waiter while under the limit
+        while self._waiters and self.inflight <= int(self.limit):
+            fut = self._waiters.popleft()
+            if not fut.done():
+                fut.set_result(None)
+                return
+        self.inflight -= 1
+        ADMISSION_INFLIGHT.labels(route_class=self.name).set(self.inflight)
+
+    def release(self, latency: float) -> None:
+        now = time.monotonic()
+        if latency > self.target_latency:
+            if now - self._last_decrease >= self.target_latency:
+                self.limit = max(1.0, self.limit * DECREASE_FACTOR)
+                self._last_decrease = now
+        else:
+            self.limit = min(float(self.max_limit), self.limit + 1.0 / self.limit)
+        ADMISSION_LIMIT.labels(route_class=self.name).set(self.limit)
+        self._release_slot()
+
+
+class AdmissionController:
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        limits = class_limits(settings.admission_limits, settings.db_pool_size + settings.db_max_overflow)
+        targets = _parse_map(settings.admission_target_latency_ms)
+        self.classes: Dict[str, AdaptiveLimit] = {
+            name: AdaptiveLimit(
+                name,
+                max_limit=limits[name],
+                max_queue=settings.admission_queue_size,
+                queue_timeout=settings.admission_queue_timeout_ms / 1000.0,
+                target_latency=targets.get(name, 1000.0) / 1000.0,
+            )
+            for name in CLASS_SHARES
+        }
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or not settings.admission_enabled:
+            await self.app(scope, receive, send)
+            return
+        route_class = classify(scope.get("method", "").upper(), scope.get("path", ""))
+        if route_class is None:
+            await self.app(scope, receive, send)
+            return
+
+        limiter = self.classes[route_class]
+        try:
+            await limiter.acquire()
+        except Rejected as e:
+            ADMISSION_REJECTED.labels(route_class=route_class, reason=e.reason).inc()
+            response = error_response(
+                scope, 503, "OVERLOADED", "Server busy, retry shortly",
+                headers={"Retry-After": str(settings.admission_retry_after_seconds)},
+            )
+            await response(scope, receive, send)
+            return
+
+        started = time.monotonic()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release(time.monotonic() - started)
@@ -1,10 +1,13 @@
-from typing import Optional, Tuple
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional, Tuple
 from fastapi import Depends, Header, HTTPException, status
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text
 
 from ..db import get_db
-from .security import verify_password
+from .activity import activity
+from .principals import cache_principal, get_cached_principal, load_principal
+from .security import hash_session_secret, verify_session_secret, verify_session_secret_async
 
 
 async def _parse_bearer(auth_header: Optional[str]) -> Tuple[str, str]:
@@ -17,34 +20,53 @@ async def _parse_bearer(auth_header: Optional[str]) -> Tuple[str, str]:
     return session_id, secret
 
 
-async def get_current_user(
+def _record_activity(session_id: str, principal: Dict[str, Any], push_token: Optional[str]) -> None:
+    activity.touch_session(session_id)
+    if push_token:
+        activity.touch_device(principal["user_id"], push_token)
+
+
+async def get_current_principal(
     authorization: Optional[str] = Header(default=None),
+    x_push_token: Optional[str] = Header(default=None),
     db: AsyncSession = Depends(get_db),
-):
+) -> Dict[str, Any]:
+    """Resolved user, subscription and profile for the bearer token.
+
+    Served from the per-process principal cache when possible; the token secret is still
+    checked against the stored digest on every request. Records session (and, with an
+    X-Push-Token header, push device) activity in the write-behind buffer.
+    """
     session_id, secret = await _parse_bearer(authorization)
-    q = text(
-        """
-        SELECT s.id, s.user_id, s.refresh_token_hash
-        FROM sessions s
-        WHERE s.id = :sid AND s.revoked_at IS NULL AND s.expires_at > now()
-        """
-    )
-    res = await db.execute(q, {"sid": session_id})
-    row = res.mappings().first()
-    if not row:
+    principal = get_cached_principal(session_id)
+    if principal is not None:
+        if principal["expires_at"] <= datetime.now(timezone.utc):
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid or expired token")
+        if not verify_session_secret(secret, principal["refresh_token_hash"])[0]:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token secret")
+        _record_activity(session_id, principal, x_push_token)
+        return principal
+
+    principal = await load_principal(db, session_id)
+    if not principal:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid or expired token")
-    if not verify_password(secret, row["refresh_token_hash"]):
+    valid, needs_upgrade = await verify_session_secret_async(secret, principal["refresh_token_hash"])
+    if not valid:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token secret")
-
-    u = await db.execute(
-        text(
-            "SELECT id, email, created_at FROM users WHERE id = :uid AND deleted_at IS NULL"
-        ),
-        {"uid": row["user_id"]},
-    )
-    user = u.mappings().first()
-    if not user:
-        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found")
-    return dict(user)
+    if needs_upgrade:
+        # Legacy bcrypt session: swap in the fast digest so this is the only slow check
+        new_hash = hash_session_secret(secret)
+        await db.execute(
+            text("UPDATE sessions SET refresh_token_hash = :new WHERE id = :sid AND refresh_token_hash = :old"),
+            {"sid": session_id, "new": new_hash, "old": principal["refresh_token_hash"]},
+        )
+        await db.commit()
+        principal["refresh_token_hash"] = new_hash
+    cache_principal(session_id, principal)
+    _record_activity(session_id, principal, x_push_token)
+    return principal
 
 
+async def get_current_user(principal: Dict[str, Any] = Depends(get_current_principal)):
+    # Copy: the principal is shared across requests through the cache
+    return dict(principal["user"])
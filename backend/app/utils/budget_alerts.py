@@ -8,7 +8,7 @@ from datetime import date
 
 async def check_and_create_budget_alerts(db: AsyncSession, user_id: str):
     """Check budgets and create alerts if thresholds are exceeded."""
-    # Get active budgets for current period
+    # Get active budgets for current period, with spend and whether an alert is already open
     res = await db.execute(
         text(
             """
@@ -18,7 +18,14 @@ async def check_and_create_budget_alerts(db: AsyncSession, user_id: str):
                 b.limit_cents,
                 b.period_start,
                 b.period_end,
-                COALESCE(SUM(t.total_cents), 0) as spent_cents
+                COALESCE(SUM(t.total_cents), 0) as spent_cents,
+                EXISTS (
+                    SELECT 1 FROM budget_alerts a
+                    WHERE a.user_id = b.user_id
+                      AND a.budget_id = b.id
+                      AND a.status = 'active'
+                      AND a.alert_type IN ('budget_warning', 'budget_exceeded')
+                ) AS has_alert
             FROM budgets b
             LEFT JOIN transactions t ON t.user_id = b.user_id 
               AND t.category = b.category
@@ -32,65 +39,62 @@ async def check_and_create_budget_alerts(db: AsyncSession, user_id: str):
         {"uid": user_id},
     )
     
+    alerts = []
     for row in res.mappings().all():
-        budget_id = row["id"]
+        if row["has_alert"]:
+            continue
         category = row["category"]
         limit_cents = row["limit_cents"]
         spent_cents = row["spent_cents"] or 0
         pct_used = (spent_cents / limit_cents * 100) if limit_cents > 0 else 0
         
-        # Check if alert already exists
-        existing_res = await db.execute(
+        # Create warning alert at 90%
+        if pct_used >= 90 and pct_used < 100:
+            alerts.append((
+                row["id"],
+                "budget_warning",
+                category,
+                f"You've used {pct_used:.1f}% of your {category} budget",
+                int(limit_cents * 0.9),
+                spent_cents,
+            ))
+        
+        # Create exceeded alert at 100%
+        elif pct_used >= 100:
+            alerts.append((
+                row["id"],
+                "budget_exceeded",
+                category,
+                f"You've exceeded your {category} budget by ${(spent_cents - limit_cents)/100:.2f}",
+                limit_cents,
+                spent_cents,
+            ))
+    
+    if alerts:
+        await db.execute(
             text(
                 """
-                SELECT id FROM budget_alerts
-                WHERE user_id = :uid
-                  AND budget_id = :bid
-                  AND status = 'active'
-                  AND alert_type IN ('budget_warning', 'budget_exceeded')
+                INSERT INTO budget_alerts(user_id, alert_type, budget_id, category, message, threshold_cents, current_cents, status)
+                SELECT :uid, v.alert_type, v.budget_id, v.category, v.message, v.threshold, v.current, 'active'
+                FROM unnest(
+                    CAST(:bids AS uuid[]),
+                    CAST(:types AS alert_type[]),
+                    CAST(:cats AS category[]),
+                    CAST(:msgs AS text[]),
+                    CAST(:thresholds AS integer[]),
+                    CAST(:currents AS integer[])
+                ) AS v(budget_id, alert_type, category, message, threshold, current)
                 """
             ),
-            {"uid": user_id, "bid": budget_id},
+            {
+                "uid": user_id,
+                "bids": [a[0] for a in alerts],
+                "types": [a[1] for a in alerts],
+                "cats": [a[2] for a in alerts],
+                "msgs": [a[3] for a in alerts],
+                "thresholds": [a[4] for a in alerts],
+                "currents": [a[5] for a in alerts],
+            },
         )
-        existing = existing_res.first()
-        
-        # Create warning alert at 90%
-        if pct_used >= 90 and pct_used < 100 and not existing:
-            await db.execute(
-                text(
-                    """
-                    INSERT INTO budget_alerts(user_id, alert_type, budget_id, category, message, threshold_cents, current_cents, status)
-                    VALUES (:uid, 'budget_warning', :bid, :cat, :msg, :threshold, :current, 'active')
-                    """
-                ),
-                {
-                    "uid": user_id,
-                    "bid": budget_id,
-                    "cat": category,
-                    "msg": f"You've used {pct_used:.1f}% of your {category} budget",
-                    "threshold": int(limit_cents * 0.9),
-                    "current": spent_cents,
-                },
-            )
-        
-        # Create exceeded alert at 100%
-        elif pct_used >= 100 and not existing:
-            await db.execute(
-                text(
-                    """
-                    INSERT INTO budget_alerts(user_id, alert_type, budget_id, category, message, threshold_cents, current_cents, status)
-                    VALUES (:uid, 'budget_exceeded', :bid, :cat, :msg, :threshold, :current, 'active')
-                    """
-                ),
-                {
-                    "uid": user_id,
-                    "bid": budget_id,
-                    "cat": category,
-                    "msg": f"You've exceeded your {category} budget by ${(spent_cents - limit_cents)/100:.2f}",
-                    "threshold": limit_cents,
-                    "current": spent_cents,
-                },
-            )
     
     await db.commit()
-
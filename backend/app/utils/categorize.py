@@ -1,15 +1,43 @@
 from __future__ import annotations
 
 import re
-from typing import Optional, Tuple
+from typing import Dict, List, Optional, Pattern, Tuple
 
 from sqlalchemy import text
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from ..config import settings
+from .category_model import get_model
+from .merchants import (
+    MEMO_MIN_CONFIDENCE,
+    get_user_overrides,
+    lookup_merchant_category,
+    normalize_merchant,
+    remember_merchant_category,
+)
 
-async def _match_merchant_category(db: AsyncSession, merchant: Optional[str]) -> Optional[Tuple[str, float]]:
-    if not merchant:
-        return None
+
+# (compiled regex or None when the pattern is not a valid regex, lowercase pattern, category, confidence)
+MerchantRule = Tuple[Optional[Pattern[str]], str, str, float]
+# (lowercase keyword, scope, category, confidence)
+KeywordRule = Tuple[str, str, str, float]
+
+
+def compile_merchant_rule(pattern: str, category: str, confidence) -> MerchantRule:
+    try:
+        compiled: Optional[Pattern[str]] = re.compile(pattern, flags=re.IGNORECASE)
+    except re.error:
+        compiled = None
+    conf = float(confidence) if confidence is not None else 0.0
+    return (compiled, pattern.lower(), category, conf)
+
+
+def compile_keyword_rule(keyword: str, scope: Optional[str], category: str, confidence) -> KeywordRule:
+    conf = float(confidence) if confidence is not None else 0.0
+    return (keyword.lower(), scope or "both", category, conf)
+
+
+async def _load_merchant_rules(db: AsyncSession) -> List[MerchantRule]:
     res = await db.execute(
         text(
             """
@@ -19,29 +47,16 @@ async def _match_merchant_category(db: AsyncSession, merchant: Optional[str]) ->
             """
         )
     )
-    best: Optional[Tuple[str, float]] = None
-    lower_name = merchant.lower()
+    rules: List[MerchantRule] = []
     for row in res.mappings().all():
         pattern = row["merchant_pattern"] or ""
-        cat = row["category"]
-        conf = float(row["confidence"]) if row["confidence"] is not None else 0.0
-        matched = False
-        try:
-            if pattern:
-                if re.search(pattern, merchant, flags=re.IGNORECASE):
-                    matched = True
-        except Exception:
-            if pattern and pattern.lower() in lower_name:
-                matched = True
-        if matched:
-            if best is None or conf > best[1]:
-                best = (cat, conf)
-    return best
+        if not pattern:
+            continue
+        rules.append(compile_merchant_rule(pattern, row["category"], row["confidence"]))
+    return rules
 
 
-async def _match_keyword_category(db: AsyncSession, text_blob: Optional[str], scope: str = "both") -> Optional[Tuple[str, float]]:
-    if not text_blob:
-        return None
+async def _load_keyword_rules(db: AsyncSession) -> List[KeywordRule]:
     res = await db.execute(
         text(
             """
@@ -51,16 +66,48 @@ async def _match_keyword_category(db: AsyncSession, text_blob: Optional[str], sc
             """
         )
     )
+    rules: List[KeywordRule] = []
+    for row in res.mappings().all():
+        kw = row["keyword"] or ""
+        if not kw:
+            continue
+        rules.append(compile_keyword_rule(kw, row["scope"], row["category"], row["confidence"]))
+    return rules
+
+
+async def load_rules(db: AsyncSession) -> Dict[str, list]:
+    """Load active merchant and keyword rules once so they can be applied to many transactions."""
+    return {
+        "merchant": await _load_merchant_rules(db),
+        "keyword": await _load_keyword_rules(db),
+    }
+
+
+def _match_merchant_category(rules: List[MerchantRule], merchant: Optional[str]) -> Optional[Tuple[str, float]]:
+    if not merchant:
+        return None
+    best: Optional[Tuple[str, float]] = None
+    lower_name = merchant.lower()
+    for compiled, pattern, cat, conf in rules:
+        if compiled is not None:
+            matched = compiled.search(merchant) is not None
+        else:
+            matched = pattern in lower_name
+        if matched:
+            if best is None or conf > best[1]:
+                best = (cat, conf)
+    return best
+
+
+def _match_keyword_category(rules: List[KeywordRule], text_blob: Optional[str], scope: str = "both") -> Optional[Tuple[str, float]]:
+    if not text_blob:
+        return None
     best: Optional[Tuple[str, float]] = None
     lower_blob = text_blob.lower()
-    for row in res.mappings().all():
-        kw = (row["keyword"] or "").lower()
-        rule_scope = row["scope"] or "both"
+    for kw, rule_scope, cat, conf in rules:
         if rule_scope not in ("both", scope):
             continue
-        if kw and kw in lower_blob:
-            cat = row["category"]
-            conf = float(row["confidence"]) if row["confidence"] is not None else 0.0
+        if kw in lower_blob:
             if best is None or conf > best[1]:
                 best = (cat, conf)
     return best
@@ -81,17 +128,17 @@ ML_CATEGORY_KEYWORDS = {
 }
 
 
-def _ml_categorize_fallback(merchant: Optional[str], raw_text: Optional[str]) -> Optional[str]:
-    """Simple ML fallback using keyword matching when rules don't match."""
+def _keyword_categorize_fallback(merchant: Optional[str], raw_text: Optional[str]) -> Optional[str]:
+    """Keyword-count fallback used when no trained model is configured."""
     search_text = ""
     if merchant:
         search_text += merchant.lower() + " "
     if raw_text:
         search_text += raw_text.lower()
-    
+
     if not search_text:
         return None
-    
+
     # Score categories based on keyword matches
     scores = {}
     for category, keywords in ML_CATEGORY_KEYWORDS.items():
@@ -101,50 +148,131 @@ def _ml_categorize_fallback(merchant: Optional[str], raw_text: Optional[str]) ->
                 score += 1
         if score > 0:
             scores[category] = score
-    
+
     if scores:
         # Return category with highest score
         return max(scores.items(), key=lambda x: x[1])[0]
-    
+
     return None
 
 
-async def determine_category(
-    db: AsyncSession,
-    merchant: Optional[str] = None,
-    raw_text: Optional[str] = None,
-) -> str:
-    """
-    Return category using rules first, then ML fallback, default to 'other'.
-    
-    Priority:
-    1. Merchant rules (confidence >= 0.8)
-    2. Keyword rules (confidence >= 0.8)
-    3. ML keyword matching fallback
-    4. 'other'
+def _ml_scored_batch(items: List[Tuple[Optional[str], Optional[str]]]) -> List[Tuple[Optional[str], Optional[float]]]:
+    """ML fallback: trained classifier when available, keyword counts otherwise.
+
+    (category, probability) per item; the category is None below the model's confidence
+    threshold, and the probability is None for the keyword-count fallback.
     """
+    model = get_model()
+    if model is None:
+        return [(_keyword_categorize_fallback(m, t), None) for m, t in items]
+    preds = model.predict_batch([m for m, _ in items], [t for _, t in items])
+    return [(cat if cat and prob >= settings.category_model_min_confidence else None, prob) for cat, prob in preds]
+
+
+def _ml_categorize_batch(items: List[Tuple[Optional[str], Optional[str]]]) -> List[Optional[str]]:
+    return [cat for cat, _ in _ml_scored_batch(items)]
+
+
+def _ml_categorize_fallback(merchant: Optional[str], raw_text: Optional[str]) -> Optional[str]:
+    return _ml_categorize_batch([(merchant, raw_text)])[0]
+
+
+def _best_rule_match(rules: Dict[str, list], merchant: Optional[str], raw_text: Optional[str]) -> Tuple[Optional[str], float]:
     best_cat: Optional[str] = None
     best_conf: float = -1.0
 
     # Try merchant rules
-    m = await _match_merchant_category(db, merchant)
+    m = _match_merchant_category(rules["merchant"], merchant)
     if m and m[1] > best_conf:
         best_cat, best_conf = m
 
     # Try keyword rules
-    k = await _match_keyword_category(db, raw_text, scope="both")
+    k = _match_keyword_category(rules["keyword"], raw_text, scope="both")
     if k and k[1] > best_conf:
         best_cat, best_conf = k
+    return best_cat, best_conf
 
-    # If we have a high-confidence rule match, use it
-    if best_conf >= 0.8:
-        return best_cat or "other"
-    
-    # Otherwise, try ML fallback
-    ml_cat = _ml_categorize_fallback(merchant, raw_text)
-    if ml_cat:
-        return ml_cat
 
-    return best_cat or "other"
+def categorize_batch_scored(
+    rules: Dict[str, list], items: List[Tuple[Optional[str], Optional[str]]]
+) -> List[Tuple[str, float, str]]:
+    """(category, confidence, source) for each (merchant, raw_text) pair.
 
+    A merchant rule at or above MEMO_MIN_CONFIDENCE decides the category outright, ahead of
+    keyword rules, because that is the verdict the merchant memo serves for every transaction of
+    the merchant; otherwise the most confident rule at or above 0.8 wins. Rows without one go
+    through the ML fallback in one batch, so backfills pay for one vectorized model call per
+    batch rather than one per row. `source` is "merchant_rule", "keyword_rule", "model",
+    "keywords" (keyword-count fallback), "weak_rule" or "default".
+    """
+    results: List[Optional[Tuple[str, float, str]]] = [None] * len(items)
+    pending: List[Tuple[int, Optional[str], float]] = []
+    for i, (merchant, raw_text) in enumerate(items):
+        m = _match_merchant_category(rules["merchant"], merchant)
+        if m and m[1] >= MEMO_MIN_CONFIDENCE:
+            results[i] = (m[0], m[1], "merchant_rule")
+            continue
+        best_cat, best_conf = _best_rule_match(rules, merchant, raw_text)
+        # If we have a high-confidence rule match, use it
+        if best_conf >= 0.8:
+            results[i] = (best_cat or "other", best_conf, "keyword_rule")
+        else:
+            pending.append((i, best_cat, best_conf))
+
+    if pending:
+        # Otherwise, try ML fallback
+        ml_preds = _ml_scored_batch([items[i] for i, _, _ in pending])
+        for (i, best_cat, best_conf), (ml_cat, prob) in zip(pending, ml_preds):
+            if ml_cat:
+                results[i] = (ml_cat, prob, "model") if prob is not None else (ml_cat, 0.0, "keywords")
+            elif best_cat:
+                results[i] = (best_cat, best_conf, "weak_rule")
+            else:
+                results[i] = ("other", 0.0, "default")
+    return results
+
+
+def categorize_batch(rules: Dict[str, list], items: List[Tuple[Optional[str], Optional[str]]]) -> List[str]:
+    """Categorize (merchant, raw_text) pairs against rules preloaded with `load_rules`."""
+    return [category for category, _, _ in categorize_batch_scored(rules, items)]
+
+
+def categorize(rules: Dict[str, list], merchant: Optional[str] = None, raw_text: Optional[str] = None) -> str:
+    """Categorize a single transaction against rules preloaded with `load_rules`."""
+    return categorize_batch(rules, [(merchant, raw_text)])[0]
+
+
+async def determine_category(
+    db: AsyncSession,
+    merchant: Optional[str] = None,
+    raw_text: Optional[str] = None,
+    user_id=None,
+) -> str:
+    """
+    Return category using rules first, then ML fallback, default to 'other'.
+
+    Priority:
+    1. The user's own correction for this merchant (when user_id is given)
+    2. Merchant memo for the normalized merchant name: a verdict previously reached in steps 3
+       or 5, served without loading rules
+    3. Merchant rules (confidence >= 0.8)
+    4. Keyword rules (confidence >= 0.8)
+    5. ML fallback (trained classifier if configured, else keyword matching)
+    6. 'other'
+    """
+    normalized = normalize_merchant(merchant)
+    if normalized and user_id is not None:
+        override = (await get_user_overrides(db, user_id)).get(normalized)
+        if override:
+            return override
+    if normalized:
+        memo = await lookup_merchant_category(db, normalized)
+        if memo:
+            return memo[0]
 
+    rules = await load_rules(db)
+    category, confidence, source = categorize_batch_scored(rules, [(merchant, raw_text)])[0]
+    if normalized and source in ("merchant_rule", "model"):
+        # Keyword-rule verdicts depend on this transaction's text, not the merchant, so they are not memoized
+        await remember_merchant_category(db, normalized, category, confidence)
+    return category
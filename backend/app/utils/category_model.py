@@ -0,0 +1,255 @@
+"""
+Multinomial naive-Bayes category classifier over hashed n-gram features.
+
+Trained offline on user-confirmed transaction categories and used by `determine_category`
+as the ML fallback when no rule matches with high confidence.
+
+    python -m app.utils.category_model train --out models/category_nb.npz
+    python -m app.utils.category_model bench --model models/category_nb.npz
+"""
+import argparse
+import asyncio
+import csv
+import re
+import sys
+import time
+import zlib
+from itertools import chain
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from prometheus_client import Counter
+
+from ..config import settings
+from .logger import log
+from .merchants import normalize_merchant
+
+
+DEFAULT_N_FEATURES = 1 << 16
+MAX_TEXT_TOKENS = 200
+
+MODEL_LOAD_FAILURES = Counter("category_model_load_failures_total", "Configured category model files that could not be loaded")
+
+_TOKEN_RE = re.compile(r"[a-z][a-z0-9]+")
+
+
+def extract_features(merchant: Optional[str], raw_text: Optional[str]) -> List[str]:
+    """Namespaced n-grams: merchant words, bigrams and char trigrams, plus OCR text words and bigrams."""
+    feats: List[str] = []
+    words = (normalize_merchant(merchant) or "").split()
+    for w in words:
+        feats.append("m:" + w)
+        padded = f" {w} "
+        feats.extend("c:" + padded[i:i + 3] for i in range(len(padded) - 2))
+    feats.extend(f"mb:{a}_{b}" for a, b in zip(words, words[1:]))
+    if raw_text:
+        tokens = _TOKEN_RE.findall(raw_text.lower())[:MAX_TEXT_TOKENS]
+        feats.extend("t:" + t for t in tokens)
+        feats.extend(f"tb:{a}_{b}" for a, b in zip(tokens, tokens[1:]))
+    return feats
+
+
+def hash_features(feats: Iterable[str], n_features: int) -> List[int]:
+    # crc32 rather than hash(): stable across processes and Python versions
+    mask = n_features - 1
+    return [zlib.crc32(f.encode("utf-8")) & mask for f in feats]
+
+
+class CategoryModel:
+    def __init__(self, classes: Sequence[str], class_log_prior: np.ndarray, feature_log_prob: np.ndarray):
+        self.classes = list(classes)
+        self.class_log_prior = class_log_prior.astype(np.float32)
+        # (n_features, n_classes) so a row gather yields per-feature class scores
+        self.feature_log_prob = feature_log_prob.astype(np.float32)
+        self.n_features = self.feature_log_prob.shape[0]
+
+    @classmethod
+    def fit(cls, merchants: Sequence[Optional[str]], texts: Sequence[Optional[str]], labels: Sequence[str],
+            n_features: int = DEFAULT_N_FEATURES, alpha: float = 1.0) -> "CategoryModel":
+        if n_features <= 0 or n_features & (n_features - 1):
+            raise ValueError("n_features must be a power of two")
+        classes = sorted(set(labels))
+        class_index = {c: i for i, c in enumerate(classes)}
+        n_classes = len(classes)
+        idx_lists = [hash_features(extract_features(m, t), n_features) for m, t in zip(merchants, texts)]
+        lengths = np.fromiter((len(x) for x in idx_lists), dtype=np.int64, count=len(idx_lists))
+        flat_idx = np.fromiter(chain.from_iterable(idx_lists), dtype=np.int64, count=int(lengths.sum()))
+        label_ids = np.fromiter((class_index[l] for l in labels), dtype=np.int64, count=len(labels))
+        flat_labels = np.repeat(label_ids, lengths)
+        counts = np.bincount(flat_idx * n_classes + flat_labels, minlength=n_features * n_classes)
+        counts = counts.reshape(n_features, n_classes).astype(np.float64)
+        smoothed = counts + alpha
+        feature_log_prob = np.log(smoothed) - np.log(smoothed.sum(axis=0, keepdims=True))
+        class_counts = np.bincount(label_ids, minlength=n_classes).astype(np.float64)
+        class_log_prior = np.log(class_counts) - np.log(class_counts.sum())
+        return cls(classes, class_log_prior, feature_log_prob)
+
+    def predict_batch(self, merchants: Sequence[Optional[str]], texts: Sequence[Optional[str]]) -> List[Tuple[Optional[str], float]]:
+        """(category, probability) per row; rows with no usable features get (None, 0.0)."""
+        n = len(merchants)
+        if n == 0:
+            return []
+        idx_lists = [hash_features(extract_features(m, t), self.n_features) for m, t in zip(merchants, texts)]
+        lengths = np.fromiter((len(x) for x in idx_lists), dtype=np.int64, count=n)
+        flat_idx = np.fromiter(chain.from_iterable(idx_lists), dtype=np.int64, count=int(lengths.sum()))
+        nonempty = lengths > 0
+        sums = np.zeros((n, len(self.classes)), dtype=np.float32)
+        if flat_idx.size:
+            offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+            sums[nonempty] = np.add.reduceat(self.feature_log_prob[flat_idx], offsets[nonempty], axis=0)
+        scores = sums + self.class_log_prior
+        scores -= scores.max(axis=1, keepdims=True)
+        probs = np.exp(scores)
+        probs /= probs.sum(axis=1, keepdims=True)
+        best = probs.argmax(axis=1)
+        best_prob = probs[np.arange(n), best]
+        return [
+            (self.classes[b], float(p)) if ok else (None, 0.0)
+            for b, p, ok in zip(best.tolist(), best_prob.tolist(), nonempty.tolist())
+        ]
+
+    def predict(self, merchant: Optional[str], raw_text: Optional[str]) -> Tuple[Optional[str], float]:
+        return self.predict_batch([merchant], [raw_text])[0]
+
+    def save(self, path: str) -> None:
+        np.savez_compressed(
+            path,
+            classes=np.array(self.classes),
+            class_log_prior=self.class_log_prior,
+            feature_log_prob=self.feature_log_prob,
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "CategoryModel":
+        with np.load(path, allow_pickle=False) as data:
+            return cls([str(c) for c in data["classes"]], data["class_log_prior"], data["feature_log_prob"])
+
+
+_model: Optional[CategoryModel] = None
+_model_loaded = False
+
+
+def get_model() -> Optional[CategoryModel]:
+    """Process-wide model, loaded on first use. None when not configured or unreadable; a
+    configured model that fails to load is logged and counted, and keyword scoring takes over."""
+    global _model, _model_loaded
+    if not _model_loaded:
+        _model_loaded = True
+        if settings.category_model_path:
+            try:
+                _model = CategoryModel.load(settings.category_model_path)
+            except Exception as e:
+                MODEL_LOAD_FAILURES.inc()
+                log.exception("category model failed to load", e, path=settings.category_model_path)
+                _model = None
+    return _model
+
+
+# -----------------
+# Training / benchmark CLI
+# -----------------
+
+async def _load_confirmed_from_db(limit: Optional[int]) -> List[Tuple[Optional[str], Optional[str], str]]:
+    from sqlalchemy import text
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    engine = create_async_engine(settings.database_url, echo=False)
+    sql = """
+        SELECT merchant, raw_text ->> 'ocr' AS ocr_text, category::text AS category
+        FROM transactions
+        WHERE category_edited_at IS NOT NULL
+           OR (source = 'manual' AND category <> 'other')
+        ORDER BY created_at DESC
+    """
+    params = {}
+    if limit:
+        sql += " LIMIT :lim"
+        params["lim"] = limit
+    try:
+        async with engine.connect() as conn:
+            res = await conn.execute(text(sql), params)
+            return [(r["merchant"], r["ocr_text"], r["category"]) for r in res.mappings().all()]
+    finally:
+        await engine.dispose()
+
+
+def _load_confirmed_from_csv(path: str) -> List[Tuple[Optional[str], Optional[str], str]]:
+    with open(path, newline="", encoding="utf-8") as f:
+        return [(r.get("merchant") or None, r.get("text") or None, r["category"]) for r in csv.DictReader(f)]
+
+
+def _load_rows(args) -> List[Tuple[Optional[str], Optional[str], str]]:
+    if args.csv:
+        return _load_confirmed_from_csv(args.csv)
+    return asyncio.run(_load_confirmed_from_db(args.limit))
+
+
+def _split(rows, holdout: float, seed: int = 7):
+    order = np.random.default_rng(seed).permutation(len(rows))
+    cut = int(len(rows) * (1 - holdout))
+    return [rows[i] for i in order[:cut]], [rows[i] for i in order[cut:]]
+
+
+def _cmd_train(args) -> int:
+    rows = _load_rows(args)
+    if not rows:
+        print("no user-confirmed transactions to train on", file=sys.stderr)
+        return 1
+    train, test = _split(rows, args.holdout) if args.holdout else (rows, [])
+    started = time.perf_counter()
+    model = CategoryModel.fit([r[0] for r in train], [r[1] for r in train], [r[2] for r in train], n_features=args.n_features)
+    print(f"trained on {len(train)} rows, {len(model.classes)} classes in {time.perf_counter() - started:.2f}s")
+    if test:
+        preds = model.predict_batch([r[0] for r in test], [r[1] for r in test])
+        acc = sum(p[0] == r[2] for p, r in zip(preds, test)) / len(test)
+        print(f"holdout accuracy: {acc:.3f} on {len(test)} rows")
+    model.save(args.out)
+    print(f"saved {args.out}")
+    return 0
+
+
+def _cmd_bench(args) -> int:
+    from .categorize import _keyword_categorize_fallback
+
+    rows = _load_rows(args)
+    if not rows:
+        print("no user-confirmed transactions to benchmark on", file=sys.stderr)
+        return 1
+    model = CategoryModel.load(args.model)
+    merchants = [r[0] for r in rows]
+    texts = [r[1] for r in rows]
+
+    started = time.perf_counter()
+    preds = model.predict_batch(merchants, texts)
+    model_secs = time.perf_counter() - started
+    started = time.perf_counter()
+    kw_preds = [_keyword_categorize_fallback(m, t) for m, t in zip(merchants, texts)]
+    kw_secs = time.perf_counter() - started
+
+    model_acc = sum(p[0] == r[2] for p, r in zip(preds, rows)) / len(rows)
+    kw_acc = sum((p or "other") == r[2] for p, r in zip(kw_preds, rows)) / len(rows)
+    print(f"rows: {len(rows)}")
+    print(f"naive-bayes   accuracy {model_acc:.3f}  throughput {len(rows) / max(model_secs, 1e-9):,.0f} rows/s")
+    print(f"keyword rules accuracy {kw_acc:.3f}  throughput {len(rows) / max(kw_secs, 1e-9):,.0f} rows/s")
+    return 0
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.utils.category_model")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    for name in ("train", "bench"):
+        p = sub.add_parser(name)
+        p.add_argument("--csv", help="read merchant,text,category rows from a CSV instead of the database")
+        p.add_argument("--limit", type=int, default=None, help="max rows to read from the database")
+    sub.choices["train"].add_argument("--out", default="category_nb.npz")
+    sub.choices["train"].add_argument("--holdout", type=float, default=0.1, help="fraction held out for accuracy")
+    sub.choices["train"].add_argument("--n-features", type=int, default=DEFAULT_N_FEATURES)
+    sub.choices["bench"].add_argument("--model", default=settings.category_model_path or "category_nb.npz")
+    args = parser.parse_args(argv)
+    if args.cmd == "train":
+        return _cmd_train(args)
+    return _cmd_bench(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
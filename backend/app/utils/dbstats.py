@@ -0,0 +1,96 @@
+"""
+Per-request database accounting: statement count, time spent executing statements and time
+spent waiting for a pooled connection.
+
+The edge middleware opens a `RequestDbStats` for each request in a context variable; engine
+event hooks and the timed pool add to whichever stats object is current. Outside a request
+(worker, startup) nothing is recorded. With QUERY_DEBUG the normalized shape of every
+statement is counted too, so a statement repeated once per row (N+1) stands out.
+"""
+import re
+import time
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+
+_PLACEHOLDERS = re.compile(r"\$\d+(?:\s*,\s*\$\d+)*")
+_LITERALS = re.compile(r"'(?:[^']|'')*'|(?<![$\w.])\d+(?:\.\d+)?\b")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def statement_shape(statement: str) -> str:
+    """SQL with literals and placeholder lists collapsed, so per-row repeats compare equal."""
+    shape = _PLACEHOLDERS.sub("$n", statement)
+    shape = _LITERALS.sub("?", shape)
+    return _WHITESPACE.sub(" ", shape).strip()
+
+
+class RequestDbStats:
+    __slots__ = ("queries", "db_seconds", "pool_wait_seconds", "shapes")
+
+    def __init__(self, track_shapes: bool = False):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.pool_wait_seconds = 0.0
+        self.shapes: Optional[Dict[str, int]] = {} if track_shapes else None
+
+    def repeated(self, threshold: int) -> List[Tuple[str, int]]:
+        """Statement shapes executed at least `threshold` times, most frequent first."""
+        if not self.shapes:
+            return []
+        return sorted(((s, n) for s, n in self.shapes.items() if n >= threshold), key=lambda x: -x[1])
+
+
+_current: ContextVar[Optional[RequestDbStats]] = ContextVar("request_db_stats", default=None)
+
+
+def begin_request(track_shapes: bool = False) -> RequestDbStats:
+    stats = RequestDbStats(track_shapes)
+    _current.set(stats)
+    return stats
+
+
+def current_stats() -> Optional[RequestDbStats]:
+    return _current.get()
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """AsyncAdaptedQueuePool that charges connection checkout time to the current request."""
+
+    def _do_get(self):
+        stats = _current.get()
+        if stats is None:
+            return super()._do_get()
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            stats.pool_wait_seconds += time.perf_counter() - started
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None and _current.get() is not None:
+        context._dbstats_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _current.get()
+    if stats is None:
+        return
+    stats.queries += 1
+    started = getattr(context, "_dbstats_started", None)
+    if started is not None:
+        stats.db_seconds += time.perf_counter() - started
+    if stats.shapes is not None:
+        shape = statement_shape(statement)
+        stats.shapes[shape] = stats.shapes.get(shape, 0) + 1
+
+
+def instrument_engine(engine) -> None:
+    """Attach the statement hooks to an (async) engine."""
+    sync_engine = getattr(engine, "sync_engine", engine)
+    event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
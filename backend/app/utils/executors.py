@@ -0,0 +1,88 @@
+"""
+Named, bounded thread pools for blocking work that must not run on the event loop.
+
+Each pool admits at most `max_workers + max_queue` calls; beyond that `run` fails fast with
+`ExecutorBusy` (503) so a burst degrades into quick rejections instead of an ever-growing
+backlog. Queue wait and run time are exported per pool.
+"""
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+from prometheus_client import Counter, Gauge, Histogram
+
+from ..errors import AppError
+
+
+EXECUTOR_QUEUE_WAIT = Histogram(
+    "executor_queue_wait_seconds",
+    "Time a call waited for a free executor thread",
+    ["pool"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+EXECUTOR_RUN_TIME = Histogram(
+    "executor_run_seconds",
+    "Time spent running a call on an executor thread",
+    ["pool"],
+)
+EXECUTOR_INFLIGHT = Gauge("executor_inflight", "Calls queued or running on an executor", ["pool"], multiprocess_mode="livesum")
+EXECUTOR_REJECTED = Counter("executor_rejected_total", "Calls rejected because the executor queue was full", ["pool"])
+
+
+class ExecutorBusy(AppError):
+    def __init__(self, pool: str):
+        super().__init__(code="SERVER_BUSY", message="Server busy, retry shortly", details={"pool": pool}, status_code=503)
+        self.headers = {"Retry-After": "1"}
+
+
+class BoundedExecutor:
+    def __init__(self, name: str, max_workers: int, max_queue: int):
+        self.name = name
+        self.max_workers = max(1, int(max_workers))
+        self.max_queue = max(0, int(max_queue))
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=f"{name}-")
+        # Only touched from the event loop thread
+        self._pending = 0
+
+    async def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        if self._pending >= self.max_workers + self.max_queue:
+            EXECUTOR_REJECTED.labels(pool=self.name).inc()
+            raise ExecutorBusy(self.name)
+        submitted = time.perf_counter()
+
+        def _call():
+            started = time.perf_counter()
+            EXECUTOR_QUEUE_WAIT.labels(pool=self.name).observe(started - submitted)
+            try:
+                return fn(*args)
+            finally:
+                EXECUTOR_RUN_TIME.labels(pool=self.name).observe(time.perf_counter() - started)
+
+        self._pending += 1
+        EXECUTOR_INFLIGHT.labels(pool=self.name).inc()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._pool, _call)
+        finally:
+            self._pending -= 1
+            EXECUTOR_INFLIGHT.labels(pool=self.name).dec()
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+_executors: Dict[str, BoundedExecutor] = {}
+
+
+def get_executor(name: str, max_workers: int, max_queue: int) -> BoundedExecutor:
+    """Process-wide pool for `name`; sizes apply on first use only."""
+    executor = _executors.get(name)
+    if executor is None:
+        executor = _executors[name] = BoundedExecutor(name, max_workers, max_queue)
+    return executor
+
+
+def shutdown_executors() -> None:
+    for executor in _executors.values():
+        executor.shutdown()
+    _executors.clear()
@@ -0,0 +1,108 @@
+"""
+Background readiness checks.
+
+Dependencies (Postgres, S3/MinIO) are probed every `health_check_interval_seconds`, concurrently
+and each under `health_check_timeout_seconds`, by one task per process. `/readyz` only reads the
+last snapshot, so probe traffic from load balancers and Kubernetes costs no queries or S3 calls.
+A snapshot older than a few intervals (the checker is stuck or dead) counts as not ready.
+"""
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, Optional
+
+from prometheus_client import Gauge, Histogram
+from sqlalchemy import text
+
+from ..config import settings
+from ..db import AsyncSessionLocal
+from .storage import s3_ready, storage_executor
+
+
+DEPENDENCY_UP = Gauge(
+    "dependency_up",
+    "1 if the last readiness check of a dependency succeeded",
+    ["dependency"],
+    multiprocess_mode="livemin",
+)
+DEPENDENCY_CHECK_TIME = Histogram(
+    "dependency_check_seconds",
+    "Duration of background readiness checks",
+    ["dependency"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+
+Check = Callable[[], Awaitable[None]]
+
+
+async def check_db() -> None:
+    async with AsyncSessionLocal() as s:
+        await s.execute(text("SELECT 1"))
+
+
+async def check_storage() -> None:
+    if not await storage_executor().run(s3_ready):
+        raise RuntimeError("bucket not reachable")
+
+
+class HealthChecker:
+    def __init__(self, checks: Dict[str, Check], interval: float, timeout: float):
+        self.checks = checks
+        self.interval = interval
+        self.timeout = timeout
+        # Replaced wholesale after each round, so readers never see a half-updated result
+        self._results: Dict[str, dict] = {}
+        self._checked_at: Optional[float] = None
+
+    async def _run_check(self, name: str, check: Check) -> dict:
+        started = time.perf_counter()
+        error = None
+        try:
+            await asyncio.wait_for(check(), self.timeout)
+        except asyncio.TimeoutError:
+            error = f"timed out after {self.timeout:g}s"
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"[:200]
+        elapsed = time.perf_counter() - started
+        DEPENDENCY_CHECK_TIME.labels(dependency=name).observe(elapsed)
+        DEPENDENCY_UP.labels(dependency=name).set(0 if error else 1)
+        result = {"ok": error is None, "latency_ms": round(elapsed * 1000, 2)}
+        if error:
+            result["error"] = error
+        return result
+
+    async def refresh(self) -> None:
+        names = list(self.checks)
+        results = await asyncio.gather(*(self._run_check(n, self.checks[n]) for n in names))
+        self._results = dict(zip(names, results))
+        self._checked_at = time.monotonic()
+
+    def snapshot(self) -> dict:
+        """Last results as served by /readyz: overall readiness plus per-dependency status and latency."""
+        results, checked_at = self._results, self._checked_at
+        if checked_at is None:
+            return {"ready": False, "reason": "checks pending", "checks": {}}
+        age = time.monotonic() - checked_at
+        stale = age > 3 * self.interval + self.timeout
+        ready = not stale and all(r["ok"] for r in results.values())
+        body = {"ready": ready, **{name: r["ok"] for name, r in results.items()}}
+        body["checked_seconds_ago"] = round(age, 3)
+        if stale:
+            body["reason"] = "checks stale"
+        body["checks"] = results
+        return body
+
+    async def run(self, stop: asyncio.Event) -> None:
+        """Refresh now, then every `interval` until `stop`."""
+        while not stop.is_set():
+            await self.refresh()
+            try:
+                await asyncio.wait_for(stop.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+
+health = HealthChecker(
+    {"db": check_db, "storage": check_storage},
+    interval=settings.health_check_interval_seconds,
+    timeout=settings.health_check_timeout_seconds,
+)
@@ -0,0 +1,107 @@
+"""
+Shared outbound HTTP layer for third-party APIs (Stripe, identity providers).
+
+One keep-alive `requests.Session` per upstream with a sized connection pool, per-upstream
+timeouts, and blocking calls run on the bounded "outbound" executor so a slow upstream only
+ties up executor threads, never the event loop. Latency is exported per upstream.
+"""
+import functools
+import time
+from typing import Any, Callable, Dict, Mapping, Tuple
+
+import requests
+from prometheus_client import Histogram
+from requests.adapters import HTTPAdapter
+
+from ..config import settings
+from .executors import BoundedExecutor, get_executor
+
+
+OUTBOUND_LATENCY = Histogram(
+    "outbound_request_latency_seconds",
+    "Latency of calls to third-party APIs",
+    ["upstream", "outcome"],
+    buckets=(0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+
+_sessions: Dict[str, requests.Session] = {}
+_stripe_configured = False
+
+
+def outbound_executor() -> BoundedExecutor:
+    return get_executor("outbound", settings.outbound_executor_workers, settings.outbound_executor_queue)
+
+
+def upstream_timeout(upstream: str) -> Tuple[float, float]:
+    """(connect, read) timeout for an upstream; OUTBOUND_TIMEOUTS overrides the read timeout per upstream."""
+    read = settings.outbound_read_timeout_seconds
+    for entry in settings.outbound_timeouts.split(","):
+        name, _, value = entry.partition("=")
+        if name.strip() == upstream and value.strip():
+            read = float(value)
+            break
+    return settings.outbound_connect_timeout_seconds, read
+
+
+def get_session(upstream: str) -> requests.Session:
+    """Keep-alive session for an upstream, pooled so executor threads can share connections."""
+    session = _sessions.get(upstream)
+    if session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=4,
+            pool_maxsize=settings.outbound_executor_workers,
+            max_retries=0,
+        )
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        _sessions[upstream] = session
+    return session
+
+
+def _timed(upstream: str, fn: Callable[..., Any], *args: Any) -> Any:
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        result = fn(*args)
+        outcome = "ok"
+        return result
+    finally:
+        OUTBOUND_LATENCY.labels(upstream=upstream, outcome=outcome).observe(time.perf_counter() - started)
+
+
+async def call_upstream(upstream: str, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """Run a blocking client call (e.g. a Stripe SDK method) on the outbound executor, timed per upstream."""
+    if kwargs:
+        fn = functools.partial(fn, **kwargs)
+    return await outbound_executor().run(_timed, upstream, fn, *args)
+
+
+def _get_json(upstream: str, url: str) -> Tuple[Any, Mapping[str, str]]:
+    resp = get_session(upstream).get(url, timeout=upstream_timeout(upstream))
+    resp.raise_for_status()
+    return resp.json(), resp.headers
+
+
+async def get_json(upstream: str, url: str) -> Tuple[Any, Mapping[str, str]]:
+    """GET a JSON document from an upstream. Returns (body, case-insensitive response headers)."""
+    return await call_upstream(upstream, _get_json, upstream, url)
+
+
+def configure_stripe() -> None:
+    """Route the Stripe SDK through the pooled "stripe" session with its per-upstream timeout."""
+    global _stripe_configured
+    if _stripe_configured:
+        return
+    import stripe
+
+    stripe.default_http_client = stripe.RequestsClient(timeout=upstream_timeout("stripe"), session=get_session("stripe"))
+    _stripe_configured = True
+
+
+def close_sessions() -> None:
+    global _stripe_configured
+    for session in _sessions.values():
+        session.close()
+    _sessions.clear()
+    _stripe_configured = False
@@ -0,0 +1,103 @@
+"""
+Process-wide JWKS key stores for verifying social login tokens locally.
+
+Keys are cached by `kid` for the JWKS response's Cache-Control max-age. Close to expiry a
+lookup schedules a background refresh and keeps serving the cached keys; an unknown `kid`
+triggers an immediate refetch (rate limited) to pick up rotated keys.
+"""
+import asyncio
+import logging
+import re
+import time
+from typing import Dict, Optional, Tuple
+
+import jwt
+from jwt import PyJWK, PyJWKSet
+
+from ..config import settings
+from .http import get_json
+
+
+logger = logging.getLogger("jwks")
+
+_MAX_AGE_RE = re.compile(r"max-age=(\d+)")
+
+# Refresh in the background once this fraction of the key set's lifetime has elapsed
+REFRESH_AHEAD_FRACTION = 0.8
+
+
+async def _fetch_jwks(upstream: str, url: str) -> Tuple[dict, Optional[int]]:
+    body, headers = await get_json(upstream, url)
+    match = _MAX_AGE_RE.search(headers.get("Cache-Control", ""))
+    return body, int(match.group(1)) if match else None
+
+
+class KeyStore:
+    def __init__(self, name: str, jwks_url: str):
+        self.name = name
+        self.jwks_url = jwks_url
+        self._keys: Dict[str, PyJWK] = {}
+        self._fetched_at = 0.0
+        self._refresh_at = 0.0
+        self._expires_at = 0.0
+        self._lock = asyncio.Lock()
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    async def refresh(self) -> None:
+        started = time.monotonic()
+        async with self._lock:
+            if self._fetched_at > started:
+                # Another caller refreshed while we waited for the lock
+                return
+            body, max_age = await _fetch_jwks(self.name, self.jwks_url)
+            keys = {k.key_id: k for k in PyJWKSet.from_dict(body).keys if k.key_id}
+            ttl = max_age if max_age else settings.jwks_default_ttl_seconds
+            now = time.monotonic()
+            self._keys = keys
+            self._fetched_at = now
+            self._refresh_at = now + ttl * REFRESH_AHEAD_FRACTION
+            self._expires_at = now + ttl
+
+    async def _refresh_quietly(self) -> None:
+        try:
+            await self.refresh()
+        except Exception as e:
+            logger.warning("%s JWKS refresh failed: %s", self.name, e)
+
+    def _schedule_refresh(self) -> None:
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._refresh_quietly())
+
+    async def get_key(self, kid: Optional[str]) -> Optional[PyJWK]:
+        now = time.monotonic()
+        if not self._keys or now >= self._expires_at:
+            if self._keys:
+                # Serve the stale set if the provider is unreachable; keys rotate with overlap
+                await self._refresh_quietly()
+            else:
+                await self.refresh()
+        elif now >= self._refresh_at:
+            self._schedule_refresh()
+        key = self._keys.get(kid) if kid else None
+        if key is None and time.monotonic() - self._fetched_at >= settings.jwks_min_refetch_seconds:
+            # Unknown kid: the provider may have rotated keys since our last fetch
+            await self.refresh()
+            key = self._keys.get(kid) if kid else None
+        return key
+
+    async def signing_key_for(self, token: str) -> PyJWK:
+        kid = jwt.get_unverified_header(token).get("kid")
+        key = await self.get_key(kid)
+        if key is None:
+            raise jwt.InvalidTokenError(f"unknown signing key {kid!r} for {self.name}")
+        return key
+
+
+_stores: Dict[str, KeyStore] = {}
+
+
+def get_key_store(name: str, jwks_url: str) -> KeyStore:
+    store = _stores.get(name)
+    if store is None or store.jwks_url != jwks_url:
+        store = _stores[name] = KeyStore(name, jwks_url)
+    return store
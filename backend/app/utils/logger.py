@@ -0,0 +1,195 @@
+"""
+Buffered structured logging.
+
+Records are serialized with orjson on the calling thread and appended to a bounded
+in-memory queue; a daemon thread writes them to stdout in batches, so request handlers never
+block on the stream. Under backpressure info/debug records are sampled (1 in
+`log_sample_rate` once the queue is `log_sample_above` full) and everything is dropped once it
+is full; both are counted in `log_records_dropped_total` and reported in the next batch.
+
+The request id lives in one context variable, set by the edge middleware (or restored from a
+job row by the worker) and stamped on every record.
+"""
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from contextvars import ContextVar
+from typing import Deque, Optional
+
+import orjson
+from prometheus_client import Counter
+
+from ..config import settings
+
+
+LOG_DROPPED = Counter("log_records_dropped_total", "Log records not written due to backpressure", ["level", "reason"])
+
+_request_id: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+
+_ALWAYS_KEEP = {"warning", "error", "critical"}
+
+
+def get_request_id() -> Optional[str]:
+    return _request_id.get()
+
+
+def set_request_id(request_id: Optional[str]):
+    """Bind `request_id` to the current context; returns a token for `reset_request_id`."""
+    return _request_id.set(request_id)
+
+
+def reset_request_id(token) -> None:
+    _request_id.reset(token)
+
+
+class BufferedLogger:
+    def __init__(self, max_queue: int, sample_above: float, sample_rate: int, flush_interval: float, stream=None):
+        self.max_queue = max(1, max_queue)
+        self.sample_from = int(self.max_queue * sample_above)
+        self.sample_rate = max(1, sample_rate)
+        # Wake the writer early, before sampling kicks in
+        self.wake_at = max(1, min(self.sample_from, self.max_queue // 2))
+        self.flush_interval = flush_interval
+        self.stream = stream
+        self._queue: Deque[bytes] = deque()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._sampled = 0
+        self._dropped = 0
+
+    # -- producers ---------------------------------------------------------
+
+    def log(self, level: str, msg: str, **fields) -> None:
+        record = {"ts": int(time.time() * 1000), "lvl": level, "msg": msg}
+        request_id = _request_id.get()
+        if request_id is not None:
+            record["request_id"] = request_id
+        record.update(fields)
+        self._enqueue(level, record)
+
+    def emit(self, record: dict) -> None:
+        """Queue a pre-built record as-is (used by the span exporter)."""
+        self._enqueue("info", record)
+
+    def _enqueue(self, level: str, record: dict) -> None:
+        depth = len(self._queue)
+        if depth >= self.sample_from and level not in _ALWAYS_KEEP:
+            self._sampled += 1
+            if depth >= self.max_queue or self._sampled % self.sample_rate:
+                self._drop(level, "full" if depth >= self.max_queue else "sampled")
+                return
+        elif depth >= self.max_queue:
+            self._drop(level, "full")
+            return
+        line = orjson.dumps(record, default=str)
+        if self._thread is None:
+            # Not started (CLI tools, tests): write through
+            self._write([line])
+            return
+        self._queue.append(line)
+        if depth + 1 >= self.wake_at:
+            self._wake.set()
+
+    def debug(self, msg: str, **fields) -> None:
+        self.log("debug", msg, **fields)
+
+    def info(self, msg: str, **fields) -> None:
+        self.log("info", msg, **fields)
+
+    def warning(self, msg: str, **fields) -> None:
+        self.log("warning", msg, **fields)
+
+    def error(self, msg: str, **fields) -> None:
+        self.log("error", msg, **fields)
+
+    def exception(self, msg: str, exc: BaseException, **fields) -> None:
+        fields["exc"] = "".join(traceback.format_exception(type(exc), exc, exc.__traceback__))
+        self.log("error", msg, **fields)
+
+    def _drop(self, level: str, reason: str) -> None:
+        self._dropped += 1
+        LOG_DROPPED.labels(level=level, reason=reason).inc()
+
+    # -- writer thread -----------------------------------------------------
+
+    def _write(self, lines) -> None:
+        stream = self.stream or sys.stdout
+        data = b"\n".join(lines) + b"\n"
+        try:
+            buffer = getattr(stream, "buffer", None)
+            if buffer is not None:
+                buffer.write(data)
+            else:
+                stream.write(data.decode("utf-8"))
+            stream.flush()
+        except Exception:
+            pass
+
+    def flush(self) -> None:
+        lines = []
+        while self._queue:
+            lines.append(self._queue.popleft())
+        if self._dropped:
+            dropped, self._dropped = self._dropped, 0
+            lines.append(orjson.dumps({"ts": int(time.time() * 1000), "lvl": "warning", "msg": "log records dropped", "count": dropped}))
+        if lines:
+            self._write(lines)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+        self.flush()
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 2.0) -> None:
+        thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        self._stop.set()
+        self._wake.set()
+        thread.join(timeout)
+
+
+class BufferedLogHandler(logging.Handler):
+    """Routes stdlib `logging` records into the buffered logger."""
+
+    def __init__(self, target: BufferedLogger):
+        super().__init__()
+        self.target = target
+
+    def emit(self, record: logging.LogRecord) -> None:
+        fields = {"logger": record.name}
+        if record.exc_info and record.exc_info[1] is not None:
+            fields["exc"] = "".join(traceback.format_exception(*record.exc_info))
+        try:
+            self.target.log(record.levelname.lower(), record.getMessage(), **fields)
+        except Exception:
+            self.handleError(record)
+
+
+log = BufferedLogger(
+    max_queue=settings.log_queue_size,
+    sample_above=settings.log_sample_above,
+    sample_rate=settings.log_sample_rate,
+    flush_interval=settings.log_flush_interval_ms / 1000.0,
+)
+
+
+def configure_logging() -> None:
+    """Start the writer thread and send stdlib logging through it."""
+    log.start()
+    root = logging.getLogger()
+    if not any(isinstance(h, BufferedLogHandler) for h in root.handlers):
+        root.addHandler(BufferedLogHandler(log))
@@ -0,0 +1,187 @@
+"""
+Canonical merchant names and the persistent merchant -> category memo.
+
+The memo holds the verdict `determine_category` reached for a merchant from a confident merchant
+rule or the ML model, with its confidence, so repeat merchants skip rule evaluation. When a rule
+changes, the recategorization job forgets just the merchants of the transactions the rule matches
+(table and every process's LRU, via the principals NOTIFY channel). A user's correction evicts
+their cached overrides in every process over the same channel.
+"""
+import re
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..config import settings
+from .cache import LRUCache, MISSING
+from .principals import publish_invalidation, publish_invalidations, register_invalidation
+
+
+# Payment processor prefixes that precede the real merchant name ("SQ *BLUE BOTTLE")
+_PROCESSOR_PREFIX_RE = re.compile(r"^\s*(sq|tst|sp|pp|paypal)\s*\*\s*")
+# Store/branch numbers: "#1234", "store 0042", "no. 17", and any standalone number of 3+ digits
+_STORE_NUMBER_RE = re.compile(r"#\s*\d+|\b(?:store|str|no|unit)\.?\s*\d+\b|\b\d{3,}\b")
+# Intra-word punctuation joins the word ("WAL-MART", "MCDONALD'S"); everything else splits
+_JOINERS_RE = re.compile(r"(?<=\w)['\-.](?=\w)")
+_NON_WORD_RE = re.compile(r"[^a-z0-9 ]+")
+_SPACES_RE = re.compile(r"\s+")
+
+# Suffixes that vary between receipts of the same merchant
+NOISE_WORDS = {
+    "supercenter", "superstore", "store", "stores", "inc", "llc", "ltd", "corp", "co", "company", "the",
+}
+
+# Common OCR confusions, only applied inside tokens that are mostly letters ("WALM0RT")
+_OCR_DIGIT_FIXES = str.maketrans({"0": "o", "1": "l"})
+
+# A merchant rule this confident decides the category ahead of keyword rules and is memoized
+MEMO_MIN_CONFIDENCE = 0.8
+
+_memo = LRUCache(maxsize=settings.merchant_cache_size, ttl_seconds=settings.merchant_cache_ttl_seconds)
+# user_id -> {normalized merchant: category}
+_user_overrides = LRUCache(maxsize=settings.user_override_cache_size, ttl_seconds=settings.merchant_cache_ttl_seconds)
+
+
+def _fix_ocr_token(token: str) -> str:
+    letters = sum(c.isalpha() for c in token)
+    if letters and letters >= len(token) - letters:
+        return token.translate(_OCR_DIGIT_FIXES)
+    return token
+
+
+def normalize_merchant(merchant: Optional[str]) -> Optional[str]:
+    """Canonical key for a merchant string, e.g. "WAL-MART #1234" and "WALMART SUPERCENTER" -> "walmart"."""
+    if not merchant:
+        return None
+    name = merchant.lower()
+    name = _PROCESSOR_PREFIX_RE.sub("", name)
+    name = _STORE_NUMBER_RE.sub(" ", name)
+    name = _JOINERS_RE.sub("", name)
+    name = _NON_WORD_RE.sub(" ", name)
+    tokens = [_fix_ocr_token(t) for t in _SPACES_RE.split(name) if t]
+    tokens = [t for t in tokens if t not in NOISE_WORDS]
+    normalized = " ".join(tokens)
+    return normalized or None
+
+
+async def lookup_merchant_category(db: AsyncSession, normalized: str) -> Optional[Tuple[str, float]]:
+    """(category, confidence) for a normalized merchant, served from the LRU before the table.
+
+    Misses are cached too, so unknown merchants cost one query per TTL window.
+    """
+    cached = _memo.get(normalized)
+    if cached is not MISSING:
+        return cached
+    res = await db.execute(
+        text("SELECT category::text AS category, confidence FROM merchants WHERE normalized_name = :n"),
+        {"n": normalized},
+    )
+    row = res.mappings().first()
+    value = (row["category"], float(row["confidence"])) if row else None
+    _memo.set(normalized, value)
+    return value
+
+
+async def remember_merchant_category(db: AsyncSession, normalized: str, category: str, confidence: float) -> None:
+    """Upsert a merchant -> category verdict; the caller decides it is confident enough. Committed by the caller."""
+    await db.execute(
+        text(
+            """
+            INSERT INTO merchants(normalized_name, category, confidence)
+            VALUES (:n, CAST(:c AS category), :conf)
+            ON CONFLICT (normalized_name) DO UPDATE
+            SET category = EXCLUDED.category, confidence = EXCLUDED.confidence, updated_at = now()
+            """
+        ),
+        {"n": normalized, "c": category, "conf": round(confidence, 2)},
+    )
+    _memo.set(normalized, (category, confidence))
+
+
+async def forget_merchants(db: AsyncSession, names: Iterable[Optional[str]]) -> None:
+    """Drop memoized verdicts for these normalized merchants, here and in peer processes.
+
+    Committed by the caller; peers evict when it commits.
+    """
+    keys = sorted({n for n in names if n})
+    if not keys:
+        return
+    await db.execute(
+        text("DELETE FROM merchants WHERE normalized_name = ANY(CAST(:names AS text[]))"),
+        {"names": keys},
+    )
+    await publish_invalidations(db, "merchant_memo", keys)
+
+
+def clear_merchant_cache() -> None:
+    _memo.clear()
+
+
+async def get_user_overrides(db: AsyncSession, user_id) -> Dict[str, str]:
+    """All of a user's merchant corrections, loaded in one query and cached per user."""
+    key = str(user_id)
+    cached = _user_overrides.get(key)
+    if cached is not MISSING:
+        return cached
+    res = await db.execute(
+        text("SELECT normalized_merchant, category::text AS category FROM user_category_overrides WHERE user_id = :uid"),
+        {"uid": user_id},
+    )
+    overrides = {r["normalized_merchant"]: r["category"] for r in res.mappings().all()}
+    _user_overrides.set(key, overrides)
+    return overrides
+
+
+async def get_overrides_for_users(db: AsyncSession, user_ids: Iterable) -> Dict[str, Dict[str, str]]:
+    """Overrides for many users at once (batch jobs); one query for all users not already cached."""
+    result: Dict[str, Dict[str, str]] = {}
+    missing: List[str] = []
+    for uid in {str(u) for u in user_ids}:
+        cached = _user_overrides.get(uid)
+        if cached is MISSING:
+            missing.append(uid)
+        else:
+            result[uid] = cached
+    if missing:
+        res = await db.execute(
+            text(
+                """
+                SELECT user_id::text AS user_id, normalized_merchant, category::text AS category
+                FROM user_category_overrides
+                WHERE user_id = ANY(CAST(:uids AS uuid[]))
+                """
+            ),
+            {"uids": missing},
+        )
+        loaded: Dict[str, Dict[str, str]] = {uid: {} for uid in missing}
+        for r in res.mappings().all():
+            loaded[r["user_id"]][r["normalized_merchant"]] = r["category"]
+        for uid, overrides in loaded.items():
+            _user_overrides.set(uid, overrides)
+        result.update(loaded)
+    return result
+
+
+async def record_user_override(db: AsyncSession, user_id, merchant: Optional[str], category: str) -> None:
+    """Remember a user's category correction for this merchant. Committed by the caller."""
+    normalized = normalize_merchant(merchant)
+    if not normalized:
+        return
+    await db.execute(
+        text(
+            """
+            INSERT INTO user_category_overrides(user_id, normalized_merchant, category)
+            VALUES (:uid, :n, CAST(:c AS category))
+            ON CONFLICT (user_id, normalized_merchant) DO UPDATE
+            SET category = EXCLUDED.category, updated_at = now()
+            """
+        ),
+        {"uid": user_id, "n": normalized, "c": category},
+    )
+    # Every process (API workers and the job worker) may hold this user's overrides
+    await publish_invalidation(db, "user_overrides", user_id)
+
+
+register_invalidation("merchant_memo", _memo.pop, clear_merchant_cache)
+register_invalidation("user_overrides", _user_overrides.pop, _user_overrides.clear)
@@ -1,43 +1,47 @@
 from typing import Optional
-import json
-import requests
-from google.oauth2 import id_token as google_id_token
-from google.auth.transport import requests as google_requests
 import jwt
-from jwt import PyJWKClient
 
 from ..config import settings
+from .jwks import get_key_store
 
 
-def verify_google(id_token: str) -> Optional[dict]:
+GOOGLE_ISSUERS = ["accounts.google.com", "https://accounts.google.com"]
+APPLE_ISSUER = "https://appleid.apple.com"
+
+
+async def verify_google(id_token: str) -> Optional[dict]:
+    """Verify a Google ID token against cached Google signing keys and optional client IDs."""
     try:
-        req = google_requests.Request()
-        info = google_id_token.verify_oauth2_token(id_token, req)
+        signing_key = await get_key_store("google", settings.google_jwks_url).signing_key_for(id_token)
         # Optionally enforce audience match against configured client IDs
         allowed = [c.strip() for c in settings.google_client_ids.split(",") if c.strip()]
-        if allowed and info.get("aud") not in allowed:
-            return None
+        info = jwt.decode(
+            id_token,
+            signing_key.key,
+            algorithms=["RS256"],
+            audience=allowed or None,
+            issuer=GOOGLE_ISSUERS,
+            options={"verify_aud": bool(allowed)},
+        )
         return info
     except Exception:
         return None
 
 
-def verify_apple(identity_token: str) -> Optional[dict]:
+async def verify_apple(identity_token: str) -> Optional[dict]:
     """Verify Apple identity token against Apple's JWKS and optional audience.
 
     Falls back to unverified decode only in dev when APPLE_AUDIENCE is empty.
     """
     try:
-        jwks_url = "https://appleid.apple.com/auth/keys"
-        jwk_client = PyJWKClient(jwks_url)
-        signing_key = jwk_client.get_signing_key_from_jwt(identity_token)
+        signing_key = await get_key_store("apple", settings.apple_jwks_url).signing_key_for(identity_token)
         options = {"verify_aud": bool(settings.apple_audience), "verify_iss": True}
         payload = jwt.decode(
             identity_token,
             signing_key.key,
             algorithms=["RS256", "ES256"],
             audience=settings.apple_audience if settings.apple_audience else None,
-            issuer="https://appleid.apple.com",
+            issuer=APPLE_ISSUER,
             options=options,
         )
         return payload
@@ -49,5 +53,3 @@ def verify_apple(identity_token: str) -> Optional[dict]:
         except Exception:
             pass
         return None
-
-
@@ -1,12 +1,19 @@
+import os
+import re
+import sys
 import time
 import uuid
-from typing import Callable
+from typing import Optional
 
-from fastapi import Request
 from starlette.types import ASGIApp, Receive, Scope, Send
-from prometheus_client import Counter, Histogram, CollectorRegistry, CONTENT_TYPE_LATEST, generate_latest
+from prometheus_client import CollectorRegistry, Counter, Histogram, CONTENT_TYPE_LATEST, generate_latest, multiprocess
 from fastapi.responses import Response
-import json
+
+from ..config import settings
+from ..errors import RequestTooLarge, error_response
+from .dbstats import begin_request
+from .logger import log, reset_request_id, set_request_id
+from .tracing import start_trace
 
 
 REQUEST_COUNT = Counter(
@@ -19,136 +26,271 @@ REQUEST_LATENCY = Histogram(
     "HTTP request latency",
     ["method", "path"],
 )
+REQUEST_DB_QUERIES = Histogram(
+    "http_request_db_queries",
+    "SQL statements executed per request",
+    ["method", "path"],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 50, 100),
+)
+REQUEST_DB_TIME = Histogram(
+    "http_request_db_seconds",
+    "Time per request spent executing SQL statements",
+    ["method", "path"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+REQUEST_POOL_WAIT = Histogram(
+    "http_request_db_pool_wait_seconds",
+    "Time per request spent waiting for a pooled DB connection",
+    ["method", "path"],
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5),
+)
 
+# Accept a caller-supplied X-Request-Id (e.g. from a proxy or the mobile app) if it looks sane
+_INBOUND_REQUEST_ID = re.compile(rb"^[A-Za-z0-9._:-]{8,64}$")
 
-class RequestIdMiddleware:
-    def __init__(self, app: ASGIApp):
-        self.app = app
+# Label for requests answered before routing (404s, 413/429/503 rejections), so unknown
+# paths cannot create new time series
+UNMATCHED_ROUTE = "unmatched"
 
-    async def __call__(self, scope: Scope, receive: Receive, send: Send):
-        if scope["type"] != "http":
-            await self.app(scope, receive, send)
-            return
-        request_id = str(uuid.uuid4())
-        scope.setdefault("headers", [])
 
-        async def send_wrapper(message):
-            if message.get("type") == "http.response.start":
-                headers = list(message.get("headers", []))
-                headers.append((b"x-request-id", request_id.encode("utf-8")))
-                message["headers"] = headers
-            await send(message)
+def route_template(scope: Scope) -> str:
+    """Path template of the route that handled the request (e.g. /v1/transactions/{txn_id})."""
+    route = scope.get("route")
+    if route is None:
+        return UNMATCHED_ROUTE
+    return getattr(route, "path_format", None) or getattr(route, "path", None) or UNMATCHED_ROUTE
+
 
-        await self.app(scope, receive, send_wrapper)
+SECURITY_HEADERS = [
+    (b"x-content-type-options", b"nosniff"),
+    (b"x-frame-options", b"DENY"),
+    (b"referrer-policy", b"no-referrer"),
+    (b"permissions-policy", b"camera=(), microphone=(), geolocation=()"),
+    (b"x-xss-protection", b"0"),
+]
 
+class EdgeMiddleware:
+    """Request id, security headers, body size limit, metrics and access log in one pure-ASGI layer.
 
-class MetricsMiddleware:
-    def __init__(self, app: ASGIApp):
+    Headers are added in a single pass over `http.response.start`. The body limit is checked
+    against `content-length` up front and enforced again on the bytes actually received, so
+    chunked or mislabelled bodies cannot slip past it.
+    """
+
+    def __init__(self, app: ASGIApp, max_body_bytes: Optional[int] = None, log_json: Optional[bool] = None):
         self.app = app
+        self.max_body_bytes = settings.max_request_bytes if max_body_bytes is None else max_body_bytes
+        self.log_json = settings.log_json if log_json is None else log_json
 
     async def __call__(self, scope: Scope, receive: Receive, send: Send):
         if scope["type"] != "http":
             await self.app(scope, receive, send)
             return
-        start = time.time()
+        start = time.perf_counter()
         method = scope.get("method", "").upper()
         path = scope.get("path", "")
+        request_id = None
+        declared = None
+        traceparent = None
+        for k, v in scope.get("headers", []):
+            if k == b"content-length":
+                declared = v
+            elif k == b"x-request-id" and _INBOUND_REQUEST_ID.match(v):
+                request_id = v.decode("latin-1")
+            elif k == b"traceparent":
+                traceparent = v.decode("latin-1")
+        if request_id is None:
+            request_id = str(uuid.uuid4())
+        request_id_token = set_request_id(request_id)
+        trace = start_trace("http", traceparent, method=method, request_id=request_id)
+        trace.__enter__()
+        query_debug = settings.query_debug
+        db_stats = begin_request(track_shapes=query_debug)
+        scope.setdefault("state", {})["request_id"] = request_id
+        request_id_header = (b"x-request-id", request_id.encode("latin-1"))
         status_code = 500
+        max_body = self.max_body_bytes
+        started = False
 
         async def send_wrapper(message):
-            nonlocal status_code
-            if message.get("type") == "http.response.start":
-                status_code = message.get("status")
+            nonlocal status_code, started
+            if message["type"] == "http.response.start":
+                started = True
+                status_code = message["status"]
+                headers = list(message.get("headers", []))
+                present = {k.lower() for k, _ in headers}
+                headers.extend(h for h in SECURITY_HEADERS if h[0] not in present)
+                headers.append(request_id_header)
+                if query_debug:
+                    # Statements run before the response started (i.e. the whole handler for non-streaming responses)
+                    headers.append((b"x-query-count", str(db_stats.queries).encode()))
+                    repeated = db_stats.repeated(settings.query_debug_repeat_threshold)
+                    headers.append((b"x-query-repeated", str(repeated[0][1] if repeated else 0).encode()))
+                message["headers"] = headers
             await send(message)
 
+        async def reject_too_large():
+            response = error_response(scope, 413, RequestTooLarge.error_code, "Body too large")
+            await response(scope, receive, send_wrapper)
+
         try:
-            await self.app(scope, receive, send_wrapper)
+            if declared is not None and declared.isdigit() and int(declared) > max_body:
+                await reject_too_large()
+                return
+
+            received = 0
+
+            async def limited_receive():
+                nonlocal received
+                message = await receive()
+                if message["type"] == "http.request":
+                    received += len(message.get("body", b""))
+                    if received > max_body:
+                        raise RequestTooLarge()
+                return message
+
+            try:
+                await self.app(scope, limited_receive, send_wrapper)
+            except RequestTooLarge:
+                # Body read outside a route (e.g. by another middleware); answer here if we still can
+                if started:
+                    raise
+                await reject_too_large()
         finally:
-            REQUEST_COUNT.labels(method=method, path=path, status=str(status_code)).inc()
-            REQUEST_LATENCY.labels(method=method, path=path).observe(time.time() - start)
+            duration = time.perf_counter() - start
+            route = route_template(scope)
+            trace.rename(f"{method} {route}")
+            trace.set("status", status_code)
+            trace.__exit__(*sys.exc_info())
+            REQUEST_COUNT.labels(method=method, path=route, status=str(status_code)).inc()
+            REQUEST_LATENCY.labels(method=method, path=route).observe(duration)
+            REQUEST_DB_QUERIES.labels(method=method, path=route).observe(db_stats.queries)
+            REQUEST_DB_TIME.labels(method=method, path=route).observe(db_stats.db_seconds)
+            REQUEST_POOL_WAIT.labels(method=method, path=route).observe(db_stats.pool_wait_seconds)
+            if query_debug:
+                for shape, count in db_stats.repeated(settings.query_debug_repeat_threshold):
+                    log.warning(
+                        "possible N+1",
+                        method=method,
+                        route=route,
+                        count=count,
+                        statement=shape[:300],
+                        total_statements=db_stats.queries,
+                    )
+            if self.log_json:
+                log.info(
+                    "request",
+                    method=method,
+                    path=path,
+                    status=status_code,
+                    client=scope.get("client")[0] if scope.get("client") else "unknown",
+                    duration_ms=int(duration * 1000),
+                    db_queries=db_stats.queries,
+                    db_ms=int(db_stats.db_seconds * 1000),
+                )
+            reset_request_id(request_id_token)
 
 
-class JsonLoggingMiddleware:
-    def __init__(self, app: ASGIApp):
-        self.app = app
+def metrics_endpoint():
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        # Several server processes (gunicorn.conf.py): aggregate every worker's mmap files rather
+        # than reporting whichever process happened to answer the scrape
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        data = generate_latest(registry)
+    else:
+        data = generate_latest()
+    return Response(content=data, media_type=CONTENT_TYPE_LATEST)
 
-    async def __call__(self, scope: Scope, receive: Receive, send: Send):
-        if scope["type"] != "http":
-            await self.app(scope, receive, send)
-            return
-        method = scope.get("method", "").upper()
-        path = scope.get("path", "")
-        client = scope.get("client")[0] if scope.get("client") else "unknown"
-        start = time.time()
-        request_id = str(uuid.uuid4())
 
-        async def send_wrapper(message):
-            if message.get("type") == "http.response.start":
-                headers = list(message.get("headers", []))
-                headers.append((b"x-request-id", request_id.encode("utf-8")))
-                message["headers"] = headers
-            await send(message)
+# ---------------------------------------------------------------------------
+# Overhead benchmark: python -m app.utils.observability bench
+# ---------------------------------------------------------------------------
 
-        await self.app(scope, receive, send_wrapper)
-        duration = time.time() - start
-        # Simple stdout JSON log
-        print(json.dumps({
-            "ts": int(time.time()*1000),
-            "lvl": "info",
-            "msg": "request",
-            "request_id": request_id,
-            "method": method,
-            "path": path,
-            "client": client,
-            "duration_ms": int(duration * 1000)
-        }))
-
-
-class RateLimiter:
-    def __init__(self, app: ASGIApp, requests: int = 60, window_seconds: int = 60):
-        self.app = app
-        self.requests = requests
-        self.window = window_seconds
-        self.buckets = {}
+async def _bench_endpoint(scope: Scope, receive: Receive, send: Send):
+    body = b""
+    more = True
+    while more:
+        message = await receive()
+        body += message.get("body", b"")
+        more = message.get("more_body", False)
+    await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"application/json")]})
+    await send({"type": "http.response.body", "body": b"{}"})
 
-    async def __call__(self, scope: Scope, receive: Receive, send: Send):
-        if scope["type"] != "http":
-            await self.app(scope, receive, send)
-            return
 
-        client = None
-        for k, v in scope.get("headers", []):
-            if k == b"x-forwarded-for":
-                client = v.decode("utf-8").split(",")[0].strip()
-                break
-        if not client:
-            client = scope.get("client")[0] if scope.get("client") else "unknown"
-
-        now = int(time.time())
-        window_start = now - (now % self.window)
-        key = (client, window_start)
-        count = self.buckets.get(key, 0) + 1
-        self.buckets[key] = count
-
-        # cleanup
-        for (c, ws) in list(self.buckets.keys()):
-            if ws < window_start:
-                self.buckets.pop((c, ws), None)
-
-        if count > self.requests:
-            response = Response(
-                content=b'{"error": {"code": "RATE_LIMITED", "message": "Too many requests", "details": {}}}',
-                status_code=429,
-                media_type="application/json",
-            )
-            await response(scope, receive, send)
-            return
+def _bench_base_http_guard(app: ASGIApp) -> ASGIApp:
+    # The previous @app.middleware("http") guard, for comparison
+    from starlette.middleware.base import BaseHTTPMiddleware
 
-        await self.app(scope, receive, send)
+    async def guard(request, call_next):
+        cl = request.headers.get("content-length")
+        if cl and cl.isdigit() and int(cl) > settings.max_request_bytes:
+            return error_response(request.scope, 413, RequestTooLarge.error_code, "Body too large")
+        response = await call_next(request)
+        for k, v in SECURITY_HEADERS:
+            response.headers.setdefault(k.decode(), v.decode())
+        return response
 
+    return BaseHTTPMiddleware(app, dispatch=guard)
 
-def metrics_endpoint():
-    data = generate_latest()
-    return Response(content=data, media_type=CONTENT_TYPE_LATEST)
+
+async def _bench_run(app: ASGIApp, requests: int, body: bytes) -> float:
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+        "scheme": "http", "path": "/bench", "raw_path": b"/bench", "query_string": b"", "root_path": "",
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        "client": ("127.0.0.1", 1234), "server": ("testserver", 80),
+    }
+
+    async def send(message):
+        pass
+
+    started = time.perf_counter()
+    for _ in range(requests):
+        sent = False
+
+        async def receive():
+            nonlocal sent
+            if sent:
+                return {"type": "http.disconnect"}
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        await app(dict(scope), receive, send)
+    return (time.perf_counter() - started) / requests * 1e6
+
+
+def main(argv=None) -> int:
+    import argparse
+    import asyncio
+
+    parser = argparse.ArgumentParser(prog="python -m app.utils.observability")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    bench = sub.add_parser("bench", help="per-request overhead of the edge middleware")
+    bench.add_argument("--requests", type=int, default=20000)
+    bench.add_argument("--body-bytes", type=int, default=512)
+    args = parser.parse_args(argv)
+
+    body = b"x" * args.body_bytes
+    stacks = [
+        ("bare app", _bench_endpoint),
+        ("BaseHTTPMiddleware guard", _bench_base_http_guard(_bench_endpoint)),
+        ("EdgeMiddleware", EdgeMiddleware(_bench_endpoint, log_json=False)),
+    ]
+
+    async def run():
+        results = []
+        for name, app in stacks:
+            await _bench_run(app, min(1000, args.requests), body)  # warm up
+            results.append((name, await _bench_run(app, args.requests, body)))
+        return results
+
+    results = asyncio.run(run())
+    bare = results[0][1]
+    for name, us in results:
+        print(f"{name:<28} {us:8.1f} us/request  (+{us - bare:.1f} us overhead)")
+    return 0
 
 
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,167 @@
+"""
+Per-process cache of authenticated principals (session, user, plan, profile) keyed by session id.
+
+Entries are dropped locally and broadcast to other API processes with Postgres NOTIFY on
+logout, rotation, profile and subscription changes; the TTL bounds staleness if a
+notification is missed. Other per-process caches share the channel through
+`register_invalidation` / `publish_invalidation`.
+"""
+import asyncio
+import json
+import logging
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..config import settings
+from .cache import LRUCache, MISSING
+
+
+INVALIDATION_CHANNEL = "principal_invalidate"
+
+logger = logging.getLogger("principals")
+
+_principals = LRUCache(maxsize=settings.principal_cache_size, ttl_seconds=settings.principal_cache_ttl_seconds)
+# Only cache while subscribed to peer invalidations; otherwise a revoked session could linger for the TTL
+_listening = False
+# Payload kind -> (evict one key, drop everything) for caches that piggyback on the channel
+_handlers: Dict[str, Tuple[Callable[[str], None], Callable[[], None]]] = {}
+
+
+def get_cached_principal(session_id: str) -> Optional[Dict[str, Any]]:
+    principal = _principals.get(session_id)
+    return None if principal is MISSING else principal
+
+
+def cache_principal(session_id: str, principal: Dict[str, Any]) -> None:
+    if _listening:
+        _principals.set(session_id, principal)
+
+
+def register_invalidation(kind: str, evict: Callable[[str], None], clear: Callable[[], None]) -> None:
+    """Route `kind:key` notifications to `evict(key)`; `clear()` runs when the listener (re)subscribes."""
+    _handlers[kind] = (evict, clear)
+
+
+def _evict(kind: str, key: str) -> None:
+    if kind == "session":
+        _principals.pop(key)
+    elif kind == "user":
+        _principals.evict_where(lambda _sid, p: p["user_id"] == key)
+    elif kind in _handlers:
+        _handlers[kind][0](key)
+
+
+async def publish_invalidation(db: AsyncSession, kind: str, key) -> None:
+    """Evict `kind:key` here and NOTIFY peers; they hear about it when the caller commits."""
+    _evict(kind, str(key))
+    await db.execute(
+        text("SELECT pg_notify(:channel, :payload)"),
+        {"channel": INVALIDATION_CHANNEL, "payload": f"{kind}:{key}"},
+    )
+
+
+async def publish_invalidations(db: AsyncSession, kind: str, keys: List[str]) -> None:
+    """`publish_invalidation` for many keys of one kind, with a single statement."""
+    if not keys:
+        return
+    for key in keys:
+        _evict(kind, key)
+    await db.execute(
+        text("SELECT pg_notify(:channel, :kind || ':' || k) FROM unnest(CAST(:keys AS text[])) AS k"),
+        {"channel": INVALIDATION_CHANNEL, "kind": kind, "keys": keys},
+    )
+
+
+async def invalidate_principal(db: AsyncSession, session_id=None, user_id=None) -> None:
+    """Drop cached principals for a session or for every session of a user, here and in peers.
+
+    The NOTIFY is transactional: peers hear about it when the caller commits.
+    """
+    for kind, key in (("session", session_id), ("user", user_id)):
+        if key is None:
+            continue
+        await publish_invalidation(db, kind, key)
+
+
+async def load_principal(db: AsyncSession, session_id: str) -> Optional[Dict[str, Any]]:
+    """Resolve session, user, subscription and profile in one round trip."""
+    res = await db.execute(
+        text(
+            """
+            SELECT s.id AS session_id, s.refresh_token_hash, s.expires_at,
+                   u.id AS user_id, u.email, u.created_at,
+                   sub.plan AS sub_plan, sub.status AS sub_status,
+                   to_jsonb(p) AS profile
+            FROM sessions s
+            JOIN users u ON u.id = s.user_id AND u.deleted_at IS NULL
+            LEFT JOIN subscriptions sub ON sub.user_id = u.id
+            LEFT JOIN profiles p ON p.user_id = u.id
+            WHERE s.id = :sid AND s.revoked_at IS NULL AND s.expires_at > now()
+            """
+        ),
+        {"sid": session_id},
+    )
+    row = res.mappings().first()
+    if not row:
+        return None
+    profile = row["profile"]
+    if isinstance(profile, str):
+        profile = json.loads(profile)
+    return {
+        "user_id": str(row["user_id"]),
+        "refresh_token_hash": row["refresh_token_hash"],
+        "expires_at": row["expires_at"],
+        "user": {"id": row["user_id"], "email": row["email"], "created_at": row["created_at"]},
+        "subscription": {"plan": row["sub_plan"], "status": row["sub_status"]} if row["sub_plan"] is not None else None,
+        "profile": profile,
+    }
+
+
+def is_premium(principal: Dict[str, Any]) -> bool:
+    sub = principal.get("subscription")
+    return bool(sub) and sub.get("plan") == "premium" and sub.get("status") == "active"
+
+
+def _on_notification(_conn, _pid, _channel, payload: str) -> None:
+    kind, _, key = payload.partition(":")
+    _evict(kind, key)
+
+
+async def listen_for_invalidations(stop: asyncio.Event) -> None:
+    """Apply peer invalidations until `stop` is set, reconnecting on connection loss."""
+    import asyncpg
+
+    global _listening
+    dsn = settings.database_url.replace("postgresql+asyncpg://", "postgresql://", 1)
+    while not stop.is_set():
+        conn = None
+        try:
+            conn = await asyncpg.connect(dsn)
+            lost = asyncio.Event()
+            conn.add_termination_listener(lambda _c: lost.set())
+            await conn.add_listener(INVALIDATION_CHANNEL, _on_notification)
+            # Anything published while we were disconnected is gone
+            _principals.clear()
+            for _, clear in _handlers.values():
+                clear()
+            _listening = True
+            waiters = [asyncio.create_task(stop.wait()), asyncio.create_task(lost.wait())]
+            _, pending = await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+            for t in pending:
+                t.cancel()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning("principal invalidation listener failed: %s", e)
+        finally:
+            _listening = False
+            if conn is not None and not conn.is_closed():
+                await conn.close()
+        _principals.clear()
+        if not stop.is_set():
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=5)
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,192 @@
+"""
+Live profiling and event-loop health for the API and the worker.
+
+- `SamplingProfiler` walks every thread's stack (`sys._current_frames()`) from a background
+  thread at a fixed interval and aggregates them into collapsed stacks
+  ("thread;outer;...;inner count"), the input format of flamegraph.pl / speedscope.
+- `monitor_event_loop` keeps the `event_loop_lag_seconds` gauge current and runs a watchdog
+  thread; when the loop's heartbeat is overdue by more than LOOP_BLOCK_THRESHOLD_MS the watchdog
+  logs the loop thread's stack at that moment, which names the blocking call (bcrypt, boto3,
+  tesseract, ...).
+"""
+import asyncio
+import os
+import signal
+import sys
+import threading
+import time
+import traceback
+from collections import Counter as Tally
+from typing import Dict, Optional
+
+from prometheus_client import Counter, Gauge
+
+from ..config import settings
+from .logger import log
+
+
+EVENT_LOOP_LAG = Gauge(
+    "event_loop_lag_seconds",
+    "How late the event loop ran a timer scheduled at a fixed interval",
+    multiprocess_mode="livemax",
+)
+EVENT_LOOP_BLOCKED = Counter("event_loop_blocked_total", "Times the event loop was blocked beyond the threshold")
+
+
+class ProfilerBusy(Exception):
+    pass
+
+
+def _frame_label(code, cache: Dict[object, str]) -> str:
+    label = cache.get(code)
+    if label is None:
+        name = getattr(code, "co_qualname", code.co_name)
+        label = f"{name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+        cache[code] = label
+    return label
+
+
+class SamplingProfiler:
+    _lock = threading.Lock()
+
+    def __init__(self, interval: float, thread_id: Optional[int] = None):
+        self.interval = interval
+        self.thread_id = thread_id
+        self.samples = 0
+        self._stacks: Tally = Tally()
+        self._labels: Dict[object, str] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _sample(self, own: int, names: Dict[int, str]) -> None:
+        for tid, frame in sys._current_frames().items():
+            if tid == own or (self.thread_id is not None and tid != self.thread_id):
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame.f_code, self._labels))
+                frame = frame.f_back
+            stack.append(names.get(tid, f"thread-{tid}"))
+            self._stacks[";".join(reversed(stack))] += 1
+        self.samples += 1
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        names: Dict[int, str] = {}
+        refreshed = 0.0
+        while not self._stop.wait(self.interval):
+            now = time.monotonic()
+            if now - refreshed > 1.0:
+                names = {t.ident: t.name for t in threading.enumerate()}
+                refreshed = now
+            self._sample(own, names)
+
+    def start(self) -> None:
+        if not SamplingProfiler._lock.acquire(blocking=False):
+            raise ProfilerBusy()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> str:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+            SamplingProfiler._lock.release()
+        return self.collapsed()
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self._stacks.most_common())
+
+
+async def profile_for(seconds: float, interval: float, thread_id: Optional[int] = None) -> str:
+    """Sample for `seconds` without blocking the event loop; one profile at a time per process."""
+    profiler = SamplingProfiler(interval, thread_id)
+    profiler.start()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        result = profiler.stop()
+    return result
+
+
+class _Watchdog:
+    def __init__(self, loop_thread: int, interval: float, threshold: float):
+        self.loop_thread = loop_thread
+        self.interval = interval
+        self.threshold = threshold
+        self.last_beat = time.monotonic()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="loop-watchdog", daemon=True)
+
+    def beat(self) -> None:
+        self.last_beat = time.monotonic()
+
+    def _run(self) -> None:
+        reported = None
+        while not self._stop.wait(self.threshold / 2):
+            beat = self.last_beat
+            overdue = time.monotonic() - beat - self.interval
+            if overdue <= self.threshold or reported == beat:
+                continue
+            # Report each blocking episode once, with where the loop thread is stuck right now
+            reported = beat
+            EVENT_LOOP_BLOCKED.inc()
+            frame = sys._current_frames().get(self.loop_thread)
+            stack = "".join(traceback.format_stack(frame)) if frame is not None else ""
+            log.warning("event loop blocked", blocked_ms=int(overdue * 1000), stack=stack)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+
+async def monitor_event_loop(stop: asyncio.Event) -> None:
+    """Publish the worst event-loop lag of each LOOP_LAG_INTERVAL_MS window and watch for
+    blocking callbacks until `stop`."""
+    loop = asyncio.get_running_loop()
+    threshold = settings.loop_block_threshold_ms / 1000.0
+    window = settings.loop_lag_interval_ms / 1000.0
+    # Beat often enough that any stall longer than the threshold makes a beat overdue
+    tick = min(window, threshold / 2)
+    watchdog = _Watchdog(threading.get_ident(), tick, threshold)
+    watchdog.start()
+    worst = 0.0
+    window_end = loop.time() + window
+    try:
+        while not stop.is_set():
+            watchdog.beat()
+            scheduled = loop.time()
+            await asyncio.sleep(tick)
+            now = loop.time()
+            worst = max(worst, now - scheduled - tick)
+            if now >= window_end:
+                EVENT_LOOP_LAG.set(max(0.0, worst))
+                worst = 0.0
+                window_end = now + window
+    finally:
+        await asyncio.to_thread(watchdog.stop)
+
+
+def install_profile_signal(sig=getattr(signal, "SIGUSR2", None)) -> None:
+    """On `sig`, profile this process for PROFILE_SIGNAL_SECONDS and write collapsed stacks to
+    PROFILE_OUTPUT_DIR/profile-<pid>-<time>.folded (for processes without an HTTP endpoint)."""
+    if sig is None:
+        return
+
+    def dump() -> None:
+        profiler = SamplingProfiler(settings.profile_interval_ms / 1000.0)
+        try:
+            profiler.start()
+        except ProfilerBusy:
+            return
+        time.sleep(settings.profile_signal_seconds)
+        path = os.path.join(settings.profile_output_dir, f"profile-{os.getpid()}-{int(time.time())}.folded")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(profiler.stop())
+        log.info("profile written", path=path, samples=profiler.samples)
+
+    signal.signal(sig, lambda *_: threading.Thread(target=dump, name="profile-dump", daemon=True).start())
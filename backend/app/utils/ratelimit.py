@@ -0,0 +1,219 @@
+"""
+Token-bucket rate limiting with per-route limits.
+
+Each client IP has a default bucket plus one bucket per matching route rule. The middleware
+runs before authentication, so it never keys on the bearer token: an unverified session id
+would let anyone spend another user's bucket, and whether a process had the principal cached
+would decide which bucket a request lands in. A request takes a token from all of its buckets
+or, if any of them is empty, from none. Buckets live in memory (per process) or in a Postgres
+UNLOGGED table shared by every API process (one statement per request; the middleware sits
+inside admission control so shed requests never reach the pool). Both are O(1) per request:
+idle buckets are simply forgotten, since a bucket idle for a full refill period is
+indistinguishable from a new one.
+"""
+import math
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from prometheus_client import Counter
+from sqlalchemy import text
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from ..config import settings
+from ..db import AsyncSessionLocal
+from ..errors import error_response
+
+
+RATE_LIMITED = Counter("rate_limited_total", "Requests rejected by the rate limiter", ["rule"])
+
+EXEMPT_PATHS = {"/healthz", "/readyz", "/metrics"}
+
+
+class Limit:
+    """`requests` per `window_seconds`, refilled continuously; bursts up to `requests`."""
+
+    def __init__(self, name: str, requests: int, window_seconds: float):
+        self.name = name
+        self.capacity = float(requests)
+        self.rate = requests / float(window_seconds)
+        self.window = float(window_seconds)
+
+
+def parse_limit(name: str, spec: str) -> Limit:
+    requests, _, window = spec.partition("/")
+    return Limit(name, int(requests), float(window or 60))
+
+
+def parse_rules(spec: str) -> Dict[Tuple[str, str], Limit]:
+    """"POST /v1/auth/login=10/60,..." -> {("POST", "/v1/auth/login"): Limit}."""
+    rules: Dict[Tuple[str, str], Limit] = {}
+    for entry in spec.split(","):
+        route, _, limit = entry.strip().partition("=")
+        if not route or not limit:
+            continue
+        method, _, path = route.strip().partition(" ")
+        rules[(method.upper(), path.strip())] = parse_limit(route.strip(), limit.strip())
+    return rules
+
+
+class MemoryBackend:
+    """Per-process buckets in an LRU map; a few idle buckets are evicted on each call."""
+
+    def __init__(self, max_keys: int = 100000):
+        self.max_keys = max_keys
+        # key -> (tokens, updated_at, idle_after)
+        self._buckets: "OrderedDict[str, Tuple[float, float, float]]" = OrderedDict()
+
+    def _evict_idle(self, now: float) -> None:
+        for _ in range(2):
+            if not self._buckets:
+                return
+            key, (_, _, idle_after) = next(iter(self._buckets.items()))
+            if idle_after > now and len(self._buckets) <= self.max_keys:
+                return
+            del self._buckets[key]
+
+    async def take_all(self, buckets: Sequence[Tuple[str, Limit]], cost: float = 1.0) -> Tuple[bool, float, Optional[Limit]]:
+        """Take `cost` from every (key, limit) bucket, or from none if any is short.
+
+        Returns (allowed, retry_after, the limit with the longest wait when denied).
+        """
+        now = time.monotonic()
+        levels = []
+        denied: Optional[Limit] = None
+        wait = 0.0
+        for key, limit in buckets:
+            entry = self._buckets.pop(key, None)
+            if entry is None:
+                tokens = limit.capacity
+            else:
+                tokens = min(limit.capacity, entry[0] + (now - entry[1]) * limit.rate)
+            levels.append(tokens)
+            if tokens < cost and (cost - tokens) / limit.rate > wait:
+                denied, wait = limit, (cost - tokens) / limit.rate
+        spent = cost if denied is None else 0.0
+        for (key, limit), tokens in zip(buckets, levels):
+            self._buckets[key] = (tokens - spent, now, now + limit.window)
+        self._evict_idle(now)
+        return denied is None, wait, denied
+
+    async def take(self, key: str, limit: Limit, cost: float = 1.0) -> Tuple[bool, float]:
+        allowed, retry_after, _ = await self.take_all([(key, limit)], cost)
+        return allowed, retry_after
+
+
+class PostgresBackend:
+    """Buckets shared across processes via `rate_limit_take_all` (migrations 0015, 0019): all of
+    a request's buckets in one statement on one pooled connection."""
+
+    async def take_all(self, buckets: Sequence[Tuple[str, Limit]], cost: float = 1.0) -> Tuple[bool, float, Optional[Limit]]:
+        async with AsyncSessionLocal() as db:
+            res = await db.execute(
+                text(
+                    """
+                    SELECT allowed, retry_after, denied
+                    FROM rate_limit_take_all(
+                        CAST(:keys AS text[]), CAST(:caps AS double precision[]), CAST(:rates AS double precision[]), :cost
+                    )
+                    """
+                ),
+                {
+                    "keys": [key for key, _ in buckets],
+                    "caps": [limit.capacity for _, limit in buckets],
+                    "rates": [limit.rate for _, limit in buckets],
+                    "cost": cost,
+                },
+            )
+            row = res.first()
+            await db.commit()
+        denied = buckets[row[2] - 1][1] if row[2] is not None else None
+        return bool(row[0]), float(row[1]), denied
+
+    async def take(self, key: str, limit: Limit, cost: float = 1.0) -> Tuple[bool, float]:
+        allowed, retry_after, _ = await self.take_all([(key, limit)], cost)
+        return allowed, retry_after
+
+
+async def purge_stale_buckets(db, idle_seconds: int = 3600) -> int:
+    """Delete shared buckets unused for `idle_seconds` (they would be full again anyway)."""
+    res = await db.execute(
+        text("DELETE FROM rate_limit_buckets WHERE updated_at < now() - make_interval(secs => :idle)"),
+        {"idle": idle_seconds},
+    )
+    await db.commit()
+    return res.rowcount or 0
+
+
+def make_backend(name: str):
+    if name == "postgres":
+        return PostgresBackend()
+    return MemoryBackend(max_keys=settings.rate_limit_memory_max_keys)
+
+
+def _client_ip(scope: Scope, trusted_hops: int) -> str:
+    """The address the outermost of `trusted_hops` proxies saw.
+
+    Each proxy appends the address it received the request from to X-Forwarded-For, so only the
+    rightmost `trusted_hops` entries (counting the peer itself) are trustworthy; anything to their
+    left is whatever the client sent.
+    """
+    peer = scope.get("client")[0] if scope.get("client") else "unknown"
+    if trusted_hops <= 0:
+        return peer
+    hops: List[str] = []
+    for k, v in scope.get("headers", []):
+        if k == b"x-forwarded-for":
+            hops.extend(h.strip() for h in v.decode("latin-1").split(","))
+    chain = [h for h in hops if h] + [peer]
+    return chain[max(0, len(chain) - 1 - trusted_hops)]
+
+
+def _identity(scope: Scope, trusted_hops: int) -> str:
+    return f"ip:{_client_ip(scope, trusted_hops)}"
+
+
+class RateLimiter:
+    def __init__(
+        self,
+        app: ASGIApp,
+        default: Optional[str] = None,
+        rules: Optional[str] = None,
+        backend: Optional[str] = None,
+        trusted_proxy_hops: Optional[int] = None,
+    ):
+        self.app = app
+        self.default = parse_limit("default", default or settings.rate_limit_default)
+        self.rules = parse_rules(rules if rules is not None else settings.rate_limit_rules)
+        self.backend = make_backend(backend or settings.rate_limit_backend)
+        self.trusted_proxy_hops = settings.trusted_proxy_hops if trusted_proxy_hops is None else trusted_proxy_hops
+
+    def _limits_for(self, scope: Scope) -> List[Limit]:
+        limits = [self.default]
+        rule = self.rules.get((scope.get("method", "").upper(), scope.get("path", "")))
+        if rule is not None:
+            limits.append(rule)
+        return limits
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or scope.get("path") in EXEMPT_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        identity = _identity(scope, self.trusted_proxy_hops)
+        buckets = [(f"{identity}|{limit.name}", limit) for limit in self._limits_for(scope)]
+        try:
+            allowed, retry_after, denied = await self.backend.take_all(buckets)
+        except Exception:
+            # Fail open: a broken shared store must not take the API down with it
+            allowed, retry_after, denied = True, 0.0, None
+        if not allowed:
+            RATE_LIMITED.labels(rule=denied.name).inc()
+            response = error_response(
+                scope, 429, "RATE_LIMITED", "Too many requests",
+                headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+            )
+            await response(scope, receive, send)
+            return
+
+        await self.app(scope, receive, send)
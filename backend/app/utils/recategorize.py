@@ -0,0 +1,306 @@
+"""
+Bulk recategorization of historical transactions after categorization rules change.
+"""
+import re
+import time
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..errors import AppError
+from .categorize import categorize_batch, compile_keyword_rule, compile_merchant_rule, load_rules
+from .logger import get_request_id
+from .merchants import forget_merchants, get_overrides_for_users, normalize_merchant
+
+
+RECATEGORIZE_BATCH_SIZE = 1000
+
+# SQLSTATE codes
+INVALID_REGULAR_EXPRESSION = "2201B"
+QUERY_CANCELED = "57014"  # statement_timeout
+
+
+async def enqueue_recategorization(db: AsyncSession, rule_kind: str, rule_id) -> None:
+    """Queue a worker job that re-evaluates transactions the given rule could match.
+
+    Runs inside the caller's transaction so the job only exists if the rule insert commits.
+    """
+    await db.execute(
+        text("INSERT INTO recategorization_jobs(rule_kind, rule_id, request_id) VALUES (:kind, :rid, :req)"),
+        {"kind": rule_kind, "rid": rule_id, "req": get_request_id()},
+    )
+
+
+def _like_escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def sqlstate(exc: BaseException) -> Optional[str]:
+    """SQLSTATE of a database error raised through SQLAlchemy, None for anything else."""
+    return getattr(getattr(exc, "orig", None), "sqlstate", None)
+
+
+async def postgres_accepts_regex(db: AsyncSession, pattern: str) -> bool:
+    """Whether Postgres' ARE dialect compiles `pattern` (Python's `re` accepts constructs it rejects,
+    e.g. lookbehind and `(?P<name>...)`)."""
+    try:
+        async with db.begin_nested():
+            await db.execute(text("SELECT '' ~* :p"), {"p": pattern})
+        return True
+    except DBAPIError as e:
+        if sqlstate(e) == INVALID_REGULAR_EXPRESSION:
+            return False
+        raise
+
+
+async def validate_merchant_pattern(db: AsyncSession, pattern: str) -> None:
+    """Reject a merchant pattern unless both the categorizer (Python) and the backfill scope
+    (Postgres) can compile it as a regex."""
+    try:
+        re.compile(pattern)
+        valid = await postgres_accepts_regex(db, pattern)
+    except re.error:
+        valid = False
+    if not valid:
+        raise AppError(
+            code="INVALID_PATTERN",
+            message="merchant_pattern must be a regular expression valid in both Python and Postgres",
+            details={"merchant_pattern": pattern},
+            status_code=400,
+        )
+
+
+def rule_scope_clause(rule_kind: str, rule: Dict, postgres_regex: bool = True) -> Tuple[str, Dict]:
+    """SQL predicate (over `transactions t`) selecting only rows the rule could possibly match.
+
+    Mirrors what `categorize` consults: merchant rules look at the merchant name, keyword
+    rules look at the OCR text. Both predicates are served by trigram indexes.
+    `postgres_regex=False` marks a merchant pattern Postgres cannot compile (rules created
+    before patterns were validated); every row with a merchant is then a candidate.
+    """
+    if rule_kind == "merchant":
+        pattern = rule["merchant_pattern"] or ""
+        try:
+            re.compile(pattern)
+        except re.error:
+            # Invalid regexes are applied as plain substrings by the categorizer
+            return "t.merchant ILIKE :scope_like", {"scope_like": f"%{_like_escape(pattern)}%"}
+        if not postgres_regex:
+            return "t.merchant IS NOT NULL", {}
+        return "t.merchant ~* :scope_pattern", {"scope_pattern": pattern}
+    keyword = rule["keyword"] or ""
+    return "(t.raw_text ->> 'ocr') ILIKE :scope_like", {"scope_like": f"%{_like_escape(keyword)}%"}
+
+
+async def scope_for_rule(db: AsyncSession, rule_kind: str, rule: Dict) -> Tuple[str, Dict]:
+    """`rule_scope_clause`, checking first that Postgres can evaluate the rule's pattern."""
+    postgres_regex = True
+    if rule_kind == "merchant":
+        pattern = rule["merchant_pattern"] or ""
+        try:
+            re.compile(pattern)
+            postgres_regex = await postgres_accepts_regex(db, pattern)
+        except re.error:
+            pass
+    return rule_scope_clause(rule_kind, rule, postgres_regex)
+
+
+async def fetch_rule(db: AsyncSession, rule_kind: str, rule_id) -> Optional[Dict]:
+    if rule_kind == "merchant":
+        q = text("SELECT id, merchant_pattern, category, confidence, active FROM merchant_rules WHERE id = :rid")
+    else:
+        q = text("SELECT id, keyword, scope, category, confidence, active FROM keyword_rules WHERE id = :rid")
+    res = await db.execute(q, {"rid": rule_id})
+    row = res.mappings().first()
+    return dict(row) if row else None
+
+
+async def fetch_candidate_batch(
+    db: AsyncSession,
+    scope_sql: str,
+    scope_params: Dict,
+    after_id=None,
+    limit: int = RECATEGORIZE_BATCH_SIZE,
+    source_sql: str = "transactions t",
+) -> List[Dict]:
+    """One keyset-paginated batch of in-scope transactions whose category was not set by the user."""
+    filters = [scope_sql, "t.category_edited_at IS NULL"]
+    params = dict(scope_params)
+    params["lim"] = limit
+    if after_id is not None:
+        filters.append("t.id > :after_id")
+        params["after_id"] = after_id
+    res = await db.execute(
+        text(
+            f"""
+            SELECT t.id, t.user_id, t.merchant, t.raw_text ->> 'ocr' AS ocr_text, t.category::text AS category
+            FROM {source_sql}
+            WHERE {' AND '.join(filters)}
+            ORDER BY t.id
+            LIMIT :lim
+            """
+        ),
+        params,
+    )
+    return [dict(r) for r in res.mappings().all()]
+
+
+async def categorize_rows(db: AsyncSession, rules: Dict[str, list], batch: List[Dict]) -> List[str]:
+    """New category per candidate row: the owner's merchant correction if any, else rules/ML."""
+    new_cats = categorize_batch(rules, [(row["merchant"], row["ocr_text"]) for row in batch])
+    overrides = await get_overrides_for_users(db, (row["user_id"] for row in batch))
+    for i, row in enumerate(batch):
+        user_overrides = overrides.get(str(row["user_id"]))
+        if user_overrides:
+            override = user_overrides.get(normalize_merchant(row["merchant"]) or "")
+            if override:
+                new_cats[i] = override
+    return new_cats
+
+
+async def apply_category_updates(db: AsyncSession, changes: List[Tuple[str, str]]) -> int:
+    """Apply (transaction_id, category) pairs in a single set-based UPDATE. Returns rows changed."""
+    if not changes:
+        return 0
+    values = []
+    params = {}
+    for i, (txn_id, category) in enumerate(changes):
+        values.append(f"(CAST(:id{i} AS uuid), CAST(:cat{i} AS category))")
+        params[f"id{i}"] = txn_id
+        params[f"cat{i}"] = category
+    res = await db.execute(
+        text(
+            f"""
+            UPDATE transactions t
+            SET category = v.category
+            FROM (VALUES {', '.join(values)}) AS v(id, category)
+            WHERE t.id = v.id
+              AND t.category_edited_at IS NULL
+              AND t.category IS DISTINCT FROM v.category
+            """
+        ),
+        params,
+    )
+    return res.rowcount or 0
+
+
+async def recategorize_for_rule(db: AsyncSession, rule_kind: str, rule_id) -> Tuple[int, int]:
+    """Re-run the categorizer over every transaction the rule could affect.
+
+    Streams candidates in keyset batches, evaluates each batch in memory against a single
+    rules load, and commits one set-based UPDATE per batch together with forgetting the batch's
+    merchants from the memo. Returns (scanned, updated).
+    """
+    rule = await fetch_rule(db, rule_kind, rule_id)
+    if not rule or not rule.get("active"):
+        return 0, 0
+    scope_sql, scope_params = await scope_for_rule(db, rule_kind, rule)
+    rules = await load_rules(db)
+
+    scanned = 0
+    updated = 0
+    after_id = None
+    while True:
+        batch = await fetch_candidate_batch(db, scope_sql, scope_params, after_id=after_id)
+        if not batch:
+            break
+        new_cats = await categorize_rows(db, rules, batch)
+        changes = [(row["id"], cat) for row, cat in zip(batch, new_cats) if cat != row["category"]]
+        updated += await apply_category_updates(db, changes)
+        # The rule may change these merchants' memoized verdicts; the rest of the memo stays warm
+        await forget_merchants(db, (normalize_merchant(row["merchant"]) for row in batch))
+        await db.commit()
+        scanned += len(batch)
+        after_id = batch[-1]["id"]
+        if len(batch) < RECATEGORIZE_BATCH_SIZE:
+            break
+    return scanned, updated
+
+
+async def simulate_rule(
+    db: AsyncSession,
+    rule_kind: str,
+    rule: Dict,
+    sample_percent: Optional[float] = None,
+    time_budget_ms: int = 2000,
+    max_examples: int = 5,
+) -> Dict:
+    """Dry-run a candidate rule: what would recategorization change if it were active?
+
+    Uses the same scoping and batch evaluation as `recategorize_for_rule` but never writes.
+    Stops at the time budget (each batch also runs under a matching statement_timeout) and
+    reports `complete: false` so callers know the counts cover only part of the table.
+    With `sample_percent`, scans a repeatable TABLESAMPLE instead of the full table.
+    """
+    started = time.monotonic()
+    deadline = started + max(time_budget_ms, 1) / 1000.0
+    if rule_kind == "merchant":
+        await validate_merchant_pattern(db, rule["merchant_pattern"])
+    scope_sql, scope_params = await scope_for_rule(db, rule_kind, rule)
+    rules = await load_rules(db)
+    if rule_kind == "merchant":
+        rules["merchant"].append(compile_merchant_rule(rule["merchant_pattern"], rule["category"], rule["confidence"]))
+    else:
+        rules["keyword"].append(compile_keyword_rule(rule["keyword"], rule.get("scope"), rule["category"], rule["confidence"]))
+
+    source_sql = "transactions t"
+    if sample_percent is not None:
+        pct = min(max(float(sample_percent), 0.0001), 100.0)
+        # REPEATABLE keeps the sample stable across keyset batches
+        source_sql = f"transactions t TABLESAMPLE SYSTEM ({pct}) REPEATABLE (42)"
+
+    transitions: Dict[Tuple[str, str], int] = {}
+    examples: List[Dict] = []
+    scanned = 0
+    changed = 0
+    complete = False
+    after_id = None
+    while True:
+        remaining_ms = int((deadline - time.monotonic()) * 1000)
+        if remaining_ms <= 0:
+            break
+        await db.execute(text(f"SET LOCAL statement_timeout = {remaining_ms}"))
+        try:
+            batch = await fetch_candidate_batch(db, scope_sql, scope_params, after_id=after_id, source_sql=source_sql)
+            # The override lookup runs under the same statement_timeout
+            new_cats = await categorize_rows(db, rules, batch)
+        except DBAPIError as e:
+            if sqlstate(e) != QUERY_CANCELED:
+                raise
+            # statement_timeout fired: report what we have so far
+            await db.rollback()
+            break
+        for row, new_cat in zip(batch, new_cats):
+            if new_cat == row["category"]:
+                continue
+            changed += 1
+            key = (row["category"], new_cat)
+            transitions[key] = transitions.get(key, 0) + 1
+            if len(examples) < max_examples:
+                examples.append({
+                    "transaction_id": str(row["id"]),
+                    "merchant": row["merchant"],
+                    "from": row["category"],
+                    "to": new_cat,
+                })
+        scanned += len(batch)
+        if len(batch) < RECATEGORIZE_BATCH_SIZE:
+            complete = True
+            break
+        after_id = batch[-1]["id"]
+    await db.rollback()
+
+    return {
+        "scanned": scanned,
+        "would_change": changed,
+        "transitions": [
+            {"from": old, "to": new, "count": count}
+            for (old, new), count in sorted(transitions.items(), key=lambda x: -x[1])
+        ],
+        "examples": examples,
+        "complete": complete,
+        "sampled_percent": sample_percent,
+        "elapsed_ms": int((time.monotonic() - started) * 1000),
+    }
@@ -0,0 +1,57 @@
+"""
+Receipt image derivatives.
+
+After OCR the worker renders a small thumbnail (list views) and a display-sized copy (receipt
+detail) as WebP next to the original upload, `receipts/{uid}/{rid}.jpg` ->
+`receipts/{uid}/{rid}/thumb.webp` and `.../display.webp`, so clients never download the original
+(up to UPLOAD_MAX_BYTES) just to show it.
+"""
+import io
+from typing import Dict, Tuple
+
+from PIL import Image, ImageOps
+
+from ..config import settings
+
+
+def receipt_prefix(user_id, receipt_id) -> str:
+    """Root of a receipt's objects: the upload is `{prefix}.jpg|.pdf`, derivatives live under `{prefix}/`."""
+    return f"receipts/{user_id}/{receipt_id}"
+
+
+def upload_keys(user_id, receipt_id) -> Tuple[str, ...]:
+    """Object keys `POST /v1/receipts/upload` can hand out for this receipt."""
+    prefix = receipt_prefix(user_id, receipt_id)
+    return (f"{prefix}.jpg", f"{prefix}.pdf")
+
+
+def derivative_key(user_id, receipt_id, name: str) -> str:
+    # Built from the receipt row, never from the client-supplied upload key
+    return f"{receipt_prefix(user_id, receipt_id)}/{name}.webp"
+
+
+def _to_rgb(img: Image.Image) -> Image.Image:
+    if img.mode in ("RGB", "L"):
+        return img
+    if img.mode in ("RGBA", "LA", "P"):
+        # Flatten transparency onto white paper rather than letting it turn black
+        rgba = img.convert("RGBA")
+        flat = Image.new("RGB", rgba.size, (255, 255, 255))
+        flat.paste(rgba, mask=rgba.getchannel("A"))
+        return flat
+    return img.convert("RGB")
+
+
+def render_derivatives(img: Image.Image) -> Dict[str, bytes]:
+    """{"display": webp, "thumb": webp}, each no larger than its configured longest edge."""
+    display = _to_rgb(ImageOps.exif_transpose(img))
+    display.thumbnail((settings.receipt_display_px, settings.receipt_display_px), Image.LANCZOS)
+    # The thumbnail is downscaled from the display copy, not from the full-size original
+    thumb = display.copy()
+    thumb.thumbnail((settings.receipt_thumbnail_px, settings.receipt_thumbnail_px), Image.LANCZOS)
+    out = {}
+    for name, im in (("display", display), ("thumb", thumb)):
+        buf = io.BytesIO()
+        im.save(buf, "WEBP", quality=settings.receipt_webp_quality, method=4)
+        out[name] = buf.getvalue()
+    return out
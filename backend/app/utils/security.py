@@ -1,7 +1,23 @@
+import hashlib
+import hmac
 import secrets
 from datetime import datetime, timedelta, timezone
-from passlib.hash import bcrypt
-from typing import Tuple
+from passlib.hash import bcrypt as _bcrypt
+from typing import Optional, Tuple
+
+from ..config import settings
+from .executors import get_executor
+
+
+# Marks session hashes produced by hash_session_secret; anything else is a legacy bcrypt hash
+SESSION_HASH_PREFIX = "hmac-sha256$"
+
+
+bcrypt = _bcrypt.using(rounds=settings.bcrypt_rounds)
+
+
+def _hashing_executor():
+    return get_executor("hashing", settings.hashing_executor_workers, settings.hashing_executor_queue)
 
 
 def hash_password(password: str) -> str:
@@ -15,11 +31,54 @@ def verify_password(password: str, password_hash: str) -> bool:
         return False
 
 
+def _verify_and_update(password: str, password_hash: str) -> Tuple[bool, Optional[str]]:
+    valid = verify_password(password, password_hash)
+    if valid and bcrypt.needs_update(password_hash):
+        return True, bcrypt.hash(password)
+    return valid, None
+
+
+async def hash_password_async(password: str) -> str:
+    """`hash_password` on the bounded hashing pool, keeping bcrypt off the event loop."""
+    return await _hashing_executor().run(hash_password, password)
+
+
+async def verify_password_async(password: str, password_hash: str) -> Tuple[bool, Optional[str]]:
+    """Returns (valid, new_hash). new_hash is set when the stored hash uses an outdated cost."""
+    return await _hashing_executor().run(_verify_and_update, password, password_hash)
+
+
+def hash_session_secret(secret: str) -> str:
+    """Keyed SHA-256 of a session secret.
+
+    Session secrets are 256-bit random values, so a slow password hash adds no protection;
+    the HMAC key keeps a leaked sessions table from being usable on its own.
+    """
+    mac = hmac.new(settings.session_hmac_secret.encode("utf-8"), secret.encode("utf-8"), hashlib.sha256)
+    return SESSION_HASH_PREFIX + mac.hexdigest()
+
+
+def verify_session_secret(secret: str, stored_hash: Optional[str]) -> Tuple[bool, bool]:
+    """Returns (valid, needs_upgrade). needs_upgrade is set for valid legacy bcrypt hashes."""
+    if not stored_hash:
+        return False, False
+    if stored_hash.startswith(SESSION_HASH_PREFIX):
+        return hmac.compare_digest(hash_session_secret(secret), stored_hash), False
+    valid = verify_password(secret, stored_hash)
+    return valid, valid
+
+
+async def verify_session_secret_async(secret: str, stored_hash: Optional[str]) -> Tuple[bool, bool]:
+    """`verify_session_secret` that only leaves the event loop for legacy bcrypt hashes."""
+    if not stored_hash or stored_hash.startswith(SESSION_HASH_PREFIX):
+        return verify_session_secret(secret, stored_hash)
+    return await _hashing_executor().run(verify_session_secret, secret, stored_hash)
+
+
 def generate_session_token() -> Tuple[str, str]:
-    """Returns tuple (secret, hashed) using bcrypt."""
+    """Returns tuple (secret, hashed) using a keyed SHA-256 digest."""
     secret = secrets.token_urlsafe(32)
-    hashed = bcrypt.hash(secret)
-    return secret, hashed
+    return secret, hash_session_secret(secret)
 
 
 def session_expiry(days: int = 30) -> datetime:
@@ -0,0 +1,57 @@
+"""
+Periodic cleanup of expired and revoked rows in `sessions`, run by the worker.
+
+Rows are kept for `session_retention_days` after they expire or are revoked, then deleted
+in small batches. When the table has been converted with db/optional/sessions_partitioned.sql,
+whole expired monthly partitions are dropped first and future partitions are created ahead;
+the batched delete then also clears stale rows from the default partition.
+"""
+from typing import Dict
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ..config import settings
+
+
+async def sessions_partitioned(db: AsyncSession) -> bool:
+    res = await db.execute(text("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass('sessions')"))
+    return bool(res.scalar())
+
+
+async def purge_sessions(db: AsyncSession) -> Dict[str, int]:
+    """Remove sessions past the retention window. Returns rows removed per method."""
+    removed = {"partition_drop": 0, "delete": 0}
+    params = {"days": settings.session_retention_days}
+    if await sessions_partitioned(db):
+        await db.execute(text("SELECT create_session_partitions(:ahead)"), {"ahead": settings.session_partition_months_ahead})
+        res = await db.execute(
+            text("SELECT drop_expired_session_partitions(now() - make_interval(days => :days))"),
+            params,
+        )
+        removed["partition_drop"] = int(res.scalar_one() or 0)
+        await db.commit()
+
+    # Revoked sessions in live partitions, or every stale row when the table is not partitioned
+    for _ in range(settings.session_purge_max_batches):
+        res = await db.execute(
+            text(
+                """
+                DELETE FROM sessions
+                WHERE (id, expires_at) IN (
+                    SELECT id, expires_at FROM sessions
+                    WHERE expires_at < now() - make_interval(days => :days)
+                       OR revoked_at < now() - make_interval(days => :days)
+                    LIMIT :lim
+                    FOR UPDATE SKIP LOCKED
+                )
+                """
+            ),
+            {**params, "lim": settings.session_purge_batch_size},
+        )
+        await db.commit()
+        deleted = res.rowcount or 0
+        removed["delete"] += deleted
+        if deleted < settings.session_purge_batch_size:
+            break
+    return removed
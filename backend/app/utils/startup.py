@@ -0,0 +1,172 @@
+"""
+Cold-start budget for the API process.
+
+Each measurement starts the API in a fresh interpreter the way a gunicorn worker does: `import
+app.main`, then the startup handlers (bucket check, health checker, invalidation listener and the
+other background tasks), with Postgres and S3 pointed at a closed local port so network waits are
+not counted. It records the import wall time, RSS after import and RSS once started;
+`-X importtime` supplies the per-module breakdown. Stripe and PyJWT are imported on first use and
+must not be loaded at all by startup. boto3 is kept out of `import app.main` (test processes and
+CLI tools never pay for it), but startup loads it for the bucket check and the health checker, so
+the started RSS includes it. `check` fails if a deferred SDK creeps back in or a budget is exceeded.
+
+    python -m app.utils.startup bench
+    python -m app.utils.startup check --import-budget-seconds 2.0 --rss-budget-mb 128
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from typing import Dict, List, Optional, Tuple
+
+
+IMPORT_BUDGET_SECONDS = 2.0
+# Resident memory of a started worker, not just of the import
+RSS_BUDGET_MB = 128
+
+# Loaded on first use by the endpoints that need them; neither import nor startup may load these
+LAZY_MODULES = ("stripe", "jwt")
+# Not imported by `import app.main`, but loaded by the startup handlers
+IMPORT_LAZY_MODULES = ("boto3", "botocore")
+
+_BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Dependencies refuse connections immediately instead of timing out or being retried
+_OFFLINE_ENV = {
+    "DB_HOST": "127.0.0.1",
+    "DB_PORT": "9",
+    "S3_ENDPOINT": "http://127.0.0.1:9",
+    "S3_MAX_ATTEMPTS": "1",
+}
+
+_PROBE = """
+import asyncio, json, sys, time
+
+
+def rss_mb():
+    rss_kb = 0
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    rss_kb = int(line.split()[1])
+    except OSError:
+        import resource
+        rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform == "darwin":
+            rss_kb //= 1024
+    return rss_kb / 1024
+
+
+started = time.perf_counter()
+import app.main
+result = {"seconds": time.perf_counter() - started, "rss_mb": rss_mb(), "modules": sorted(sys.modules)}
+
+
+async def start_and_stop(api):
+    started = time.perf_counter()
+    await api.router.startup()
+    result["startup_seconds"] = time.perf_counter() - started
+    await asyncio.sleep(0.5)  # let the background tasks finish their first round
+    result["started_rss_mb"] = rss_mb()
+    result["started_modules"] = sorted(sys.modules)
+    await api.router.shutdown()
+
+
+asyncio.run(start_and_stop(app.main.app))
+print(json.dumps(result))
+"""
+
+
+def _run(args: List[str], env: Optional[Dict[str, str]] = None) -> subprocess.CompletedProcess:
+    return subprocess.run(
+        [sys.executable, *args],
+        cwd=_BACKEND_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+        env={**os.environ, **env} if env else None,
+    )
+
+
+def measure(runs: int = 3) -> Dict:
+    """Medians over `runs` fresh interpreters of import time, RSS after import, startup time and
+    RSS once started, plus the deferred SDKs that were loaded anyway."""
+    samples = [json.loads(_run(["-c", _PROBE], env=_OFFLINE_ENV).stdout.splitlines()[-1]) for _ in range(runs)]
+    imported, started = set(samples[0]["modules"]), set(samples[0]["started_modules"])
+    return {
+        "seconds": statistics.median(s["seconds"] for s in samples),
+        "rss_mb": statistics.median(s["rss_mb"] for s in samples),
+        "startup_seconds": statistics.median(s["startup_seconds"] for s in samples),
+        "started_rss_mb": statistics.median(s["started_rss_mb"] for s in samples),
+        "eager_heavy": [m for m in IMPORT_LAZY_MODULES if m in imported] + [m for m in LAZY_MODULES if m in started],
+    }
+
+
+def import_breakdown(module: str = "app.main", depth: int = 2) -> List[Tuple[str, int, int]]:
+    """(module, self_us, cumulative_us) from `-X importtime`, for modules nested at most `depth` deep."""
+    stderr = _run(["-X", "importtime", "-c", f"import {module}"]).stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|", 2)
+        if not own.strip().isdigit():
+            continue  # header row
+        level = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        if level <= depth:
+            rows.append((name.strip(), int(own), int(cumulative)))
+    return rows
+
+
+def check(import_budget_seconds: float = IMPORT_BUDGET_SECONDS, rss_budget_mb: float = RSS_BUDGET_MB, runs: int = 3) -> List[str]:
+    """Budget violations for starting the API (empty when within budget)."""
+    result = measure(runs=runs)
+    problems = []
+    if result["seconds"] > import_budget_seconds:
+        problems.append(f"import app.main took {result['seconds']:.2f}s (budget {import_budget_seconds:.2f}s)")
+    if result["started_rss_mb"] > rss_budget_mb:
+        problems.append(f"RSS after startup is {result['started_rss_mb']:.0f} MB (budget {rss_budget_mb:.0f} MB)")
+    for name in result["eager_heavy"]:
+        problems.append(f"{name} is imported at startup; import it where it is used")
+    return problems
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.utils.startup")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    bench = sub.add_parser("bench", help="import and startup time, RSS and the slowest imports of app.main")
+    bench.add_argument("--runs", type=int, default=5)
+    bench.add_argument("--top", type=int, default=15)
+    budget = sub.add_parser("check", help="exit 1 if startup exceeds its budget")
+    budget.add_argument("--runs", type=int, default=3)
+    budget.add_argument("--import-budget-seconds", type=float, default=IMPORT_BUDGET_SECONDS)
+    budget.add_argument("--rss-budget-mb", type=float, default=RSS_BUDGET_MB)
+    args = parser.parse_args(argv)
+
+    if args.cmd == "check":
+        problems = check(args.import_budget_seconds, args.rss_budget_mb, args.runs)
+        for problem in problems:
+            print(problem)
+        if not problems:
+            print("startup within budget")
+        return 1 if problems else 0
+
+    result = measure(runs=args.runs)
+    print(f"import app.main   {result['seconds'] * 1000:7.0f} ms  (median of {args.runs})")
+    print(f"startup handlers  {result['startup_seconds'] * 1000:7.0f} ms  (dependencies offline)")
+    print(f"RSS after import  {result['rss_mb']:7.0f} MB")
+    print(f"RSS after startup {result['started_rss_mb']:7.0f} MB")
+    print(f"heavy modules loaded eagerly: {', '.join(result['eager_heavy']) or 'none'}")
+    print()
+    print(f"{'cumulative ms':>14} {'self ms':>8}  module")
+    rows = sorted(import_breakdown(), key=lambda r: r[2], reverse=True)[: args.top]
+    for name, own, cumulative in rows:
+        print(f"{cumulative / 1000:14.1f} {own / 1000:8.1f}  {name}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
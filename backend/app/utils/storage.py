@@ -1,24 +1,101 @@
-import boto3
-from botocore.client import Config
+"""
+S3/MinIO access.
+
+One boto3 client per process, built on first use (botocore's service model is parsed once) with a
+connection pool sized for the storage executor, bounded timeouts and standard retries. boto3
+clients are thread-safe once created. Presigning is local signing and stays synchronous; calls
+that go over the network have `*_async` variants that run on the bounded "storage" executor so
+handlers never block the event loop on S3.
+
+    python -m app.utils.storage bench
+"""
+import threading
+import time
 from datetime import timedelta
-from typing import Optional, List
+from typing import Any, Callable, Optional, List
+
+from prometheus_client import Histogram
+
 from ..config import settings
 from ..errors import AppError
+from .cache import MISSING, LRUCache
+from .executors import BoundedExecutor, get_executor
 from urllib.parse import urlparse, urlunparse
 
 
-def _client():
-    return boto3.client(
+STORAGE_LATENCY = Histogram(
+    "storage_request_latency_seconds",
+    "Latency of S3 calls",
+    ["op", "outcome"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+
+_client_instance = None
+_client_lock = threading.Lock()
+
+# Receipt image URLs are reused for half their lifetime: one signature per object instead of one
+# per response, and a stable URL the app can cache the image under
+_image_urls = LRUCache(maxsize=50000, ttl_seconds=settings.receipt_image_url_expires_seconds / 2)
+
+
+def _new_client(endpoint_url: Optional[str] = None):
+    # boto3/botocore are imported on first use, not when the API process starts
+    import boto3
+    from botocore.client import Config
+
+    # A private session: boto3's default session is not safe to create clients from concurrently
+    return boto3.session.Session().client(
         "s3",
-        endpoint_url=settings.s3_endpoint,
+        endpoint_url=endpoint_url or settings.s3_endpoint,
         aws_access_key_id=settings.s3_access_key,
         aws_secret_access_key=settings.s3_secret_key,
         region_name=settings.s3_region,
         use_ssl=settings.s3_use_ssl,
-        config=Config(signature_version="s3v4"),
+        config=Config(
+            signature_version="s3v4",
+            max_pool_connections=settings.s3_max_pool_connections,
+            connect_timeout=settings.s3_connect_timeout_seconds,
+            read_timeout=settings.s3_read_timeout_seconds,
+            retries={"max_attempts": settings.s3_max_attempts, "mode": "standard"},
+            tcp_keepalive=True,
+        ),
     )
 
 
+def _client():
+    global _client_instance
+    client = _client_instance
+    if client is None:
+        with _client_lock:
+            if _client_instance is None:
+                _client_instance = _new_client()
+            client = _client_instance
+    return client
+
+
+def close_client() -> None:
+    global _client_instance
+    with _client_lock:
+        client, _client_instance = _client_instance, None
+    if client is not None:
+        client.close()
+
+
+def storage_executor() -> BoundedExecutor:
+    return get_executor("storage", settings.storage_executor_workers, settings.storage_executor_queue)
+
+
+def _timed(op: str, fn: Callable[..., Any], *args: Any) -> Any:
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        result = fn(*args)
+        outcome = "ok"
+        return result
+    finally:
+        STORAGE_LATENCY.labels(op=op, outcome=outcome).observe(time.perf_counter() - started)
+
+
 def ensure_bucket():
     s3 = _client()
     try:
@@ -51,17 +128,18 @@ def presign_put(object_key: str, content_type: Optional[str] = None, expires: in
 
 
 def download_bytes(object_key: str) -> bytes:
-    s3 = _client()
-    obj = s3.get_object(Bucket=settings.s3_bucket, Key=object_key)
-    return obj["Body"].read()
+    def _get():
+        obj = _client().get_object(Bucket=settings.s3_bucket, Key=object_key)
+        return obj["Body"].read()
+
+    return _timed("get_object", _get)
 
 
 def upload_bytes(object_key: str, data: bytes, content_type: Optional[str] = None) -> None:
-    s3 = _client()
     params = {"Bucket": settings.s3_bucket, "Key": object_key, "Body": data}
     if content_type:
         params["ContentType"] = content_type
-    s3.put_object(**params)
+    _timed("put_object", lambda: _client().put_object(**params))
 
 
 def presign_get(object_key: str, expires: int = 900) -> str:
@@ -74,14 +152,38 @@ def presign_get(object_key: str, expires: int = 900) -> str:
     return _rewrite_public(url)
 
 
+def presign_image(object_key: str) -> str:
+    """Presigned GET for a receipt image derivative (event loop only, like the LRU it uses)."""
+    url = _image_urls.get(object_key)
+    if url is MISSING:
+        url = presign_get(object_key, expires=settings.receipt_image_url_expires_seconds)
+        _image_urls.set(object_key, url)
+    return url
+
+
 def head_object(object_key: str):
-    s3 = _client()
     try:
-        return s3.head_object(Bucket=settings.s3_bucket, Key=object_key)
+        return _timed("head_object", lambda: _client().head_object(Bucket=settings.s3_bucket, Key=object_key))
     except Exception:
         raise AppError(code="OBJECT_NOT_FOUND", message="Uploaded object not found", status_code=400)
 
 
+async def head_object_async(object_key: str):
+    return await storage_executor().run(head_object, object_key)
+
+
+async def download_bytes_async(object_key: str) -> bytes:
+    return await storage_executor().run(download_bytes, object_key)
+
+
+async def upload_bytes_async(object_key: str, data: bytes, content_type: Optional[str] = None) -> None:
+    await storage_executor().run(upload_bytes, object_key, data, content_type)
+
+
+async def delete_prefix_async(prefix: str) -> int:
+    return await storage_executor().run(delete_prefix, prefix)
+
+
 def _rewrite_public(url: str) -> str:
     if not settings.s3_public_endpoint:
         return url
@@ -137,3 +239,89 @@ def s3_ready() -> bool:
         return False
 
 
+# ---------------------------------------------------------------------------
+# Per-call latency: python -m app.utils.storage bench
+# ---------------------------------------------------------------------------
+
+def _stub_server():
+    """Local HTTP/1.1 endpoint answering HeadObject, so the bench needs no MinIO."""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_HEAD(self):
+            self.send_response(200)
+            self.send_header("Content-Type", "image/jpeg")
+            self.send_header("Content-Length", "48213")
+            self.send_header("ETag", '"d41d8cd98f00b204e9800998ecf8427e"')
+            self.send_header("Last-Modified", "Mon, 05 Oct 2026 10:00:00 GMT")
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="s3-stub", daemon=True).start()
+    return server
+
+
+def _per_call_client(endpoint_url: str):
+    # What every storage call used to do: a fresh client from boto3's default session
+    import boto3
+    from botocore.client import Config
+
+    return boto3.client(
+        "s3",
+        endpoint_url=endpoint_url,
+        aws_access_key_id=settings.s3_access_key,
+        aws_secret_access_key=settings.s3_secret_key,
+        region_name=settings.s3_region,
+        use_ssl=settings.s3_use_ssl,
+        config=Config(signature_version="s3v4"),
+    )
+
+
+def _bench_op(calls: int, get_client: Callable[[], Any], op: str) -> float:
+    started = time.perf_counter()
+    for i in range(calls):
+        s3 = get_client()
+        if op == "presign_get":
+            s3.generate_presigned_url(ClientMethod="get_object", Params={"Bucket": settings.s3_bucket, "Key": f"receipts/u/{i}.jpg"}, ExpiresIn=900)
+        else:
+            s3.head_object(Bucket=settings.s3_bucket, Key=f"receipts/u/{i}.jpg")
+    return (time.perf_counter() - started) / calls * 1e3
+
+
+def main(argv=None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="python -m app.utils.storage")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    bench = sub.add_parser("bench", help="per-call latency: new client per call vs the shared client")
+    bench.add_argument("--calls", type=int, default=200)
+    bench.add_argument("--endpoint", default="", help="S3 endpoint for head_object (default: a local stub server)")
+    args = parser.parse_args(argv)
+
+    server = None
+    endpoint = args.endpoint
+    if not endpoint:
+        server = _stub_server()
+        endpoint = f"http://127.0.0.1:{server.server_address[1]}"
+    shared = _new_client(endpoint)
+    try:
+        for op in ("presign_get", "head_object"):
+            before = _bench_op(args.calls, lambda: _per_call_client(endpoint), op)
+            _bench_op(min(20, args.calls), lambda: shared, op)  # warm the pool
+            after = _bench_op(args.calls, lambda: shared, op)
+            print(f"{op:<12} new client per call {before:8.2f} ms   shared client {after:8.2f} ms   ({before / after:.0f}x)")
+    finally:
+        shared.close()
+        if server is not None:
+            server.shutdown()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,215 @@
+"""
+Lightweight span tracing across the API and the worker.
+
+A trace starts at the edge middleware (or continues an inbound W3C `traceparent`), its
+context is stored as a `traceparent` on the job rows a request enqueues, and the worker resumes
+it so one trace covers upload -> queue wait -> download/OCR/parse/categorize/insert/badges.
+
+Finished spans are written as JSON lines by a buffered writer (TRACE_EXPORT_PATH: a file a
+collector can tail, or "-" for stdout). With no path configured tracing is off and `span()`
+costs a context-variable lookup.
+
+    python -m app.utils.tracing bench
+"""
+import os
+import random
+import sys
+import time
+from contextvars import ContextVar
+from typing import Optional, Tuple
+
+from ..config import settings
+from .logger import BufferedLogger
+
+
+_current: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+
+_exporter: Optional[BufferedLogger] = None
+
+
+def parse_traceparent(value: Optional[str]) -> Optional[Tuple[str, str, bool]]:
+    """"00-<trace_id>-<span_id>-<flags>" -> (trace_id, span_id, sampled), or None if malformed."""
+    if not value:
+        return None
+    parts = value.strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16 or len(parts[3]) != 2:
+        return None
+    try:
+        int(parts[1], 16), int(parts[2], 16), int(parts[3], 16)
+    except ValueError:
+        return None
+    if parts[1] == "0" * 32 or parts[2] == "0" * 16:
+        return None
+    return parts[1], parts[2], bool(int(parts[3], 16) & 1)
+
+
+class Span:
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "start_ns", "attrs", "status", "_token")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], attrs: dict, start_ns: Optional[int] = None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = "%016x" % random.getrandbits(64)
+        self.parent_id = parent_id
+        self.start_ns = start_ns or time.time_ns()
+        self.attrs = attrs
+        self.status = "ok"
+        self._token = None
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def set(self, key: str, value) -> None:
+        self.attrs[key] = value
+
+    def rename(self, name: str) -> None:
+        self.name = name
+
+    def end(self, end_ns: Optional[int] = None) -> None:
+        end_ns = end_ns or time.time_ns()
+        exporter = _exporter
+        if exporter is not None:
+            exporter.emit({
+                "trace_id": self.trace_id,
+                "span_id": self.span_id,
+                "parent_id": self.parent_id,
+                "name": self.name,
+                "start_us": self.start_ns // 1000,
+                "duration_us": (end_ns - self.start_ns) // 1000,
+                "status": self.status,
+                "attrs": self.attrs,
+            })
+
+    def __enter__(self) -> "Span":
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc is not None:
+            self.status = "error"
+            self.attrs["error"] = f"{exc_type.__name__}: {exc}"[:500]
+        self.end()
+        _current.reset(self._token)
+
+
+class _NoopSpan:
+    traceparent = None
+
+    def set(self, key: str, value) -> None:
+        pass
+
+    def rename(self, name: str) -> None:
+        pass
+
+    def end(self, end_ns: Optional[int] = None) -> None:
+        pass
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def start_trace(name: str, traceparent: Optional[str] = None, start_ns: Optional[int] = None, **attrs):
+    """Root span of this process's part of a trace; continues `traceparent` when it is valid."""
+    if _exporter is None:
+        return NOOP_SPAN
+    parent = parse_traceparent(traceparent)
+    if parent is not None:
+        trace_id, parent_id, sampled = parent
+        if not sampled:
+            return NOOP_SPAN
+    else:
+        if settings.trace_sample_ratio < 1.0 and random.random() >= settings.trace_sample_ratio:
+            return NOOP_SPAN
+        trace_id, parent_id = "%032x" % random.getrandbits(128), None
+    return Span(name, trace_id, parent_id, attrs, start_ns)
+
+
+def span(name: str, **attrs):
+    """Child of the current span (no-op outside a trace). Use as `with span("ocr"): ...`."""
+    parent = _current.get()
+    if parent is None:
+        return NOOP_SPAN
+    return Span(name, parent.trace_id, parent.span_id, attrs)
+
+
+def record_span(name: str, start_ns: int, end_ns: int, **attrs) -> None:
+    """Add an already-finished child of the current span (e.g. time a job spent queued)."""
+    parent = _current.get()
+    if parent is None:
+        return
+    Span(name, parent.trace_id, parent.span_id, attrs, start_ns).end(end_ns)
+
+
+def current_traceparent() -> Optional[str]:
+    current = _current.get()
+    return current.traceparent if current is not None else None
+
+
+def configure_tracing(path: Optional[str] = None) -> None:
+    """Enable span export to `path` (default TRACE_EXPORT_PATH; "-" = stdout)."""
+    global _exporter
+    path = settings.trace_export_path if path is None else path
+    if not path or _exporter is not None:
+        return
+    stream = sys.stdout if path == "-" else open(path, "a", encoding="utf-8")
+    exporter = BufferedLogger(
+        max_queue=settings.trace_queue_size,
+        sample_above=1.0,
+        sample_rate=1,
+        flush_interval=settings.log_flush_interval_ms / 1000.0,
+        stream=stream,
+    )
+    exporter.start()
+    _exporter = exporter
+
+
+def shutdown_tracing() -> None:
+    global _exporter
+    exporter, _exporter = _exporter, None
+    if exporter is not None:
+        exporter.stop()
+        if exporter.stream is not sys.stdout:
+            exporter.stream.close()
+
+
+# ---------------------------------------------------------------------------
+# Overhead benchmark: python -m app.utils.tracing bench
+# ---------------------------------------------------------------------------
+
+def _bench(n: int) -> float:
+    started = time.perf_counter()
+    for _ in range(n):
+        with span("stage", n=1):
+            pass
+    return (time.perf_counter() - started) / n * 1e6
+
+
+def main(argv=None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="python -m app.utils.tracing")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    bench = sub.add_parser("bench", help="per-span overhead, tracing off vs exporting")
+    bench.add_argument("--spans", type=int, default=100000)
+    bench.add_argument("--out", default=os.devnull, help="export target while enabled")
+    args = parser.parse_args(argv)
+
+    off = _bench(args.spans)
+    configure_tracing(args.out)
+    with start_trace("bench"):
+        on = _bench(args.spans)
+    shutdown_tracing()
+    print(f"tracing off      {off:7.2f} us/span")
+    print(f"tracing on       {on:7.2f} us/span  (exported to {args.out})")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,44 @@
+"""
+Multi-process launch for the API: gunicorn supervising uvicorn workers.
+
+    gunicorn -c gunicorn.conf.py app.main:app
+
+Prometheus runs in multiprocess mode: every worker writes its metrics to mmap files under
+PROMETHEUS_MULTIPROC_DIR and /metrics aggregates them. The directory is emptied when the master
+starts (stale files from a previous run would be summed in) and a dead worker's live gauges
+are discarded as soon as it exits.
+
+With more than one worker, rate-limit buckets default to the shared Postgres backend: per-process
+buckets would multiply every limit by the worker count. RATE_LIMIT_BACKEND still overrides.
+"""
+import glob
+import multiprocessing
+import os
+
+
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/prometheus-multiproc")
+
+bind = os.environ.get("BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+if workers > 1:
+    # Inherited by the forked workers before they load app.config
+    os.environ.setdefault("RATE_LIMIT_BACKEND", "postgres")
+worker_class = "uvicorn.workers.UvicornWorker"
+# A worker whose event loop stops heartbeating for this long is killed and replaced
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 60))
+graceful_timeout = 30
+keepalive = 5
+accesslog = None  # requests are logged by the app's edge middleware
+
+
+def on_starting(server):
+    path = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    os.makedirs(path, exist_ok=True)
+    for stale in glob.glob(os.path.join(path, "*.db")):
+        os.remove(stale)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
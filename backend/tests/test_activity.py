@@ -0,0 +1,105 @@
+import asyncio
+
+from app.utils import activity as activity_module
+from app.utils.activity import ActivityBuffer
+
+
+class FakeSession:
+    """Async context manager standing in for AsyncSessionLocal(); `fail` makes every execute raise."""
+
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.statements = []
+        self.commits = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def execute(self, stmt, params=None):
+        if self.fail:
+            raise ConnectionError("database unreachable")
+        self.statements.append((str(stmt), dict(params or {})))
+
+    async def commit(self):
+        self.commits += 1
+
+
+def _use(monkeypatch, db):
+    monkeypatch.setattr(activity_module, "AsyncSessionLocal", lambda: db)
+
+
+def test_touches_of_one_session_are_coalesced(monkeypatch):
+    buf = ActivityBuffer(max_entries=100)
+    for _ in range(50):
+        buf.touch_session("s1")
+    buf.touch_session("s2")
+    buf.touch_device("u1", "tok")
+    buf.touch_device("u1", "tok")
+    assert len(buf) == 3
+    latest = buf._sessions["s1"]
+
+    db = FakeSession()
+    _use(monkeypatch, db)
+    asyncio.run(buf.flush())
+    sessions = [params for sql, params in db.statements if "UPDATE sessions" in sql]
+    assert len(sessions) == 1
+    assert sessions[0]["ids"] == ["s1", "s2"]
+    assert sessions[0]["seen"][0] == latest
+
+
+def test_flush_issues_one_unnest_update_per_table(monkeypatch):
+    buf = ActivityBuffer(max_entries=100)
+    for i in range(10):
+        buf.touch_session(f"s{i}")
+        buf.touch_device(f"u{i}", f"tok{i}")
+    db = FakeSession()
+    _use(monkeypatch, db)
+    asyncio.run(buf.flush())
+    assert len(db.statements) == 2
+    assert all("unnest(" in sql for sql, _ in db.statements)
+    assert db.statements[1][1]["tokens"] == [f"tok{i}" for i in range(10)]
+    assert db.commits == 1
+    assert len(buf) == 0
+    # Nothing buffered: no session is opened at all
+    _use(monkeypatch, None)
+    asyncio.run(buf.flush())
+
+
+def test_failed_flush_restores_entries(monkeypatch):
+    buf = ActivityBuffer(max_entries=100)
+    buf.touch_session("s1")
+    buf.touch_device("u1", "tok")
+    seen = buf._sessions["s1"]
+    _use(monkeypatch, FakeSession(fail=True))
+    asyncio.run(buf.flush())
+    assert buf._sessions == {"s1": seen}
+    assert list(buf._devices) == [("u1", "tok")]
+
+    # The next flush writes them
+    db = FakeSession()
+    _use(monkeypatch, db)
+    asyncio.run(buf.flush())
+    assert db.statements[0][1]["ids"] == ["s1"]
+    assert len(buf) == 0
+
+
+def test_restore_keeps_newer_touches_and_the_cap(monkeypatch):
+    buf = ActivityBuffer(max_entries=2)
+    buf.touch_session("s1")
+    buf.touch_session("s2")
+    old = dict(buf._sessions)
+
+    class TouchThenFail(FakeSession):
+        async def execute(self, stmt, params=None):
+            # Requests keep arriving while the flush is in flight
+            buf.touch_session("s1")
+            raise ConnectionError("database unreachable")
+
+    _use(monkeypatch, TouchThenFail())
+    asyncio.run(buf.flush())
+    assert buf._sessions["s1"] >= old["s1"]
+    assert buf._sessions["s2"] == old["s2"]
+    assert len(buf) == 2
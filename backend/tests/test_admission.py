@@ -0,0 +1,65 @@
+import asyncio
+
+import pytest
+
+from app.utils.admission import AdaptiveLimit, Rejected, class_limits, classify
+
+
+def test_classify_routes():
+    assert classify("GET", "/healthz") is None
+    assert classify("POST", "/v1/auth/login") == "auth"
+    assert classify("GET", "/v1/analytics/trends") == "analytics"
+    assert classify("GET", "/v1/transactions") == "read"
+    assert classify("PATCH", "/v1/transactions/abc") == "write"
+
+
+def test_bounded_queue_and_deadline():
+    async def run():
+        lim = AdaptiveLimit("t", max_limit=1, max_queue=1, queue_timeout=0.05, target_latency=1.0)
+        await lim.acquire()
+        waiter = asyncio.create_task(lim.acquire())
+        await asyncio.sleep(0)
+        with pytest.raises(Rejected) as full:
+            await lim.acquire()
+        with pytest.raises(Rejected) as timeout:
+            await waiter
+        return full.value.reason, timeout.value.reason, lim.inflight
+    assert asyncio.run(run()) == ("queue_full", "queue_timeout", 1)
+
+
+def test_release_hands_slot_to_waiter():
+    async def run():
+        lim = AdaptiveLimit("t", max_limit=1, max_queue=5, queue_timeout=1.0, target_latency=1.0)
+        await lim.acquire()
+        waiter = asyncio.create_task(lim.acquire())
+        await asyncio.sleep(0)
+        lim.release(0.01)
+        await waiter
+        return lim.inflight
+    assert asyncio.run(run()) == 1
+
+
+def test_limit_adapts_to_latency():
+    async def run():
+        lim = AdaptiveLimit("t", max_limit=10, max_queue=0, queue_timeout=0.1, target_latency=0.0)
+        await lim.acquire()
+        lim.release(5.0)
+        decreased = lim.limit
+        lim.target_latency = 1.0
+        for _ in range(20):
+            await lim.acquire()
+            lim.release(0.01)
+        return decreased, lim.limit
+    decreased, recovered = asyncio.run(run())
+    assert decreased == 9.0
+    assert recovered == 10.0
+
+
+def test_class_limits_fit_the_db_pool():
+    # Default pool (5 + 10 overflow) split by share
+    assert class_limits("", 15) == {"auth": 2, "analytics": 1, "write": 4, "read": 8}
+    assert sum(class_limits("", 30).values()) == 30
+    # Explicit limits within the pool are kept; overcommitted ones are scaled down to it
+    assert class_limits("auth=3,analytics=2,write=4,read=6", 15) == {"auth": 3, "analytics": 2, "write": 4, "read": 6}
+    scaled = class_limits("auth=8,analytics=4,write=16,read=32", 15)
+    assert sum(scaled.values()) <= 15 and scaled["read"] > scaled["write"] > scaled["auth"] >= scaled["analytics"] >= 1
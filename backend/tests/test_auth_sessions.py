@@ -0,0 +1,50 @@
+import os
+import uuid
+import requests
+
+BASE = os.environ.get("BASE_URL", "http://localhost:8000")
+
+
+def _login():
+    email = f"sess-{uuid.uuid4().hex[:10]}@example.com"
+    requests.post(f"{BASE}/v1/auth/signup", json={"email": email, "password": "Passw0rd!"})
+    r = requests.post(f"{BASE}/v1/auth/login", json={"email": email, "password": "Passw0rd!"})
+    assert r.status_code == 200
+    return r.json()["token"]
+
+
+def _me(token):
+    return requests.get(f"{BASE}/v1/auth/me", headers={"Authorization": f"Bearer {token}"})
+
+
+def test_logout_revokes_cached_principal():
+    token = _login()
+    assert _me(token).status_code == 200
+    assert _me(token).status_code == 200  # second call served from the principal cache
+    requests.post(f"{BASE}/v1/auth/logout", headers={"Authorization": f"Bearer {token}"})
+    assert _me(token).status_code == 401
+
+
+def test_rotate_revokes_old_token():
+    token = _login()
+    assert _me(token).status_code == 200
+    r = requests.post(f"{BASE}/v1/auth/rotate", headers={"Authorization": f"Bearer {token}"})
+    assert r.status_code == 200
+    assert _me(token).status_code == 401
+    assert _me(r.json()["token"]).status_code == 200
+
+
+def test_cached_principal_rejects_wrong_secret():
+    token = _login()
+    assert _me(token).status_code == 200
+    session_id = token.split(".", 1)[0]
+    assert _me(f"{session_id}.not-the-secret").status_code == 401
+
+
+def test_profile_update_visible_in_me():
+    token = _login()
+    headers = {"Authorization": f"Bearer {token}"}
+    assert _me(token).status_code == 200
+    r = requests.patch(f"{BASE}/v1/profile", json={"display_name": "Cache Check"}, headers=headers)
+    assert r.status_code == 200
+    assert _me(token).json()["profile"]["display_name"] == "Cache Check"
@@ -0,0 +1,75 @@
+import pytest
+
+from app.config import settings
+from app.utils import categorize, category_model
+from app.utils.category_model import CategoryModel
+
+
+ROWS = [
+    ("STARBUCKS #1234", "latte grande coffee", "dining"),
+    ("BLUE BOTTLE COFFEE", "cappuccino coffee", "dining"),
+    ("JOE'S PIZZA", "pizza slice soda", "dining"),
+    ("KROGER #55", "milk eggs bread produce", "groceries"),
+    ("SAFEWAY STORE 0042", "bananas milk cheese", "groceries"),
+    ("TRADER JOE'S", "eggs bread produce", "groceries"),
+    ("SHELL OIL 5731", "unleaded fuel pump 4", "transport"),
+    ("CHEVRON", "diesel fuel", "transport"),
+]
+
+
+@pytest.fixture
+def model():
+    return CategoryModel.fit([r[0] for r in ROWS], [r[1] for r in ROWS], [r[2] for r in ROWS], n_features=1 << 12)
+
+
+@pytest.fixture
+def fresh_model_cache(monkeypatch):
+    monkeypatch.setattr(category_model, "_model", None)
+    monkeypatch.setattr(category_model, "_model_loaded", False)
+
+
+def test_fit_predict_is_deterministic(model):
+    preds = model.predict_batch(["STARBUCKS #99", "KROGER", "SHELL"], ["coffee", "milk bread", "fuel"])
+    assert [c for c, _ in preds] == ["dining", "groceries", "transport"]
+    assert all(0.5 < p <= 1.0 for _, p in preds)
+    again = CategoryModel.fit([r[0] for r in ROWS], [r[1] for r in ROWS], [r[2] for r in ROWS], n_features=1 << 12)
+    assert again.predict_batch(["STARBUCKS #99"], ["coffee"]) == preds[:1]
+    # No features at all: no guess
+    assert model.predict(None, "") == (None, 0.0)
+
+
+def test_save_load_round_trip(model, tmp_path):
+    path = str(tmp_path / "nb.npz")
+    model.save(path)
+    loaded = CategoryModel.load(path)
+    assert loaded.predict_batch(["CHEVRON"], ["fuel"]) == model.predict_batch(["CHEVRON"], ["fuel"])
+
+
+def test_n_features_must_be_power_of_two():
+    with pytest.raises(ValueError):
+        CategoryModel.fit(["a"], [None], ["dining"], n_features=1000)
+
+
+def test_fallback_applies_confidence_threshold(model, monkeypatch):
+    monkeypatch.setattr(categorize, "get_model", lambda: model)
+    items = [("STARBUCKS", "coffee latte"), ("UNKNOWN VENDOR", None)]
+    (_, confident), (_, unsure) = model.predict_batch([m for m, _ in items], [t for _, t in items])
+    monkeypatch.setattr(settings, "category_model_min_confidence", (confident + unsure) / 2)
+    assert categorize._ml_categorize_batch(items) == ["dining", None]
+    monkeypatch.setattr(settings, "category_model_min_confidence", 0.0)
+    assert categorize._ml_categorize_batch(items)[1] is not None
+
+
+def test_unreadable_model_is_logged_and_counted(tmp_path, monkeypatch, fresh_model_cache):
+    bad = tmp_path / "broken.npz"
+    bad.write_bytes(b"not a model")
+    monkeypatch.setattr(settings, "category_model_path", str(bad))
+    logged = []
+    monkeypatch.setattr(category_model.log, "exception", lambda msg, exc, **fields: logged.append((msg, fields)))
+    before = category_model.MODEL_LOAD_FAILURES._value.get()
+    assert category_model.get_model() is None
+    assert category_model.MODEL_LOAD_FAILURES._value.get() == before + 1
+    assert logged == [("category model failed to load", {"path": str(bad)})]
+    # Not retried on every call
+    assert category_model.get_model() is None
+    assert len(logged) == 1
@@ -0,0 +1,34 @@
+from sqlalchemy import create_engine, text
+
+from app.utils import dbstats
+
+
+def test_statements_counted_only_inside_request():
+    engine = create_engine("sqlite://")
+    dbstats.instrument_engine(engine)
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))  # outside a request: not recorded
+        stats = dbstats.begin_request()
+        for _ in range(3):
+            conn.execute(text("SELECT 1"))
+    assert stats.queries == 3
+    assert stats.db_seconds > 0
+    assert dbstats.current_stats() is stats
+
+
+def test_repeated_shapes_flagged_in_debug_mode():
+    engine = create_engine("sqlite://")
+    dbstats.instrument_engine(engine)
+    with engine.connect() as conn:
+        stats = dbstats.begin_request(track_shapes=True)
+        conn.execute(text("SELECT 1"))
+        for i in range(4):
+            conn.execute(text("SELECT :x + 1"), {"x": i})
+    assert stats.queries == 5
+    assert [n for _, n in stats.repeated(3)] == [4]
+
+
+def test_statement_shape_collapses_literals_and_placeholders():
+    a = dbstats.statement_shape("SELECT * FROM t WHERE id = $1 AND k IN ($2, $3) LIMIT 10")
+    b = dbstats.statement_shape("SELECT *  FROM t\n WHERE id = $1 AND k IN ($2) LIMIT 50")
+    assert a == b
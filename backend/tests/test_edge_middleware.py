@@ -0,0 +1,77 @@
+import asyncio
+import json
+
+from app.utils.admission import AdmissionController
+from app.utils.observability import EdgeMiddleware
+from app.utils.ratelimit import RateLimiter
+
+
+async def _echo(scope, receive, send):
+    more = True
+    while more:
+        message = await receive()
+        more = message.get("more_body", False)
+    await send({"type": "http.response.start", "status": 200, "headers": [(b"x-frame-options", b"SAMEORIGIN")]})
+    await send({"type": "http.response.body", "body": b"ok"})
+
+
+def _send(app, chunks, headers=(), path="/x"):
+    scope = {"type": "http", "method": "POST", "path": path, "headers": list(headers), "client": ("1.2.3.4", 1)}
+    pending = list(chunks)
+    sent = []
+
+    async def receive():
+        body = pending.pop(0)
+        return {"type": "http.request", "body": body, "more_body": bool(pending)}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(app(scope, receive, send))
+    return sent
+
+
+def _call(app, chunks, headers=()):
+    sent = _send(app, chunks, headers)
+    return sent[0]["status"], dict(sent[0]["headers"])
+
+
+def _error_with_request_id(sent):
+    body = json.loads(b"".join(m.get("body", b"") for m in sent[1:]))
+    assert body["error"]["request_id"] == dict(sent[0]["headers"])[b"x-request-id"].decode()
+    return sent[0]["status"], body["error"]["code"]
+
+
+def test_security_headers_and_request_id_added_once():
+    status, headers = _call(EdgeMiddleware(_echo, max_body_bytes=100, log_json=False), [b"{}"])
+    assert status == 200
+    assert headers[b"x-content-type-options"] == b"nosniff"
+    assert headers[b"x-frame-options"] == b"SAMEORIGIN"  # handler's own value wins
+    assert len(headers[b"x-request-id"]) == 36
+
+
+def test_declared_length_over_limit_rejected_without_reading():
+    status, _ = _call(EdgeMiddleware(_echo, max_body_bytes=10, log_json=False), [], [(b"content-length", b"11")])
+    assert status == 413
+
+
+def test_streamed_body_over_limit_rejected():
+    status, headers = _call(EdgeMiddleware(_echo, max_body_bytes=10, log_json=False), [b"x" * 6, b"x" * 6])
+    assert status == 413
+    assert b"x-request-id" in headers
+
+
+def test_rejections_carry_the_request_id():
+    edge = EdgeMiddleware(_echo, max_body_bytes=10, log_json=False)
+    assert _error_with_request_id(_send(edge, [], [(b"content-length", b"11")])) == (413, "REQUEST_TOO_LARGE")
+    assert _error_with_request_id(_send(edge, [b"x" * 6, b"x" * 6])) == (413, "REQUEST_TOO_LARGE")
+
+    limited = EdgeMiddleware(RateLimiter(_echo, default="1/60", rules="", backend="memory"), log_json=False)
+    assert _send(limited, [b"{}"])[0]["status"] == 200
+    assert _error_with_request_id(_send(limited, [b"{}"])) == (429, "RATE_LIMITED")
+
+    admission = AdmissionController(_echo)
+    for limit in admission.classes.values():
+        limit.inflight, limit.max_queue = limit.limit, 0  # saturated with no room to queue
+    overloaded = EdgeMiddleware(admission, log_json=False)
+    assert _error_with_request_id(_send(overloaded, [b"{}"], path="/v1/transactions")) == (503, "OVERLOADED")
@@ -0,0 +1,35 @@
+import asyncio
+
+from app.utils.health import HealthChecker
+
+
+async def _ok():
+    pass
+
+
+async def _broken():
+    raise ConnectionError("refused")
+
+
+async def _hangs():
+    await asyncio.sleep(10)
+
+
+def test_snapshot_reports_each_dependency():
+    checker = HealthChecker({"db": _ok, "storage": _broken, "cache": _hangs}, interval=5, timeout=0.05)
+    assert checker.snapshot()["ready"] is False  # nothing checked yet
+    asyncio.run(checker.refresh())
+    body = checker.snapshot()
+    assert body["ready"] is False
+    assert body["db"] is True and body["storage"] is False and body["cache"] is False
+    assert body["checks"]["storage"]["error"] == "ConnectionError: refused"
+    assert body["checks"]["cache"]["error"].startswith("timed out")
+    assert body["checks"]["cache"]["latency_ms"] >= 50
+
+
+def test_stale_snapshot_is_not_ready():
+    checker = HealthChecker({"db": _ok}, interval=0.01, timeout=0.01)
+    asyncio.run(checker.refresh())
+    assert checker.snapshot()["ready"] is True
+    checker._checked_at -= 1
+    assert checker.snapshot()["ready"] is False
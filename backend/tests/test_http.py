@@ -0,0 +1,97 @@
+import asyncio
+
+import pytest
+import stripe
+from prometheus_client import REGISTRY
+
+from app.config import settings
+from app.utils import http
+
+
+class FakeResponse:
+    headers = {"Cache-Control": "max-age=60"}
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return {"keys": []}
+
+
+class FakeSession:
+    """Stands in for a pooled requests.Session; records each GET's url and timeout."""
+
+    def __init__(self):
+        self.calls = []
+
+    def get(self, url, timeout=None):
+        self.calls.append((url, timeout))
+        return FakeResponse()
+
+    def close(self):
+        pass
+
+
+@pytest.fixture(autouse=True)
+def _fresh_sessions(monkeypatch):
+    monkeypatch.setattr(settings, "outbound_timeouts", "stripe=20,google=5")
+    monkeypatch.setattr(stripe, "default_http_client", None)
+    http.close_sessions()
+    yield
+    http.close_sessions()
+
+
+def _observations(upstream, outcome):
+    labels = {"upstream": upstream, "outcome": outcome}
+    return REGISTRY.get_sample_value("outbound_request_latency_seconds_count", labels) or 0.0
+
+
+def test_timeouts_per_upstream():
+    connect = settings.outbound_connect_timeout_seconds
+    assert http.upstream_timeout("stripe") == (connect, 20.0)
+    assert http.upstream_timeout("google") == (connect, 5.0)
+    assert http.upstream_timeout("apple") == (connect, settings.outbound_read_timeout_seconds)
+
+
+def test_sessions_are_pooled_per_upstream():
+    session = http.get_session("google")
+    assert http.get_session("google") is session
+    assert http.get_session("apple") is not session
+    assert session.get_adapter("https://example.com")._pool_maxsize == settings.outbound_executor_workers
+
+
+def test_get_json_reuses_the_session_with_its_timeout():
+    fake = FakeSession()
+    http._sessions["google"] = fake
+    body, headers = asyncio.run(http.get_json("google", "https://example.com/certs"))
+    asyncio.run(http.get_json("google", "https://example.com/certs"))
+    assert body == {"keys": []} and headers["Cache-Control"] == "max-age=60"
+    assert fake.calls == [("https://example.com/certs", http.upstream_timeout("google"))] * 2
+
+
+def test_call_upstream_records_latency_by_outcome():
+    ok = _observations("test-upstream", "ok")
+    failed = _observations("test-upstream", "error")
+    assert asyncio.run(http.call_upstream("test-upstream", lambda a, b=0: a + b, 1, b=2)) == 3
+
+    def boom():
+        raise ConnectionError("upstream down")
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(http.call_upstream("test-upstream", boom))
+    assert _observations("test-upstream", "ok") == ok + 1
+    assert _observations("test-upstream", "error") == failed + 1
+
+
+def test_configure_stripe_uses_the_pooled_session():
+    http.configure_stripe()
+    client = stripe.default_http_client
+    assert isinstance(client, stripe.RequestsClient)
+    assert client._session is http.get_session("stripe")
+    assert client._timeout == http.upstream_timeout("stripe")
+    # Idempotent until the sessions are closed
+    http.configure_stripe()
+    assert stripe.default_http_client is client
+    http.close_sessions()
+    http.configure_stripe()
+    assert stripe.default_http_client is not client
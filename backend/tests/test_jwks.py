@@ -0,0 +1,109 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import jwt
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jwt.algorithms import RSAAlgorithm
+
+from app.config import settings
+from app.utils.jwks import KeyStore
+from app.utils import oauth
+
+
+def _make_key(kid):
+    private = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    jwk = json.loads(RSAAlgorithm.to_jwk(private.public_key()))
+    jwk.update({"kid": kid, "alg": "RS256", "use": "sig"})
+    return private, jwk
+
+
+class _JWKSServer:
+    """Local stand-in for a provider's JWKS endpoint."""
+
+    def __init__(self):
+        self.keys = []
+        self.hits = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.hits += 1
+                body = json.dumps({"keys": server.keys}).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Cache-Control", "public, max-age=300")
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = HTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_port}/keys"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+
+
+def _token(private, kid, **claims):
+    payload = {"sub": "123", "email": "a@example.com", "exp": int(time.time()) + 300, **claims}
+    return jwt.encode(payload, private, algorithm="RS256", headers={"kid": kid})
+
+
+def test_keys_cached_by_kid():
+    srv = _JWKSServer()
+    try:
+        _, jwk = _make_key("k1")
+        srv.keys = [jwk]
+
+        async def run():
+            store = KeyStore("test", srv.url)
+            assert (await store.get_key("k1")) is not None
+            assert (await store.get_key("k1")) is not None
+        asyncio.run(run())
+        assert srv.hits == 1
+    finally:
+        srv.close()
+
+
+def test_unknown_kid_refetches_rotated_keys(monkeypatch):
+    monkeypatch.setattr(settings, "jwks_min_refetch_seconds", 0)
+    srv = _JWKSServer()
+    try:
+        _, jwk1 = _make_key("k1")
+        _, jwk2 = _make_key("k2")
+        srv.keys = [jwk1]
+
+        async def run():
+            store = KeyStore("test", srv.url)
+            assert (await store.get_key("k1")) is not None
+            srv.keys = [jwk1, jwk2]
+            assert (await store.get_key("k2")) is not None
+            assert (await store.get_key("nope")) is None
+        asyncio.run(run())
+        assert srv.hits == 3
+    finally:
+        srv.close()
+
+
+def test_verify_google_against_stand_in(monkeypatch):
+    srv = _JWKSServer()
+    try:
+        private, jwk = _make_key("g1")
+        srv.keys = [jwk]
+        monkeypatch.setattr(settings, "google_jwks_url", srv.url)
+        monkeypatch.setattr(settings, "google_client_ids", "client-a")
+
+        async def run():
+            good = await oauth.verify_google(_token(private, "g1", iss="https://accounts.google.com", aud="client-a"))
+            wrong_aud = await oauth.verify_google(_token(private, "g1", iss="https://accounts.google.com", aud="other"))
+            return good, wrong_aud
+        good, wrong_aud = asyncio.run(run())
+        assert good and good["sub"] == "123"
+        assert wrong_aud is None
+    finally:
+        srv.close()
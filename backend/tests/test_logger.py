@@ -0,0 +1,39 @@
+import io
+
+import orjson
+
+from app.utils.logger import BufferedLogger, reset_request_id, set_request_id
+
+
+def _started(stream, **kw):
+    logger = BufferedLogger(max_queue=kw.get("max_queue", 10), sample_above=kw.get("sample_above", 0.5), sample_rate=2, flush_interval=60, stream=stream)
+    logger._thread = object()  # queue without a writer thread; tests flush by hand
+    return logger
+
+
+def test_records_carry_context_request_id():
+    stream = io.StringIO()
+    logger = _started(stream)
+    token = set_request_id("req-12345678")
+    try:
+        logger.info("hello", n=1)
+    finally:
+        reset_request_id(token)
+    logger.flush()
+    record = orjson.loads(stream.getvalue().splitlines()[0])
+    assert record["msg"] == "hello" and record["n"] == 1 and record["request_id"] == "req-12345678"
+
+
+def test_backpressure_samples_info_and_keeps_warnings_until_full():
+    stream = io.StringIO()
+    logger = _started(stream, max_queue=10, sample_above=0.5)
+    for i in range(12):
+        logger.info("spam", i=i)
+    assert 5 < len(logger._queue) < 10  # first 5 kept, then 1 in 2 sampled
+    while len(logger._queue) < 10:
+        logger.warning("important")
+    logger.warning("dropped")
+    assert len(logger._queue) == 10
+    logger.flush()
+    lines = [orjson.loads(l) for l in stream.getvalue().splitlines()]
+    assert lines[-1]["msg"] == "log records dropped" and lines[-1]["count"] > 0
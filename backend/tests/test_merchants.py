@@ -0,0 +1,192 @@
+import asyncio
+
+import pytest
+
+from app.config import settings
+from app.utils import categorize, merchants, principals
+from app.utils.categorize import categorize_batch, compile_keyword_rule, compile_merchant_rule
+
+
+class FakeSession:
+    """Counts statements and answers memo lookups from `rows` (normalized name -> (category, confidence))."""
+
+    def __init__(self, rows=None):
+        self.rows = rows or {}
+        self.statements = []
+
+    async def execute(self, stmt, params=None):
+        self.statements.append((str(stmt), dict(params or {})))
+        row = self.rows.get((params or {}).get("n"))
+        found = [{"category": row[0], "confidence": row[1]}] if row else []
+
+        class _Result:
+            def mappings(self):
+                return self
+
+            def first(self):
+                return found[0] if found else None
+
+        return _Result()
+
+
+@pytest.fixture(autouse=True)
+def _empty_caches():
+    merchants.clear_merchant_cache()
+    merchants._user_overrides.clear()
+    yield
+    merchants.clear_merchant_cache()
+    merchants._user_overrides.clear()
+
+
+@pytest.mark.parametrize(
+    "raw, expected",
+    [
+        ("WAL-MART #1234", "walmart"),
+        ("WALMART SUPERCENTER", "walmart"),
+        ("Walmart Store 0042", "walmart"),
+        ("SQ *BLUE BOTTLE", "blue bottle"),
+        ("TST* Joe's Pizza", "joes pizza"),
+        ("MCDONALD'S 10234", "mcdonalds"),
+        ("WALM0RT", "walmort"),
+        ("7-ELEVEN", "7eleven"),
+        ("", None),
+        (None, None),
+        ("#1234", None),
+    ],
+)
+def test_normalize_merchant(raw, expected):
+    assert merchants.normalize_merchant(raw) == expected
+
+
+def test_memo_lookup_is_served_from_the_lru():
+    db = FakeSession({"walmart": ("groceries", 0.9)})
+    assert asyncio.run(merchants.lookup_merchant_category(db, "walmart")) == ("groceries", 0.9)
+    assert asyncio.run(merchants.lookup_merchant_category(db, "walmart")) == ("groceries", 0.9)
+    assert len(db.statements) == 1
+
+
+def test_memo_caches_misses():
+    db = FakeSession()
+    assert asyncio.run(merchants.lookup_merchant_category(db, "corner deli")) is None
+    assert asyncio.run(merchants.lookup_merchant_category(db, "corner deli")) is None
+    assert len(db.statements) == 1
+
+
+def test_remember_fills_the_lru():
+    db = FakeSession()
+    asyncio.run(merchants.remember_merchant_category(db, "walmart", "groceries", 0.62))
+    assert db.statements[0][1] == {"n": "walmart", "c": "groceries", "conf": 0.62}
+    assert asyncio.run(merchants.lookup_merchant_category(db, "walmart")) == ("groceries", 0.62)
+    assert len(db.statements) == 1  # the upsert; the lookup was a cache hit
+
+
+def test_forget_merchants_is_targeted_and_notifies_peers():
+    db = FakeSession({"walmart": ("groceries", 0.9), "costco": ("groceries", 0.9)})
+    asyncio.run(merchants.lookup_merchant_category(db, "walmart"))
+    asyncio.run(merchants.lookup_merchant_category(db, "costco"))
+    db.statements.clear()
+    asyncio.run(merchants.forget_merchants(db, ["walmart", None, "walmart"]))
+    assert "DELETE FROM merchants" in db.statements[0][0]
+    assert db.statements[0][1] == {"names": ["walmart"]}
+    assert "pg_notify" in db.statements[1][0]
+    assert db.statements[1][1] == {"channel": principals.INVALIDATION_CHANNEL, "kind": "merchant_memo", "keys": ["walmart"]}
+    asyncio.run(merchants.lookup_merchant_category(db, "costco"))
+    assert len(db.statements) == 2  # still cached
+    asyncio.run(merchants.lookup_merchant_category(db, "walmart"))
+    assert len(db.statements) == 3  # evicted locally
+
+
+def test_peer_notification_evicts_one_merchant():
+    db = FakeSession({"walmart": ("groceries", 0.9), "costco": ("groceries", 0.9)})
+    asyncio.run(merchants.lookup_merchant_category(db, "walmart"))
+    asyncio.run(merchants.lookup_merchant_category(db, "costco"))
+    principals._on_notification(None, 0, principals.INVALIDATION_CHANNEL, "merchant_memo:walmart")
+    asyncio.run(merchants.lookup_merchant_category(db, "walmart"))
+    asyncio.run(merchants.lookup_merchant_category(db, "costco"))
+    assert len(db.statements) == 3
+
+
+def test_confident_merchant_rule_beats_keyword_rule_in_batches():
+    # The memo serves a merchant-rule verdict for every transaction of the merchant, so backfills
+    # give a confident merchant rule the same precedence
+    rules = {
+        "merchant": [compile_merchant_rule("costco", "groceries", 0.85)],
+        "keyword": [compile_keyword_rule("gas", "both", "transport", 0.95)],
+    }
+    assert categorize_batch(rules, [("COSTCO #12", "gas station")]) == ["groceries"]
+    # A weak merchant rule still loses to a stronger keyword rule
+    rules["merchant"] = [compile_merchant_rule("costco", "groceries", 0.6)]
+    assert categorize_batch(rules, [("COSTCO #12", "gas station")]) == ["transport"]
+    # Between keyword rules the most confident one wins
+    rules["keyword"].append(compile_keyword_rule("station", "both", "travel", 0.9))
+    assert categorize_batch(rules, [("COSTCO #12", "gas station")]) == ["transport"]
+
+
+class _Model:
+    def __init__(self, prediction):
+        self.prediction = prediction
+
+    def predict_batch(self, merchants_, texts):
+        return [self.prediction for _ in merchants_]
+
+
+def _no_rules(calls):
+    async def load_rules(_db):
+        calls.append(1)
+        return {"merchant": [], "keyword": [compile_keyword_rule("fuel", "both", "transport", 0.9)]}
+
+    return load_rules
+
+
+def test_model_verdicts_are_memoized_with_their_confidence(monkeypatch):
+    loads = []
+    monkeypatch.setattr(categorize, "load_rules", _no_rules(loads))
+    monkeypatch.setattr(categorize, "get_model", lambda: _Model(("dining", 0.7)))
+    monkeypatch.setattr(settings, "category_model_min_confidence", 0.5)
+    db = FakeSession()
+    assert asyncio.run(categorize.determine_category(db, "STARBUCKS #12", "latte")) == "dining"
+    assert db.statements[-1][1] == {"n": "starbucks", "c": "dining", "conf": 0.7}
+    # Repeat merchant: answered by the memo without loading rules
+    assert asyncio.run(categorize.determine_category(db, "Starbucks 0042", "latte")) == "dining"
+    assert len(loads) == 1
+
+
+def test_keyword_and_unsure_verdicts_are_not_memoized(monkeypatch):
+    loads = []
+    monkeypatch.setattr(categorize, "load_rules", _no_rules(loads))
+    monkeypatch.setattr(categorize, "get_model", lambda: _Model(("dining", 0.3)))
+    monkeypatch.setattr(settings, "category_model_min_confidence", 0.5)
+    db = FakeSession()
+    assert asyncio.run(categorize.determine_category(db, "SHELL", "fuel pump")) == "transport"
+    assert asyncio.run(categorize.determine_category(db, "CORNER DELI", "sandwich")) == "other"
+    assert not any("INSERT INTO merchants" in sql for sql, _ in db.statements)
+
+
+def test_user_override_is_evicted_everywhere():
+    class OverrideSession(FakeSession):
+        async def execute(self, stmt, params=None):
+            self.statements.append((str(stmt), dict(params or {})))
+
+            class _Result:
+                def mappings(self):
+                    return self
+
+                def all(self):
+                    return [{"normalized_merchant": "walmart", "category": "shopping"}]
+
+            return _Result()
+
+    db = OverrideSession()
+    assert asyncio.run(merchants.get_user_overrides(db, "u1")) == {"walmart": "shopping"}
+    asyncio.run(merchants.record_user_override(db, "u1", "WAL-MART #1", "groceries"))
+    assert db.statements[-1][1] == {"channel": principals.INVALIDATION_CHANNEL, "payload": "user_overrides:u1"}
+    reads = len(db.statements)
+    asyncio.run(merchants.get_user_overrides(db, "u1"))
+    assert len(db.statements) == reads + 1  # evicted locally
+
+    # A peer's correction arrives as a notification
+    asyncio.run(merchants.get_user_overrides(db, "u2"))
+    principals._on_notification(None, 0, principals.INVALIDATION_CHANNEL, "user_overrides:u2")
+    reads = len(db.statements)
+    asyncio.run(merchants.get_user_overrides(db, "u2"))
+    assert len(db.statements) == reads + 1
@@ -0,0 +1,75 @@
+import importlib.util
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+from prometheus_client.parser import text_string_to_metric_families
+
+from app.utils.observability import metrics_endpoint
+
+
+BACKEND = Path(__file__).resolve().parents[1]
+
+# A worker process: multiprocess mode is picked up from the environment before any metric exists
+_WORKER = """
+import os, sys
+from app.utils.executors import EXECUTOR_INFLIGHT, EXECUTOR_REJECTED
+from app.utils.profiling import EVENT_LOOP_LAG
+EXECUTOR_INFLIGHT.labels(pool="test").inc()
+EXECUTOR_REJECTED.labels(pool="test").inc()
+EVENT_LOOP_LAG.set(float(sys.argv[1]))
+print(os.getpid())
+"""
+
+
+def _run_worker(env, lag):
+    out = subprocess.run(
+        [sys.executable, "-c", _WORKER, str(lag)], cwd=BACKEND, env=env, capture_output=True, text=True, check=True
+    )
+    return int(out.stdout.strip())
+
+
+def _scrape():
+    body = metrics_endpoint().body.decode()
+    return {
+        sample.name: sample.value
+        for family in text_string_to_metric_families(body)
+        for sample in family.samples
+        if sample.labels.get("pool") in (None, "test")
+    }
+
+
+def _gunicorn_conf(monkeypatch, path):
+    monkeypatch.setenv("PROMETHEUS_MULTIPROC_DIR", str(path))
+    monkeypatch.setenv("WEB_CONCURRENCY", "1")
+    spec = importlib.util.spec_from_file_location("gunicorn_conf", BACKEND / "gunicorn.conf.py")
+    conf = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(conf)
+    return conf
+
+
+def test_metrics_aggregate_workers_and_drop_dead_gauges(tmp_path, monkeypatch):
+    conf = _gunicorn_conf(monkeypatch, tmp_path)
+    (tmp_path / "counter_999.db").write_bytes(b"stale")
+    conf.on_starting(None)
+    assert list(tmp_path.iterdir()) == []
+
+    env = {**os.environ, "PROMETHEUS_MULTIPROC_DIR": str(tmp_path)}
+    first = _run_worker(env, 0.3)
+    _run_worker(env, 0.1)
+
+    samples = _scrape()
+    assert samples["executor_rejected_total"] == 2
+    assert samples["executor_inflight"] == 2  # livesum
+    assert samples["event_loop_lag_seconds"] == 0.3  # livemax
+
+    class Worker:
+        pid = first
+
+    conf.child_exit(None, Worker())
+    samples = _scrape()
+    # The dead worker's live gauges are gone; its counters still count
+    assert samples["executor_rejected_total"] == 2
+    assert samples["executor_inflight"] == 1
+    assert samples["event_loop_lag_seconds"] == 0.1
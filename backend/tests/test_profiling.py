@@ -0,0 +1,30 @@
+import threading
+import time
+
+import pytest
+
+from app.utils.profiling import ProfilerBusy, SamplingProfiler
+
+
+def _busy_loop(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def test_collapsed_stacks_name_the_hot_function():
+    stop = threading.Event()
+    worker = threading.Thread(target=_busy_loop, args=(stop,), name="busy")
+    worker.start()
+    profiler = SamplingProfiler(interval=0.002, thread_id=worker.ident)
+    profiler.start()
+    try:
+        with pytest.raises(ProfilerBusy):
+            SamplingProfiler(interval=0.01).start()
+        time.sleep(0.2)
+    finally:
+        collapsed = profiler.stop()
+        stop.set()
+        worker.join()
+    lines = collapsed.splitlines()
+    assert lines and all(line.startswith("busy;") for line in lines)
+    assert "_busy_loop" in lines[0] and int(lines[0].rsplit(" ", 1)[1]) > 0
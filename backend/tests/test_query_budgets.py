@@ -0,0 +1,98 @@
+"""
+Per-endpoint query budgets. Needs the API running with QUERY_DEBUG=true (X-Query-Count header);
+each list endpoint is seeded with a few and with several rows and must stay within its budget
+without the statement count growing with the number of rows.
+"""
+import os
+import uuid
+from datetime import date
+
+import pytest
+import requests
+
+BASE = os.environ.get("BASE_URL", "http://localhost:8000")
+
+# Statements per request, including the auth lookup on a cold principal cache
+QUERY_BUDGETS = {
+    "GET /v1/savings/goals": 3,
+    "GET /v1/linked-accounts": 3,
+    "PUT /v1/budgets": 8,
+}
+
+
+def _headers():
+    email = f"qb-{uuid.uuid4().hex[:10]}@example.com"
+    requests.post(f"{BASE}/v1/auth/signup", json={"email": email, "password": "Passw0rd!"})
+    r = requests.post(f"{BASE}/v1/auth/login", json={"email": email, "password": "Passw0rd!"})
+    assert r.status_code == 200
+    return {"Authorization": f"Bearer {r.json()['token']}"}
+
+
+def _query_count(resp):
+    assert resp.status_code == 200, resp.text
+    if "x-query-count" not in resp.headers:
+        pytest.skip("API not running with QUERY_DEBUG=true")
+    return int(resp.headers["x-query-count"])
+
+
+def _seed_goals(headers, n):
+    for i in range(n):
+        r = requests.post(f"{BASE}/v1/savings/goals", json={"name": f"goal {i}", "target_cents": 10000}, headers=headers)
+        requests.post(f"{BASE}/v1/savings/goals/{r.json()['id']}/contributions", json={"amount_cents": 500}, headers=headers)
+
+
+def _seed_accounts(headers, n):
+    for i in range(n):
+        body = {"provider": "plaid", "provider_account_id": uuid.uuid4().hex, "account_name": f"acct {i}"}
+        r = requests.post(f"{BASE}/v1/linked-accounts", json=body, headers=headers)
+        requests.post(f"{BASE}/v1/linked-accounts/{r.json()['id']}/balances", json={"current_cents": 1000 * i}, headers=headers)
+
+
+CATEGORIES = ["groceries", "dining", "transport", "shopping", "entertainment", "utilities"]
+
+
+def _put_budgets(headers, n):
+    today = date.today()
+    start = today.replace(day=1).isoformat()
+    end = date(today.year + (today.month == 12), today.month % 12 + 1, 1).isoformat()
+    last = None
+    for cat in CATEGORIES[:n]:
+        last = requests.put(
+            f"{BASE}/v1/budgets",
+            json={"period_start": start, "period_end": end, "category": cat, "limit_cents": 1},
+            headers=headers,
+        )
+    return last
+
+
+def _assert_flat(endpoint, small, large):
+    assert small <= QUERY_BUDGETS[endpoint], f"{endpoint}: {small} statements"
+    assert large <= QUERY_BUDGETS[endpoint], f"{endpoint}: {large} statements"
+    assert large == small, f"{endpoint}: statement count grows with rows ({small} -> {large})"
+
+
+def test_savings_goals_list_budget():
+    endpoint = "GET /v1/savings/goals"
+    small_h, large_h = _headers(), _headers()
+    _seed_goals(small_h, 1)
+    _seed_goals(large_h, 6)
+    small = _query_count(requests.get(f"{BASE}/v1/savings/goals", headers=small_h))
+    large = _query_count(requests.get(f"{BASE}/v1/savings/goals", headers=large_h))
+    _assert_flat(endpoint, small, large)
+
+
+def test_linked_accounts_list_budget():
+    endpoint = "GET /v1/linked-accounts"
+    small_h, large_h = _headers(), _headers()
+    _seed_accounts(small_h, 1)
+    _seed_accounts(large_h, 6)
+    small = _query_count(requests.get(f"{BASE}/v1/linked-accounts", headers=small_h))
+    large = _query_count(requests.get(f"{BASE}/v1/linked-accounts", headers=large_h))
+    _assert_flat(endpoint, small, large)
+
+
+def test_budget_alert_check_budget():
+    endpoint = "PUT /v1/budgets"
+    small = _query_count(_put_budgets(_headers(), 1))
+    large = _query_count(_put_budgets(_headers(), 6))
+    _assert_flat(endpoint, small, large)
@@ -0,0 +1,109 @@
+import asyncio
+
+from app.utils.ratelimit import Limit, MemoryBackend, RateLimiter, _client_ip, parse_rules
+
+
+def test_token_bucket_allows_burst_then_limits():
+    async def run():
+        backend = MemoryBackend()
+        limit = Limit("t", 3, 60)
+        results = [await backend.take("ip:1|t", limit) for _ in range(4)]
+        other = await backend.take("ip:2|t", limit)
+        return results, other
+    results, other = asyncio.run(run())
+    assert [r[0] for r in results] == [True, True, True, False]
+    assert 0 < results[-1][1] <= 20  # one token refills in 60/3 seconds
+    assert other[0] is True
+
+
+def test_idle_buckets_are_evicted_lazily():
+    async def run():
+        backend = MemoryBackend(max_keys=2)
+        limit = Limit("t", 1, 60)
+        for i in range(10):
+            await backend.take(f"ip:{i}|t", limit)
+        return len(backend._buckets)
+    assert asyncio.run(run()) <= 3
+
+
+def test_parse_route_rules():
+    rules = parse_rules("POST /v1/auth/login=10/60, POST /v1/receipts/upload=30/120")
+    login = rules[("POST", "/v1/auth/login")]
+    assert login.capacity == 10 and login.window == 60
+    assert rules[("POST", "/v1/receipts/upload")].rate == 0.25
+
+
+def test_denied_request_spends_no_tokens():
+    async def run():
+        backend = MemoryBackend()
+        default, login = Limit("default", 3, 60), Limit("login", 1, 60)
+        buckets = [("ip:1|default", default), ("ip:1|login", login)]
+        first = await backend.take_all(buckets)
+        denied = [await backend.take_all(buckets) for _ in range(5)]
+        other_route = [await backend.take("ip:1|default", default) for _ in range(3)]
+        return first, denied, other_route
+    first, denied, other_route = asyncio.run(run())
+    assert first == (True, 0.0, None)
+    assert all(not allowed and limit.name == "login" for allowed, _, limit in denied)
+    # Only the one allowed login spent from the default bucket
+    assert [a for a, _ in other_route] == [True, True, False]
+
+
+def _scope(xff=None, peer="10.0.0.2"):
+    headers = [(b"x-forwarded-for", xff.encode())] if xff else []
+    return {"type": "http", "headers": headers, "client": (peer, 1234)}
+
+
+def test_forwarded_for_is_only_trusted_from_configured_hops():
+    spoofed = _scope("6.6.6.6, 203.0.113.9")
+    assert _client_ip(spoofed, 0) == "10.0.0.2"
+    # One proxy (10.0.0.2) appended the address it saw; the client-supplied entry is ignored
+    assert _client_ip(spoofed, 1) == "203.0.113.9"
+    assert _client_ip(_scope("6.6.6.6, 203.0.113.9, 10.0.0.1"), 2) == "203.0.113.9"
+    # Fewer entries than hops: the leftmost address we have
+    assert _client_ip(_scope("203.0.113.9"), 3) == "203.0.113.9"
+    assert _client_ip(_scope(), 1) == "10.0.0.2"
+
+
+def test_middleware_counts_a_route_denial_against_the_route_only():
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    limiter = RateLimiter(app, default="3/60", rules="POST /v1/auth/login=1/60", backend="memory", trusted_proxy_hops=0)
+
+    async def call(method, path):
+        sent = []
+
+        async def receive():
+            return {"type": "http.request", "body": b""}
+
+        async def send(message):
+            sent.append(message)
+
+        await limiter(dict(_scope(), method=method, path=path), receive, send)
+        return sent[0]["status"]
+
+    async def run():
+        return [await call("POST", "/v1/auth/login") for _ in range(3)] + [await call("GET", "/v1/me") for _ in range(3)]
+
+    assert asyncio.run(run()) == [200, 429, 429, 200, 200, 429]
+
+
+def test_bearer_token_does_not_choose_the_bucket():
+    from app.utils import principals, ratelimit
+
+    principals._principals.set("s1", {"user_id": "u1"})
+    try:
+        scope = dict(_scope(), headers=[(b"authorization", b"Bearer s1.not-the-secret")])
+        assert ratelimit._identity(scope, 0) == "ip:10.0.0.2"
+    finally:
+        principals._principals.pop("s1")
+
+
+def test_admission_control_runs_before_the_limiter():
+    from app.main import app
+    from app.utils.admission import AdmissionController
+
+    order = [m.cls for m in app.user_middleware]  # outermost first
+    assert order.index(AdmissionController) < order.index(RateLimiter)
@@ -0,0 +1,184 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+import pytest
+from sqlalchemy.exc import DBAPIError
+
+from app.errors import AppError
+from app.utils import recategorize
+
+
+class _PgError(Exception):
+    def __init__(self, sqlstate):
+        super().__init__(sqlstate)
+        self.sqlstate = sqlstate
+
+
+class FakeSession:
+    """Records statements; `reject` maps a bound parameter value to the SQLSTATE Postgres would raise."""
+
+    def __init__(self, reject=None, rows=()):
+        self.reject = reject or {}
+        self.rows = list(rows)
+        self.statements = []
+
+    @asynccontextmanager
+    async def begin_nested(self):
+        yield
+
+    async def execute(self, stmt, params=None):
+        self.statements.append((str(stmt), dict(params or {})))
+        for value in (params or {}).values():
+            if isinstance(value, str) and value in self.reject:
+                raise DBAPIError(str(stmt), params, _PgError(self.reject[value]))
+        rows = self.rows
+
+        class _Result:
+            rowcount = 0
+
+            def mappings(self):
+                return self
+
+            def all(self):
+                return rows
+
+        return _Result()
+
+
+def test_scope_clause_per_rule_kind():
+    sql, params = recategorize.rule_scope_clause("merchant", {"merchant_pattern": "^star(bucks)?"})
+    assert sql == "t.merchant ~* :scope_pattern" and params == {"scope_pattern": "^star(bucks)?"}
+    # Not a regex at all: the categorizer matches it as a substring, so does the scope
+    sql, params = recategorize.rule_scope_clause("merchant", {"merchant_pattern": "50%_off("})
+    assert sql == "t.merchant ILIKE :scope_like" and params == {"scope_like": "%50\\%\\_off(%"}
+    # Python regex Postgres cannot compile: scan every merchant instead of failing the job
+    assert recategorize.rule_scope_clause("merchant", {"merchant_pattern": "(?<=a)b"}, postgres_regex=False) == ("t.merchant IS NOT NULL", {})
+    sql, params = recategorize.rule_scope_clause("keyword", {"keyword": "uber"})
+    assert sql == "(t.raw_text ->> 'ocr') ILIKE :scope_like" and params == {"scope_like": "%uber%"}
+
+
+def test_scope_for_rule_falls_back_when_postgres_rejects_pattern():
+    db = FakeSession(reject={"(?P<store>tesco)": recategorize.INVALID_REGULAR_EXPRESSION})
+    scope = asyncio.run(recategorize.scope_for_rule(db, "merchant", {"merchant_pattern": "(?P<store>tesco)"}))
+    assert scope == ("t.merchant IS NOT NULL", {})
+
+
+def test_validate_merchant_pattern():
+    db = FakeSession(reject={"(?<=x)y": recategorize.INVALID_REGULAR_EXPRESSION})
+    asyncio.run(recategorize.validate_merchant_pattern(db, "^whole ?foods"))
+    for bad in ("(?<=x)y", "unbalanced("):
+        with pytest.raises(AppError) as info:
+            asyncio.run(recategorize.validate_merchant_pattern(db, bad))
+        assert info.value.status_code == 400
+
+
+def test_validate_merchant_pattern_propagates_other_db_errors():
+    db = FakeSession(reject={"^a": "08006"})  # connection failure
+    with pytest.raises(DBAPIError):
+        asyncio.run(recategorize.validate_merchant_pattern(db, "^a"))
+
+
+def test_user_edited_rows_are_never_candidates_or_updated():
+    db = FakeSession()
+    asyncio.run(recategorize.fetch_candidate_batch(db, "t.merchant ~* :scope_pattern", {"scope_pattern": "x"}))
+    assert "t.category_edited_at IS NULL" in db.statements[-1][0]
+    asyncio.run(recategorize.apply_category_updates(db, [("00000000-0000-0000-0000-000000000001", "dining")]))
+    assert "t.category_edited_at IS NULL" in db.statements[-1][0]
+
+
+
+class ScanFails(FakeSession):
+    """Candidate scans (the only statements binding :scope_pattern) fail with `scan_sqlstate`."""
+
+    def __init__(self, scan_sqlstate):
+        super().__init__()
+        self.scan_sqlstate = scan_sqlstate
+
+    async def execute(self, stmt, params=None):
+        if params and "scope_pattern" in params:
+            raise DBAPIError(str(stmt), params, _PgError(self.scan_sqlstate))
+        return await super().execute(stmt, params)
+
+    async def rollback(self):
+        pass
+
+
+def _simulate(db, pattern):
+    return recategorize.simulate_rule(db, "merchant", {"merchant_pattern": pattern, "category": "dining", "confidence": 0.9})
+
+
+def test_simulation_stops_on_statement_timeout_only(monkeypatch):
+    async def no_rules(_db):
+        return {"merchant": [], "keyword": []}
+
+    monkeypatch.setattr(recategorize, "load_rules", no_rules)
+    result = asyncio.run(_simulate(ScanFails(recategorize.QUERY_CANCELED), "^star"))
+    assert result["complete"] is False and result["scanned"] == 0
+    with pytest.raises(DBAPIError):
+        asyncio.run(_simulate(ScanFails("08006"), "^star"))  # connection failure
+
+
+def test_simulation_rejects_invalid_pattern():
+    db = FakeSession(reject={"(?<=a)b": recategorize.INVALID_REGULAR_EXPRESSION})
+    with pytest.raises(AppError) as info:
+        asyncio.run(_simulate(db, "(?<=a)b"))
+    assert info.value.status_code == 400
+
+
+def test_simulation_timeout_during_override_lookup_is_partial(monkeypatch):
+    class OverridesTimeOut(FakeSession):
+        async def execute(self, stmt, params=None):
+            if params and "uids" in params:
+                raise DBAPIError(str(stmt), params, _PgError(recategorize.QUERY_CANCELED))
+            return await super().execute(stmt, params)
+
+        async def rollback(self):
+            pass
+
+    async def no_rules(_db):
+        return {"merchant": [], "keyword": []}
+
+    monkeypatch.setattr(recategorize, "load_rules", no_rules)
+    row = {"id": "t1", "user_id": "sim-user", "merchant": "STARBUCKS", "ocr_text": None, "category": "other"}
+    result = asyncio.run(_simulate(OverridesTimeOut(rows=[row]), "^star"))
+    assert result["complete"] is False and result["scanned"] == 0
+
+
+def test_backfill_forgets_only_the_merchants_it_scanned(monkeypatch):
+    class CommittingSession(FakeSession):
+        async def commit(self):
+            self.statements.append(("COMMIT", {}))
+
+    async def fetch_rule(_db, _kind, _rid):
+        return {"id": 1, "merchant_pattern": "mart", "category": "groceries", "confidence": 0.9, "active": True}
+
+    async def scope_for_rule(_db, _kind, _rule):
+        return "true", {}
+
+    async def load_rules(_db):
+        return {"merchant": [recategorize.compile_merchant_rule("mart", "groceries", 0.9)], "keyword": []}
+
+    async def fetch_candidate_batch(_db, _sql, _params, after_id=None):
+        return [
+            {"id": "a", "user_id": "u1", "merchant": "WAL-MART #1", "ocr_text": None, "category": "shopping"},
+            {"id": "b", "user_id": "u1", "merchant": "KMART", "ocr_text": None, "category": "groceries"},
+        ]
+
+    async def no_overrides(_db, _uids):
+        return {}
+
+    for name, fn in [
+        ("fetch_rule", fetch_rule),
+        ("scope_for_rule", scope_for_rule),
+        ("load_rules", load_rules),
+        ("fetch_candidate_batch", fetch_candidate_batch),
+        ("get_overrides_for_users", no_overrides),
+    ]:
+        monkeypatch.setattr(recategorize, name, fn)
+    db = CommittingSession()
+    assert asyncio.run(recategorize.recategorize_for_rule(db, "merchant", 1)) == (2, 0)
+    sql = [s for s, _ in db.statements]
+    forget = next(i for i, s in enumerate(sql) if "DELETE FROM merchants" in s)
+    assert db.statements[forget][1] == {"names": ["kmart", "walmart"]}
+    assert sql[-1] == "COMMIT" and forget < len(sql) - 1
+    assert not any(s.strip() == "DELETE FROM merchants" for s in sql)
@@ -0,0 +1,27 @@
+import io
+
+from PIL import Image
+
+from app.config import settings
+from app.utils.receipt_images import derivative_key, render_derivatives, upload_keys
+
+
+def test_derivative_key_sits_under_receipt_prefix():
+    assert derivative_key("u1", "r1", "thumb") == "receipts/u1/r1/thumb.webp"
+    assert derivative_key("u1", "r1", "display") == "receipts/u1/r1/display.webp"
+
+
+def test_upload_keys_are_scoped_to_user_and_receipt():
+    assert upload_keys("u1", "r1") == ("receipts/u1/r1.jpg", "receipts/u1/r1.pdf")
+    for foreign in ("receipts/u2/r1.jpg", "receipts/u1/r2.jpg", "receipts/u1/../u2/r1.jpg", "exports/u1/r1.jpg"):
+        assert foreign not in upload_keys("u1", "r1")
+
+
+def test_render_derivatives_bounds_size():
+    original = Image.new("RGBA", (2400, 4000), (250, 250, 245, 255))
+    out = render_derivatives(original)
+    for name, px in (("display", settings.receipt_display_px), ("thumb", settings.receipt_thumbnail_px)):
+        im = Image.open(io.BytesIO(out[name]))
+        assert im.format == "WEBP" and im.mode == "RGB"
+        assert max(im.size) == px
+    assert len(out["thumb"]) < len(out["display"])
@@ -0,0 +1,31 @@
+import os
+import requests
+
+BASE = os.environ.get("BASE_URL", "http://localhost:8000")
+ADMIN_HEADERS = {"X-Admin-Secret": os.environ.get("ADMIN_SECRET", "")}
+
+
+def test_merchant_rule_simulation_shape():
+    r = requests.post(
+        f"{BASE}/v1/rules/merchant/simulate",
+        json={"merchant_pattern": "starbucks", "category": "dining", "confidence": 0.95, "time_budget_ms": 500},
+        headers=ADMIN_HEADERS,
+    )
+    assert r.status_code == 200
+    body = r.json()
+    assert body["scanned"] >= body["would_change"] >= 0
+    assert sum(t["count"] for t in body["transitions"]) == body["would_change"]
+    assert all(e["from"] != e["to"] for e in body["examples"])
+    assert isinstance(body["complete"], bool)
+
+
+def test_rule_simulation_does_not_write():
+    before = requests.get(f"{BASE}/v1/rules/merchant").json()["items"]
+    r = requests.post(
+        f"{BASE}/v1/rules/merchant/simulate",
+        json={"merchant_pattern": "zz-sim-only", "category": "travel", "confidence": 0.9, "sample_percent": 10},
+        headers=ADMIN_HEADERS,
+    )
+    assert r.status_code == 200
+    after = requests.get(f"{BASE}/v1/rules/merchant").json()["items"]
+    assert len(after) == len(before)
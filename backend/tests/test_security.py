@@ -0,0 +1,127 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi import HTTPException
+from passlib.hash import bcrypt as passlib_bcrypt
+
+from app.config import settings
+from app.routers import v1
+from app.utils import auth, security
+
+
+class FakeSession:
+    """Records statements and commits."""
+
+    def __init__(self):
+        self.statements = []
+        self.commits = 0
+
+    async def execute(self, stmt, params=None):
+        self.statements.append((str(stmt), dict(params or {})))
+
+    async def commit(self):
+        self.commits += 1
+
+
+def test_session_digest_round_trip():
+    secret, stored = security.generate_session_token()
+    assert stored.startswith(security.SESSION_HASH_PREFIX)
+    assert stored == security.hash_session_secret(secret)
+    assert security.verify_session_secret(secret, stored) == (True, False)
+
+
+def test_session_digest_rejects_wrong_secret_and_key(monkeypatch):
+    secret, stored = security.generate_session_token()
+    assert security.verify_session_secret(secret + "x", stored) == (False, False)
+    assert security.verify_session_secret(secret, None) == (False, False)
+    # The digest is keyed: the same secret under another key does not verify
+    monkeypatch.setattr(settings, "session_hmac_secret", "rotated")
+    assert security.verify_session_secret(secret, stored) == (False, False)
+
+
+def test_legacy_bcrypt_session_is_rewritten_after_lookup(monkeypatch):
+    secret = "legacy-secret"
+    legacy = passlib_bcrypt.using(rounds=4).hash(secret)
+    assert security.verify_session_secret(secret, legacy) == (True, True)
+    assert security.verify_session_secret("wrong", legacy) == (False, False)
+
+    async def load_principal(_db, session_id):
+        assert session_id == "sid"
+        return {
+            "user_id": "u1",
+            "refresh_token_hash": legacy,
+            "expires_at": datetime.now(timezone.utc) + timedelta(days=1),
+            "user": {"id": "u1"},
+        }
+
+    monkeypatch.setattr(auth, "load_principal", load_principal)
+    monkeypatch.setattr(auth, "_record_activity", lambda *_args: None)
+    db = FakeSession()
+    principal = asyncio.run(auth.get_current_principal(f"Bearer sid.{secret}", None, db))
+
+    new_hash = security.hash_session_secret(secret)
+    sql, params = db.statements[0]
+    assert "UPDATE sessions SET refresh_token_hash" in sql
+    assert params == {"sid": "sid", "new": new_hash, "old": legacy}
+    assert db.commits == 1
+    assert principal["refresh_token_hash"] == new_hash
+    assert security.verify_session_secret(secret, new_hash) == (True, False)
+
+    # A wrong secret against the legacy hash is rejected without rewriting anything
+    db = FakeSession()
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(auth.get_current_principal("Bearer sid.wrong", None, db))
+    assert exc.value.status_code == 401
+    assert db.statements == []
+
+
+class LoginSession(FakeSession):
+    """Answers the login lookup from `password_hash` and the session insert with an id."""
+
+    def __init__(self, password_hash):
+        super().__init__()
+        self.password_hash = password_hash
+
+    async def execute(self, stmt, params=None):
+        await super().execute(stmt, params)
+        password_hash = self.password_hash
+
+        class _Result:
+            def mappings(self):
+                return self
+
+            def first(self):
+                return {"user_id": "u1", "password_hash": password_hash}
+
+            def scalar_one(self):
+                return "sid"
+
+        return _Result()
+
+
+class _Request:
+    headers = {"user-agent": "pytest"}
+    client = None
+
+
+def test_login_rewrites_lower_cost_bcrypt_hash(monkeypatch):
+    monkeypatch.setattr(security, "bcrypt", passlib_bcrypt.using(rounds=5))
+    old_hash = passlib_bcrypt.using(rounds=4).hash("Passw0rd!")
+    assert security.bcrypt.needs_update(old_hash)
+    payload = v1.LoginRequest(email="a@example.com", password="Passw0rd!")
+
+    db = LoginSession(old_hash)
+    assert asyncio.run(v1.login(payload, _Request(), db))["token"].startswith("sid.")
+    updates = [params for sql, params in db.statements if "UPDATE identities SET password_hash" in sql]
+    assert len(updates) == 1 and updates[0]["old"] == old_hash
+    new_hash = updates[0]["new"]
+    assert security.verify_password("Passw0rd!", new_hash)
+    assert not security.bcrypt.needs_update(new_hash)
+
+    # Next login against the rewritten hash succeeds and leaves it alone
+    db = LoginSession(new_hash)
+    assert asyncio.run(v1.login(payload, _Request(), db))["token"].startswith("sid.")
+    assert not any("UPDATE identities" in sql for sql, _ in db.statements)
+    with pytest.raises(HTTPException):
+        asyncio.run(v1.login(v1.LoginRequest(email="a@example.com", password="nope"), _Request(), LoginSession(new_hash)))
@@ -0,0 +1,79 @@
+import asyncio
+
+from app.config import settings
+from app.utils import session_maintenance
+
+
+class FakeSession:
+    """Records statements and commits; DELETE batches report the next count from `deleted`."""
+
+    def __init__(self, partitioned=False, dropped=0, deleted=()):
+        self.partitioned = partitioned
+        self.dropped = dropped
+        self.deleted = list(deleted)
+        self.statements = []
+        self.commits = 0
+
+    async def execute(self, stmt, params=None):
+        sql = str(stmt)
+        self.statements.append((sql, dict(params or {})))
+        if "relkind" in sql:
+            value = self.partitioned
+        elif "drop_expired_session_partitions" in sql:
+            value = self.dropped
+        else:
+            value = None
+        rowcount = self.deleted.pop(0) if "DELETE FROM sessions" in sql else 0
+
+        class _Result:
+            def scalar(self):
+                return value
+
+            def scalar_one(self):
+                return value
+
+        result = _Result()
+        result.rowcount = rowcount
+        return result
+
+    async def commit(self):
+        self.commits += 1
+
+
+def _deletes(db):
+    return [params for sql, params in db.statements if "DELETE FROM sessions" in sql]
+
+
+def test_purge_deletes_in_batches_until_a_short_one(monkeypatch):
+    monkeypatch.setattr(settings, "session_purge_batch_size", 100)
+    db = FakeSession(deleted=[100, 100, 40])
+    assert asyncio.run(session_maintenance.purge_sessions(db)) == {"partition_drop": 0, "delete": 240}
+    deletes = _deletes(db)
+    assert len(deletes) == 3
+    assert deletes[0] == {"days": settings.session_retention_days, "lim": 100}
+    assert db.commits == 3  # one per batch, so locks are held briefly
+    assert not any("partition" in sql for sql, _ in db.statements)
+
+
+def test_purge_stops_at_max_batches(monkeypatch):
+    monkeypatch.setattr(settings, "session_purge_batch_size", 10)
+    monkeypatch.setattr(settings, "session_purge_max_batches", 2)
+    db = FakeSession(deleted=[10, 10, 10])
+    assert asyncio.run(session_maintenance.purge_sessions(db))["delete"] == 20
+    assert len(_deletes(db)) == 2
+
+
+def test_partitioned_table_drops_expired_partitions_first(monkeypatch):
+    monkeypatch.setattr(settings, "session_purge_batch_size", 100)
+    monkeypatch.setattr(settings, "session_partition_months_ahead", 3)
+    db = FakeSession(partitioned=True, dropped=5000, deleted=[7])
+    assert asyncio.run(session_maintenance.purge_sessions(db)) == {"partition_drop": 5000, "delete": 7}
+    sql = [s for s, _ in db.statements]
+    create = next(i for i, s in enumerate(sql) if "create_session_partitions" in s)
+    drop = next(i for i, s in enumerate(sql) if "drop_expired_session_partitions" in s)
+    delete = next(i for i, s in enumerate(sql) if "DELETE FROM sessions" in s)
+    assert create < drop < delete
+    assert db.statements[create][1] == {"ahead": 3}
+    assert db.statements[drop][1] == {"days": settings.session_retention_days}
+    # Partition maintenance is committed before the batched delete starts
+    assert db.commits == 2
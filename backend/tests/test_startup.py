@@ -0,0 +1,20 @@
+from app.utils import startup
+
+
+def test_startup_within_budget():
+    # Fresh interpreters that also run the startup handlers, so this catches a heavy SDK imported
+    # at module level or during startup, and memory the started worker holds
+    assert startup.check(runs=1) == []
+
+
+def test_measures_the_started_worker():
+    result = startup.measure(runs=1)
+    assert result["startup_seconds"] > 0
+    # The bucket check and health checker load boto3, so the started worker is heavier
+    assert result["started_rss_mb"] > result["rss_mb"]
+
+
+def test_import_breakdown_lists_app_modules():
+    names = [name for name, _, _ in startup.import_breakdown(depth=1)]
+    assert "app.main" in names
+    assert "app.routers.v1" in names
@@ -0,0 +1,29 @@
+import asyncio
+
+from app.utils import storage
+
+
+def test_client_shared_and_head_runs_off_loop(monkeypatch):
+    server = storage._stub_server()
+    try:
+        client = storage._new_client(f"http://127.0.0.1:{server.server_address[1]}")
+        monkeypatch.setattr(storage, "_client_instance", client)
+        assert storage._client() is storage._client() is client
+        meta = asyncio.run(storage.head_object_async("receipts/u/r.jpg"))
+        assert meta["ContentLength"] == 48213
+        assert meta["ContentType"] == "image/jpeg"
+    finally:
+        client.close()
+        server.shutdown()
+
+
+def test_image_urls_reused(monkeypatch):
+    client = storage._new_client("http://127.0.0.1:9")
+    monkeypatch.setattr(storage, "_client_instance", client)
+    monkeypatch.setattr(storage, "_image_urls", storage.LRUCache(100, ttl_seconds=60))
+    try:
+        first = storage.presign_image("receipts/u/r/thumb.webp")
+        assert storage.presign_image("receipts/u/r/thumb.webp") == first
+        assert storage.presign_image("receipts/u/r/display.webp") != first
+    finally:
+        client.close()
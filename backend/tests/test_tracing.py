@@ -0,0 +1,28 @@
+import io
+
+import orjson
+
+from app.utils import tracing
+from app.utils.logger import BufferedLogger
+
+
+def test_parse_traceparent():
+    tp = "00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01"
+    assert tracing.parse_traceparent(tp) == ("4bf92f3577b34da6a3ce929d0e0e4736", "00f067aa0ba902b7", True)
+    assert tracing.parse_traceparent("00-xyz-00f067aa0ba902b7-01") is None
+    assert tracing.parse_traceparent(None) is None
+
+
+def test_trace_resumed_from_stored_traceparent(monkeypatch):
+    stream = io.StringIO()
+    monkeypatch.setattr(tracing, "_exporter", BufferedLogger(1000, 1.0, 1, 60, stream=stream))
+    with tracing.start_trace("http") as api:
+        stored = tracing.current_traceparent()
+    with tracing.start_trace("job.receipt", stored) as job:
+        with tracing.span("ocr"):
+            pass
+    assert tracing.span("outside") is tracing.NOOP_SPAN
+    spans = {s["name"]: s for s in map(orjson.loads, stream.getvalue().splitlines())}
+    assert spans["job.receipt"]["trace_id"] == api.trace_id
+    assert spans["job.receipt"]["parent_id"] == api.span_id
+    assert spans["ocr"]["parent_id"] == job.span_id
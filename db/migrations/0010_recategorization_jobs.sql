@@ -0,0 +1,26 @@
+-- Bulk recategorization when categorization rules change
+
+-- Set when a user edits a transaction category; bulk jobs never overwrite these
+ALTER TABLE transactions
+  ADD COLUMN IF NOT EXISTS category_edited_at timestamptz;
+
+CREATE TYPE rule_kind AS ENUM ('merchant', 'keyword');
+
+CREATE TABLE recategorization_jobs (
+  id uuid PRIMARY KEY DEFAULT gen_random_uuid(),
+  rule_kind rule_kind NOT NULL,
+  rule_id uuid NOT NULL,
+  status job_status NOT NULL DEFAULT 'pending',
+  scanned_count integer NOT NULL DEFAULT 0,
+  updated_count integer NOT NULL DEFAULT 0,
+  attempts integer NOT NULL DEFAULT 0,
+  created_at timestamptz NOT NULL DEFAULT now(),
+  started_at timestamptz,
+  completed_at timestamptz,
+  last_error text
+);
+
+CREATE INDEX IF NOT EXISTS idx_recategorization_jobs_status ON recategorization_jobs(status, created_at);
+
+-- Keyword rules are scoped against OCR text
+CREATE INDEX IF NOT EXISTS idx_transactions_ocr_trgm ON transactions USING gin ((raw_text ->> 'ocr') gin_trgm_ops);
@@ -0,0 +1,9 @@
+-- Canonical merchant names mapped to a category (memo in front of rule evaluation)
+
+CREATE TABLE merchants (
+  normalized_name text PRIMARY KEY,
+  category category NOT NULL,
+  confidence numeric(3,2) NOT NULL CHECK (confidence >= 0 AND confidence <= 1),
+  created_at timestamptz NOT NULL DEFAULT now(),
+  updated_at timestamptz NOT NULL DEFAULT now()
+);
@@ -0,0 +1,9 @@
+-- Per-user merchant -> category corrections learned from transaction edits
+
+CREATE TABLE user_category_overrides (
+  user_id uuid NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+  normalized_merchant text NOT NULL,
+  category category NOT NULL,
+  updated_at timestamptz NOT NULL DEFAULT now(),
+  PRIMARY KEY (user_id, normalized_merchant)
+);
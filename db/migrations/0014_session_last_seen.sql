@@ -0,0 +1,3 @@
+-- Last activity per session, written in batches by the API's activity buffer
+
+ALTER TABLE sessions ADD COLUMN IF NOT EXISTS last_seen_at timestamptz;
@@ -0,0 +1,40 @@
+-- Shared token buckets for the API rate limiter (RATE_LIMIT_BACKEND=postgres).
+-- UNLOGGED: losing buckets on a crash only means a brief period of fresh limits.
+
+CREATE UNLOGGED TABLE IF NOT EXISTS rate_limit_buckets (
+  bucket_key text PRIMARY KEY,
+  tokens double precision NOT NULL,
+  updated_at timestamptz NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_rate_limit_buckets_updated_at ON rate_limit_buckets(updated_at);
+
+-- Refill the bucket for the time since its last use, then take p_cost tokens if available.
+-- Stale rows need no cleanup for correctness (they refill to capacity); the worker deletes them.
+CREATE OR REPLACE FUNCTION rate_limit_take(
+  p_key text,
+  p_capacity double precision,
+  p_rate double precision,
+  p_cost double precision DEFAULT 1
+)
+RETURNS TABLE(allowed boolean, retry_after double precision)
+LANGUAGE plpgsql AS $$
+DECLARE
+  ts timestamptz := clock_timestamp();
+  available double precision;
+BEGIN
+  INSERT INTO rate_limit_buckets AS b (bucket_key, tokens, updated_at)
+  VALUES (p_key, p_capacity, ts)
+  ON CONFLICT (bucket_key) DO UPDATE
+    SET tokens = LEAST(p_capacity, b.tokens + GREATEST(EXTRACT(EPOCH FROM ts - b.updated_at), 0) * p_rate),
+        updated_at = ts
+  RETURNING b.tokens INTO available;
+
+  IF available >= p_cost THEN
+    UPDATE rate_limit_buckets SET tokens = available - p_cost WHERE bucket_key = p_key;
+    RETURN QUERY SELECT true, 0::double precision;
+  ELSE
+    RETURN QUERY SELECT false, (p_cost - available) / p_rate;
+  END IF;
+END;
+$$;
@@ -0,0 +1,6 @@
+-- Id of the API request that enqueued each job, so worker logs line up with the request's
+
+ALTER TABLE receipt_processing_jobs ADD COLUMN IF NOT EXISTS request_id text;
+ALTER TABLE export_jobs ADD COLUMN IF NOT EXISTS request_id text;
+ALTER TABLE deletion_jobs ADD COLUMN IF NOT EXISTS request_id text;
+ALTER TABLE recategorization_jobs ADD COLUMN IF NOT EXISTS request_id text;
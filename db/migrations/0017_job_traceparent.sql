@@ -0,0 +1,4 @@
+-- W3C trace context of the API request that enqueued the job; the worker continues the trace
+
+ALTER TABLE receipt_processing_jobs ADD COLUMN IF NOT EXISTS traceparent text;
+ALTER TABLE export_jobs ADD COLUMN IF NOT EXISTS traceparent text;
@@ -0,0 +1,5 @@
+-- Object keys of the WebP derivatives the worker renders after OCR (receipts/{uid}/{rid}/thumb.webp
+-- and display.webp); NULL until processed, or when the original could not be rendered
+
+ALTER TABLE receipts ADD COLUMN IF NOT EXISTS thumbnail_uri text;
+ALTER TABLE receipts ADD COLUMN IF NOT EXISTS display_uri text;
@@ -0,0 +1,44 @@
+-- All of a request's rate-limit buckets in one statement (replaces 0015's rate_limit_take): refill each, then take p_cost from
+-- every bucket only if every bucket has it, so a denied request spends nothing.
+-- Buckets are locked in key order, so concurrent requests sharing buckets cannot deadlock.
+-- Returns the 1-based index of the bucket with the longest wait when denied.
+CREATE OR REPLACE FUNCTION rate_limit_take_all(
+  p_keys text[],
+  p_capacities double precision[],
+  p_rates double precision[],
+  p_cost double precision DEFAULT 1
+)
+RETURNS TABLE(allowed boolean, retry_after double precision, denied integer)
+LANGUAGE plpgsql AS $$
+DECLARE
+  ts timestamptz := clock_timestamp();
+  i integer;
+  available double precision;
+  wait double precision := 0;
+  worst integer;
+BEGIN
+  FOR i IN SELECT u.ord::integer FROM unnest(p_keys) WITH ORDINALITY AS u(k, ord) ORDER BY u.k LOOP
+    INSERT INTO rate_limit_buckets AS b (bucket_key, tokens, updated_at)
+    VALUES (p_keys[i], p_capacities[i], ts)
+    ON CONFLICT (bucket_key) DO UPDATE
+      SET tokens = LEAST(p_capacities[i], b.tokens + GREATEST(EXTRACT(EPOCH FROM ts - b.updated_at), 0) * p_rates[i]),
+          updated_at = ts
+    RETURNING b.tokens INTO available;
+
+    IF available < p_cost AND (p_cost - available) / p_rates[i] > wait THEN
+      wait := (p_cost - available) / p_rates[i];
+      worst := i;
+    END IF;
+  END LOOP;
+
+  IF worst IS NOT NULL THEN
+    RETURN QUERY SELECT false, wait, worst;
+    RETURN;
+  END IF;
+  UPDATE rate_limit_buckets SET tokens = tokens - p_cost WHERE bucket_key = ANY(p_keys);
+  RETURN QUERY SELECT true, 0::double precision, NULL::integer;
+END;
+$$;
+
+-- Superseded: the API takes all of a request's buckets at once
+DROP FUNCTION IF EXISTS rate_limit_take(text, double precision, double precision, double precision);
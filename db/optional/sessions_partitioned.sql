@@ -0,0 +1,93 @@
+-- OPTIONAL: convert `sessions` to a table range-partitioned by expires_at month.
+--
+-- Not applied by apply-migrations.ps1. Run once, after all migrations, during a quiet period:
+-- only live sessions are copied, and the table is locked for the duration of the copy.
+-- Afterwards the worker's session maintenance drops whole expired partitions instead of
+-- deleting rows, and keeps partitions created ahead of time.
+
+BEGIN;
+
+LOCK TABLE sessions IN ACCESS EXCLUSIVE MODE;
+
+ALTER TABLE sessions RENAME TO sessions_unpartitioned;
+ALTER TABLE sessions_unpartitioned RENAME CONSTRAINT sessions_pkey TO sessions_unpartitioned_pkey;
+ALTER INDEX idx_sessions_user_expires RENAME TO idx_sessions_unpartitioned_user_expires;
+ALTER INDEX idx_sessions_expires_at RENAME TO idx_sessions_unpartitioned_expires_at;
+ALTER INDEX idx_sessions_revoked_at RENAME TO idx_sessions_unpartitioned_revoked_at;
+
+-- The partition key must be part of the primary key; lookups by id still use its leading column
+CREATE TABLE sessions (
+  LIKE sessions_unpartitioned INCLUDING DEFAULTS,
+  PRIMARY KEY (id, expires_at),
+  FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+) PARTITION BY RANGE (expires_at);
+
+CREATE INDEX idx_sessions_user_expires ON sessions(user_id, expires_at DESC);
+CREATE INDEX idx_sessions_expires_at ON sessions(expires_at);
+CREATE INDEX idx_sessions_revoked_at ON sessions(revoked_at) WHERE revoked_at IS NOT NULL;
+
+-- Catches rows outside every monthly partition (e.g. when partitioning ahead falls behind),
+-- so session inserts never fail for lack of a partition; the batched purge cleans it up
+CREATE TABLE sessions_default PARTITION OF sessions DEFAULT;
+
+-- Monthly partitions named sessions_pYYYYMM, from the current month through months_ahead.
+-- Rows that already landed in the default partition for that month are moved into the new
+-- partition before it is attached, which would otherwise fail.
+CREATE OR REPLACE FUNCTION create_session_partitions(months_ahead int DEFAULT 2)
+RETURNS void LANGUAGE plpgsql AS $$
+DECLARE
+  m date;
+  part text;
+BEGIN
+  FOR i IN 0..months_ahead LOOP
+    m := (date_trunc('month', now()) + make_interval(months => i))::date;
+    part := 'sessions_p' || to_char(m, 'YYYYMM');
+    IF to_regclass(part) IS NULL THEN
+      EXECUTE format('CREATE TABLE %I (LIKE sessions INCLUDING DEFAULTS)', part);
+      EXECUTE format(
+        'WITH moved AS (DELETE FROM sessions_default WHERE expires_at >= %L AND expires_at < %L RETURNING *) '
+        'INSERT INTO %I SELECT * FROM moved',
+        m, (m + interval '1 month')::date, part
+      );
+      EXECUTE format(
+        'ALTER TABLE sessions ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+        part, m, (m + interval '1 month')::date
+      );
+    END IF;
+  END LOOP;
+END;
+$$;
+
+-- Drop partitions whose whole range expired before cutoff; returns the number of rows removed
+CREATE OR REPLACE FUNCTION drop_expired_session_partitions(cutoff timestamptz)
+RETURNS bigint LANGUAGE plpgsql AS $$
+DECLARE
+  r record;
+  n bigint;
+  removed bigint := 0;
+BEGIN
+  FOR r IN
+    SELECT c.relname
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = 'sessions'::regclass
+      AND c.relname ~ '^sessions_p[0-9]{6}$'
+      AND to_date(substring(c.relname FROM 11), 'YYYYMM') + interval '1 month' <= cutoff
+  LOOP
+    EXECUTE format('SELECT count(*) FROM %I', r.relname) INTO n;
+    EXECUTE format('DROP TABLE %I', r.relname);
+    removed := removed + n;
+  END LOOP;
+  RETURN removed;
+END;
+$$;
+
+SELECT create_session_partitions(2);
+
+INSERT INTO sessions
+SELECT * FROM sessions_unpartitioned
+WHERE revoked_at IS NULL AND expires_at > now();
+
+DROP TABLE sessions_unpartitioned;
+
+COMMIT;
@@ -2,6 +2,8 @@ import asyncio
 import io
 import os
 import re
+import sys
+import time
 from datetime import datetime, timezone, date
 
 import pytesseract
@@ -11,10 +13,18 @@ from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, Asyn
 from prometheus_client import Counter, Histogram, start_http_server
 
 from app.config import settings
-from app.utils.storage import download_bytes, upload_bytes, delete_prefix
+from app.utils.storage import download_bytes_async, upload_bytes_async, delete_prefix_async
 from app.utils.categorize import determine_category
+from app.utils.receipt_images import derivative_key, render_derivatives
 from app.utils.receipt_parser import parse_receipt
 from app.utils.badges import check_and_award_badges
+from app.utils.recategorize import recategorize_for_rule
+from app.utils.principals import invalidate_principal, listen_for_invalidations
+from app.utils.session_maintenance import purge_sessions
+from app.utils.ratelimit import purge_stale_buckets
+from app.utils.logger import configure_logging, log, reset_request_id, set_request_id
+from app.utils.tracing import configure_tracing, record_span, span, start_trace
+from app.utils.profiling import install_profile_signal, monitor_event_loop
 
 
 engine = create_async_engine(settings.database_url, echo=False, pool_pre_ping=True)
@@ -23,6 +33,7 @@ SessionLocal = async_sessionmaker(engine, expire_on_commit=False, class_=AsyncSe
 
 JOBS_PROCESSED = Counter("worker_jobs_total", "Total jobs processed", ["kind", "status"]) 
 JOB_LATENCY = Histogram("worker_job_latency_seconds", "Job processing latency", ["kind"]) 
+SESSIONS_PURGED = Counter("sessions_purged_total", "Expired or revoked sessions removed", ["method"])
 
 
 async def fetch_pending_job(db: AsyncSession):
@@ -30,7 +41,8 @@ async def fetch_pending_job(db: AsyncSession):
     res = await db.execute(
         text(
             """
-            SELECT 'receipt' as kind, j.id, r.id as receipt_id, r.user_id, r.storage_uri
+            SELECT 'receipt' as kind, j.id, j.request_id, j.traceparent, j.created_at AS enqueued_at,
+                   r.id as receipt_id, r.user_id, r.storage_uri
             FROM receipt_processing_jobs j
             JOIN receipts r ON r.id = j.receipt_id
             WHERE j.status = 'pending'
@@ -46,7 +58,8 @@ async def fetch_pending_job(db: AsyncSession):
     res = await db.execute(
         text(
             """
-            SELECT 'export' as kind, e.id, e.user_id, e.from_date, e.to_date
+            SELECT 'export' as kind, e.id, e.request_id, e.traceparent, e.created_at AS enqueued_at,
+                   e.user_id, e.from_date, e.to_date
             FROM export_jobs e
             WHERE e.status = 'pending'
             ORDER BY e.created_at ASC
@@ -61,7 +74,7 @@ async def fetch_pending_job(db: AsyncSession):
     res = await db.execute(
         text(
             """
-            SELECT 'deletion' as kind, d.id, d.user_id
+            SELECT 'deletion' as kind, d.id, d.request_id, d.user_id
             FROM deletion_jobs d
             WHERE d.status = 'scheduled'
             ORDER BY d.requested_at ASC
@@ -70,23 +83,58 @@ async def fetch_pending_job(db: AsyncSession):
         )
     )
     row = res.mappings().first()
+    if row:
+        return dict(row)
+    # Then recategorization job
+    res = await db.execute(
+        text(
+            """
+            SELECT 'recategorization' as kind, c.id, c.request_id, c.rule_kind::text as rule_kind, c.rule_id
+            FROM recategorization_jobs c
+            WHERE c.status = 'pending'
+            ORDER BY c.created_at ASC
+            LIMIT 1
+            """
+        )
+    )
+    row = res.mappings().first()
     return dict(row) if row else None
 
 
 
 
+async def store_derivatives(user_id, receipt_id, img) -> dict:
+    """Render and upload the WebP thumbnail and display copy; best-effort, a failure leaves them NULL."""
+    try:
+        rendered = await asyncio.to_thread(render_derivatives, img)
+        keys = {name: derivative_key(user_id, receipt_id, name) for name in rendered}
+        await asyncio.gather(*(upload_bytes_async(keys[name], data, content_type="image/webp") for name, data in rendered.items()))
+        return keys
+    except Exception as e:
+        log.warning("receipt derivatives failed", receipt_id=str(receipt_id), error=str(e))
+        return {}
+
+
 async def process_receipt_job(db: AsyncSession, job: dict):
     import time
     start = time.time()
     await db.execute(text("UPDATE receipt_processing_jobs SET status='processing', started_at=now() WHERE id=:id"), {"id": job["id"]})
     await db.commit()
     try:
-        data = download_bytes(job["storage_uri"])  # object_key
-        img = Image.open(io.BytesIO(data))
-        text_blob = pytesseract.image_to_string(img)
+        with span("download") as sp:
+            data = await download_bytes_async(job["storage_uri"])  # object_key
+            sp.set("bytes", len(data))
+        with span("preprocess"):
+            img = Image.open(io.BytesIO(data))
+        with span("ocr"):
+            text_blob = pytesseract.image_to_string(img)
         
         # Parse receipt using enhanced parser
-        parsed = parse_receipt(text_blob)
+        with span("parse"):
+            parsed = parse_receipt(text_blob)
+        # Small WebP copies for the app, which then never downloads the original to display it
+        with span("derivatives"):
+            derivatives = await store_derivatives(job["user_id"], job["receipt_id"], img)
         
         # Use parsed data or fallbacks
         merchant = parsed.get("merchant")
@@ -101,61 +149,69 @@ async def process_receipt_job(db: AsyncSession, job: dict):
             txn_date = date.today()
         
         await db.execute(
-            text("UPDATE receipts SET ocr_status='done', processed_at=now() WHERE id=:rid"),
-            {"rid": job["receipt_id"]},
+            text(
+                """
+                UPDATE receipts SET ocr_status='done', processed_at=now(), thumbnail_uri=:thumb, display_uri=:display
+                WHERE id=:rid
+                """
+            ),
+            {"rid": job["receipt_id"], "thumb": derivatives.get("thumb"), "display": derivatives.get("display")},
         )
 
         if total_cents > 0:
             # Determine category using merchant and OCR text
-            category = await determine_category(db, merchant=merchant, raw_text=text_blob)
+            with span("categorize"):
+                category = await determine_category(db, merchant=merchant, raw_text=text_blob, user_id=job["user_id"])
             
             # Insert transaction
-            txn_result = await db.execute(
-                text(
-                    """
-                    INSERT INTO transactions(user_id, receipt_id, merchant, txn_date, total_cents, tax_cents, tip_cents, currency_code, category, source, raw_text)
-                    VALUES (:uid, :rid, :merchant, :txn_date, :total, :tax, :tip, 'USD', :category, 'receipt', :raw)
-                    RETURNING id
-                    """
-                ),
-                {
-                    "uid": job["user_id"],
-                    "rid": job["receipt_id"],
-                    "merchant": merchant,
-                    "txn_date": txn_date,
-                    "total": total_cents,
-                    "tax": tax_cents,
-                    "tip": tip_cents,
-                    "category": category,
-                    "raw": {"ocr": text_blob, "parsed": parsed},
-                },
-            )
-            txn_id = txn_result.scalar_one()
+            with span("insert", line_items=len(line_items)):
+                txn_result = await db.execute(
+                    text(
+                        """
+                        INSERT INTO transactions(user_id, receipt_id, merchant, txn_date, total_cents, tax_cents, tip_cents, currency_code, category, source, raw_text)
+                        VALUES (:uid, :rid, :merchant, :txn_date, :total, :tax, :tip, 'USD', :category, 'receipt', :raw)
+                        RETURNING id
+                        """
+                    ),
+                    {
+                        "uid": job["user_id"],
+                        "rid": job["receipt_id"],
+                        "merchant": merchant,
+                        "txn_date": txn_date,
+                        "total": total_cents,
+                        "tax": tax_cents,
+                        "tip": tip_cents,
+                        "category": category,
+                        "raw": {"ocr": text_blob, "parsed": parsed},
+                    },
+                )
+                txn_id = txn_result.scalar_one()
             
-            # Insert line items if any
-            if line_items:
-                for idx, item in enumerate(line_items):
-                    await db.execute(
-                        text(
-                            """
-                            INSERT INTO transaction_items(transaction_id, line_index, description, quantity, unit_price_cents, total_cents, category)
-                            VALUES (:txn_id, :idx, :desc, :qty, :unit_price, :total, :cat)
-                            """
-                        ),
-                        {
-                            "txn_id": txn_id,
-                            "idx": idx,
-                            "desc": item.get("description"),
-                            "qty": item.get("quantity"),
-                            "unit_price": item.get("unit_price_cents"),
-                            "total": item.get("total_cents"),
-                            "cat": category,  # Use transaction category for items
-                        },
-                    )
+                # Insert line items if any
+                if line_items:
+                    for idx, item in enumerate(line_items):
+                        await db.execute(
+                            text(
+                                """
+                                INSERT INTO transaction_items(transaction_id, line_index, description, quantity, unit_price_cents, total_cents, category)
+                                VALUES (:txn_id, :idx, :desc, :qty, :unit_price, :total, :cat)
+                                """
+                            ),
+                            {
+                                "txn_id": txn_id,
+                                "idx": idx,
+                                "desc": item.get("description"),
+                                "qty": item.get("quantity"),
+                                "unit_price": item.get("unit_price_cents"),
+                                "total": item.get("total_cents"),
+                                "cat": category,  # Use transaction category for items
+                            },
+                        )
             
             # Award badges after successful transaction creation
-            await check_and_award_badges(db, job["user_id"], "transaction_created")
-            await check_and_award_badges(db, job["user_id"], "receipt_uploaded")
+            with span("badges"):
+                await check_and_award_badges(db, job["user_id"], "transaction_created")
+                await check_and_award_badges(db, job["user_id"], "receipt_uploaded")
 
         await db.execute(
             text("UPDATE receipt_processing_jobs SET status='done', completed_at=now() WHERE id=:id"),
@@ -170,6 +226,7 @@ async def process_receipt_job(db: AsyncSession, job: dict):
         )
         await db.commit()
         JOBS_PROCESSED.labels(kind="receipt", status="failed").inc()
+        log.exception("job failed", e, kind="receipt", job_id=str(job["id"]))
     finally:
         JOB_LATENCY.labels(kind="receipt").observe(time.time() - start)
 
@@ -180,31 +237,35 @@ async def process_export_job(db: AsyncSession, job: dict):
     await db.execute(text("UPDATE export_jobs SET status='processing' WHERE id=:id"), {"id": job["id"]})
     await db.commit()
     try:
-        rows = await db.execute(
-            text(
-                """
-                SELECT txn_date, merchant, total_cents, tax_cents, tip_cents, currency_code, category, subcategory
-                FROM transactions
-                WHERE user_id = :uid AND txn_date BETWEEN :fd AND :td
-                ORDER BY txn_date
-                """
-            ),
-            {"uid": job["user_id"], "fd": job["from_date"], "td": job["to_date"]},
-        )
-        items = rows.mappings().all()
+        with span("query") as sp:
+            rows = await db.execute(
+                text(
+                    """
+                    SELECT txn_date, merchant, total_cents, tax_cents, tip_cents, currency_code, category, subcategory
+                    FROM transactions
+                    WHERE user_id = :uid AND txn_date BETWEEN :fd AND :td
+                    ORDER BY txn_date
+                    """
+                ),
+                {"uid": job["user_id"], "fd": job["from_date"], "td": job["to_date"]},
+            )
+            items = rows.mappings().all()
+            sp.set("rows", len(items))
         # Build CSV
         import csv
 
-        output = io.StringIO()
-        writer = csv.writer(output)
-        writer.writerow(["date", "merchant", "total_cents", "tax_cents", "tip_cents", "currency_code", "category", "subcategory"])
-        for r in items:
-            writer.writerow([
-                r["txn_date"], r["merchant"], r["total_cents"], r["tax_cents"], r["tip_cents"], r["currency_code"], r["category"], r["subcategory"],
-            ])
-        data = output.getvalue().encode("utf-8")
+        with span("render"):
+            output = io.StringIO()
+            writer = csv.writer(output)
+            writer.writerow(["date", "merchant", "total_cents", "tax_cents", "tip_cents", "currency_code", "category", "subcategory"])
+            for r in items:
+                writer.writerow([
+                    r["txn_date"], r["merchant"], r["total_cents"], r["tax_cents"], r["tip_cents"], r["currency_code"], r["category"], r["subcategory"],
+                ])
+            data = output.getvalue().encode("utf-8")
         object_key = f"exports/{job['user_id']}/{job['id']}.csv"
-        upload_bytes(object_key, data, content_type="text/csv")
+        with span("upload", bytes=len(data)):
+            await upload_bytes_async(object_key, data, content_type="text/csv")
         await db.execute(text("UPDATE export_jobs SET status='done', storage_uri=:uri, completed_at=now() WHERE id=:id"), {"id": job["id"], "uri": object_key})
         await db.commit()
         JOBS_PROCESSED.labels(kind="export", status="done").inc()
@@ -212,6 +273,7 @@ async def process_export_job(db: AsyncSession, job: dict):
         await db.execute(text("UPDATE export_jobs SET status='failed', failure_reason=:err WHERE id=:id"), {"id": job["id"], "err": str(e)})
         await db.commit()
         JOBS_PROCESSED.labels(kind="export", status="failed").inc()
+        log.exception("job failed", e, kind="export", job_id=str(job["id"]))
     finally:
         JOB_LATENCY.labels(kind="export").observe(time.time() - start)
 
@@ -238,41 +300,129 @@ async def process_deletion_job(db: AsyncSession, job: dict):
         await db.execute(text("DELETE FROM account_balances USING linked_accounts la WHERE account_balances.linked_account_id = la.id AND la.user_id=:uid"), {"uid": uid})
         # Remove S3 assets for the user (best-effort)
         try:
-            delete_prefix(f"receipts/{uid}/")
-            delete_prefix(f"exports/{uid}/")
+            await delete_prefix_async(f"receipts/{uid}/")
+            await delete_prefix_async(f"exports/{uid}/")
         except Exception:
             pass
 
         await db.execute(text("DELETE FROM deletion_jobs WHERE id=:id"), {"id": job["id"]})
         await db.execute(text("UPDATE users SET deleted_at=now() WHERE id=:uid"), {"uid": uid})
+        # API processes may still hold this user's sessions in their principal caches
+        await invalidate_principal(db, user_id=uid)
         await db.commit()
     except Exception as e:
         await db.execute(text("UPDATE deletion_jobs SET status='failed', error=:err WHERE id=:id"), {"id": job["id"], "err": str(e)})
         await db.commit()
         JOBS_PROCESSED.labels(kind="deletion", status="failed").inc()
+        log.exception("job failed", e, kind="deletion", job_id=str(job["id"]))
     finally:
         JOB_LATENCY.labels(kind="deletion").observe(time.time() - start)
 
 
+async def process_recategorization_job(db: AsyncSession, job: dict):
+    import time
+    start = time.time()
+    await db.execute(text("UPDATE recategorization_jobs SET status='processing', started_at=now() WHERE id=:id"), {"id": job["id"]})
+    await db.commit()
+    try:
+        scanned, updated = await recategorize_for_rule(db, job["rule_kind"], job["rule_id"])
+        await db.execute(
+            text(
+                "UPDATE recategorization_jobs SET status='done', scanned_count=:scanned, updated_count=:updated, completed_at=now() WHERE id=:id"
+            ),
+            {"id": job["id"], "scanned": scanned, "updated": updated},
+        )
+        await db.commit()
+        JOBS_PROCESSED.labels(kind="recategorization", status="done").inc()
+    except Exception as e:
+        await db.rollback()
+        await db.execute(
+            text("UPDATE recategorization_jobs SET status='failed', last_error=:err, attempts=attempts+1 WHERE id=:id"),
+            {"id": job["id"], "err": str(e)},
+        )
+        await db.commit()
+        JOBS_PROCESSED.labels(kind="recategorization", status="failed").inc()
+        log.exception("job failed", e, kind="recategorization", job_id=str(job["id"]))
+    finally:
+        JOB_LATENCY.labels(kind="recategorization").observe(time.time() - start)
+
+
+async def run_session_maintenance(db: AsyncSession):
+    import time
+    start = time.time()
+    try:
+        removed = await purge_sessions(db)
+        for method, count in removed.items():
+            SESSIONS_PURGED.labels(method=method).inc(count)
+        if settings.rate_limit_backend == "postgres":
+            await purge_stale_buckets(db)
+        JOBS_PROCESSED.labels(kind="session_maintenance", status="done").inc()
+    except Exception as e:
+        await db.rollback()
+        JOBS_PROCESSED.labels(kind="session_maintenance", status="failed").inc()
+        log.exception("session maintenance failed", e)
+    finally:
+        JOB_LATENCY.labels(kind="session_maintenance").observe(time.time() - start)
+
+
 async def worker_loop():
+    loop = asyncio.get_running_loop()
+    next_maintenance = loop.time()
     async with SessionLocal() as db:
         while True:
+            if loop.time() >= next_maintenance:
+                await run_session_maintenance(db)
+                next_maintenance = loop.time() + settings.session_purge_interval_seconds
             job = await fetch_pending_job(db)
             if not job:
                 await asyncio.sleep(2)
                 continue
-            if job["kind"] == "receipt":
-                await process_receipt_job(db, job)
-            elif job["kind"] == "export":
-                await process_export_job(db, job)
-            elif job["kind"] == "deletion":
-                await process_deletion_job(db, job)
+            # Log under the id of the API request that enqueued the job, and continue its trace
+            token = set_request_id(job.get("request_id"))
+            started = loop.time()
+            trace = start_trace(f"job.{job['kind']}", job.get("traceparent"), job_id=str(job["id"]))
+            trace.__enter__()
+            try:
+                enqueued_at = job.get("enqueued_at")
+                if enqueued_at is not None:
+                    record_span("queue.wait", int(enqueued_at.timestamp() * 1e9), time.time_ns())
+                if job["kind"] == "receipt":
+                    await process_receipt_job(db, job)
+                elif job["kind"] == "export":
+                    await process_export_job(db, job)
+                elif job["kind"] == "deletion":
+                    await process_deletion_job(db, job)
+                elif job["kind"] == "recategorization":
+                    await process_recategorization_job(db, job)
+                log.info("job finished", kind=job["kind"], job_id=str(job["id"]), duration_ms=int((loop.time() - started) * 1000))
+            finally:
+                trace.__exit__(*sys.exc_info())
+                reset_request_id(token)
+
+
+async def run():
+    # OCR and CSV work run inline on this loop (S3 calls go to the storage executor); the monitor
+    # reports when they stall it
+    stop = asyncio.Event()
+    background = [
+        asyncio.create_task(monitor_event_loop(stop)),
+        # Rule writes and user corrections evict the categorization caches in every process
+        asyncio.create_task(listen_for_invalidations(stop)),
+    ]
+    try:
+        await worker_loop()
+    finally:
+        stop.set()
+        await asyncio.gather(*background, return_exceptions=True)
 
 
 def main():
+    configure_logging()
+    configure_tracing()
+    install_profile_signal()
     # Expose Prometheus metrics on :9100
     start_http_server(9100)
-    asyncio.run(worker_loop())
+    asyncio.run(run())
 
 
 if __name__ == "__main__":